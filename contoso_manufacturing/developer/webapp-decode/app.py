@@ -1,5 +1,7 @@
 from flask import Flask, render_template, Response, request
+import atexit
 import os
+import threading
 import cv2
 import json
 import numpy as np
@@ -7,13 +9,49 @@ from yolov8 import YOLOv8OVMS
 from welding import WeldPorosity
 from pose_estimator import PoseEstimator
 from bolt_detection import BoltDetection
+from pipeline import DetectorPipeline
+from broadcast import BroadcastHub
+from detector_pool import DetectorPool
+from batching import BatchScheduler
+from backends import make_backend
+from frame_skipping import AdaptiveSkipScheduler
+from metrics import format_prometheus
+from events import EventBus, make_event_sinks
+from motion_gate import MotionGate
+from tiling import TileLayout
+from fmp4 import FMP4Encoder
 
 app = Flask(__name__)
 
-latest_choice_detector = None # Global variable to keep track of the latest choice of the user
 ovms_url = os.environ.get('OVMS_URL', '')
 influx_iframe_url = os.environ.get('INFLUX_URL', '')
 adx_iframe_url = os.environ.get('ADX_URL', '')
+warm_pool_size = int(os.environ.get('WARM_POOL_SIZE', '3'))
+warm_pool_memory_mb = float(os.environ.get('WARM_POOL_MEMORY_MB', '0'))
+raw_stream_fps = float(os.environ.get('RAW_STREAM_FPS', '5'))
+raw_stream_width = int(os.environ.get('RAW_STREAM_WIDTH', '640'))
+raw_stream_quality = int(os.environ.get('RAW_STREAM_QUALITY', '70'))
+fmp4_bitrate = os.environ.get('FMP4_BITRATE', '2M')
+fmp4_fps = float(os.environ.get('FMP4_FPS', '15'))
+fmp4_gop_seconds = float(os.environ.get('FMP4_GOP_SECONDS', '2'))
+fmp4_width = int(os.environ.get('FMP4_WIDTH', '0'))
+ffmpeg_path = os.environ.get('FFMPEG_PATH', 'ffmpeg')
+preload_videos = [name for name in os.environ.get('PRELOAD_VIDEOS', '').split(',') if name]
+batch_schedulers = {} # Shared BatchScheduler and the batching configuration it was created with per model with a "batching" configuration
+shared_lock = threading.RLock() # Guards the shared backends and batch schedulers, as pipelines are created concurrently
+backends = {} # Shared inference backend and the backend configuration it was created with per model, e.g. one compiled OpenVINO model for every camera
+
+# Structured per-frame results of the detectors, written in batches to a JSON Lines file and/or MQTT
+event_bus = EventBus()
+for sink in make_event_sinks(
+    jsonl_path=os.environ.get('EVENTS_JSONL_PATH', ''),
+    mqtt_url=os.environ.get('EVENTS_MQTT_URL', ''),
+    mqtt_topic=os.environ.get('EVENTS_MQTT_TOPIC', 'contoso/defects'),
+    max_batch_size=int(os.environ.get('EVENTS_BATCH_SIZE', '100')),
+    max_interval=float(os.environ.get('EVENTS_FLUSH_INTERVAL', '1.0'))
+):
+    event_bus.subscribe(sink)
+atexit.register(event_bus.close)
 
 def reload_config():
     """
@@ -26,17 +64,122 @@ def reload_config():
     with open('./config/config_file.json') as config_file:
         return json.load(config_file)
 
-def init_yolo_detector():
+def get_rtsp_url(model_config, camera=None):
+    """
+    Returns the RTSP URL of a camera of a model.
+
+    Args:
+        model_config (dict): The configuration of the model.
+        camera (str): The name of the camera in the "cameras" configuration, or None for the default "rtsp_url".
+
+    Returns:
+        str: The RTSP URL.
+
+    Raises:
+        KeyError: If the camera is not configured.
+    """
+    if camera is None:
+        return model_config['rtsp_url']
+    return model_config['cameras'][camera]
+
+def get_backend(model_name):
+    """
+    Returns the inference backend shared by every pipeline of a model, creating it on first use.
+
+    The backend is recreated when the "backend" configuration of the model changed, e.g. its type,
+    model path or device. The pipelines created before keep the previous backend until they are
+    stopped, and it is released with the last of them.
+
+    Args:
+        model_name (str): The name of the model.
+
+    Returns:
+        OVMSBackend or OpenVINOBackend: The backend selected by the "backend" configuration of the model.
+    """
+    with shared_lock:
+        backend_config = config[model_name].get('backend') or {}
+        cached = backends.get(model_name)
+        if cached is None or cached[0] != backend_config:
+            if cached is not None:
+                print(f"Backend configuration of {model_name} changed, recreating its backend")
+            backends[model_name] = (dict(backend_config), make_backend(model_name, config[model_name], ovms_url))
+        return backends[model_name][1]
+
+def get_batch_scheduler(model_name):
+    """
+    Returns the batch scheduler shared by every camera of a model, creating it on first use.
+
+    The scheduler is recreated when the batching configuration or the backend of the model changed,
+    and closed when batching was removed from the configuration. The pipelines still using a closed
+    scheduler send their frames without batching until they are recreated.
+
+    Args:
+        model_name (str): The name of the model.
+
+    Returns:
+        BatchScheduler: The shared scheduler, or None if batching is not configured for the model.
+    """
+    with shared_lock:
+        batching_config = config[model_name].get('batching')
+        cached = batch_schedulers.get(model_name)
+        if batching_config is None:
+            if cached is not None:
+                del batch_schedulers[model_name]
+                cached[1].close()
+            return None
+
+        predict = get_backend(model_name).predict
+        if cached is None or cached[0] != batching_config or cached[1].predict_batch != predict:
+            if cached is not None:
+                print(f"Batching or backend configuration of {model_name} changed, recreating its batch scheduler")
+                cached[1].close()
+            batch_schedulers[model_name] = (dict(batching_config), BatchScheduler(
+                predict=predict,
+                input_name="images",
+                max_batch_size=batching_config.get('max_batch_size', 8),
+                max_wait_ms=batching_config.get('max_wait_ms', 10),
+                name=model_name
+            ))
+        return batch_schedulers[model_name][1]
+
+def get_tile_layout(model_config, camera=None):
+    """
+    Returns the region of interest and tiling of a camera of a model.
+
+    Args:
+        model_config (dict): The configuration of the model.
+        camera (str): The name of the camera in the "cameras" configuration, or None for the default "rtsp_url".
+
+    Returns:
+        TileLayout: The layout, or None if neither a region of interest nor tiling is configured.
+    """
+    roi = model_config.get('roi') if camera is None else model_config.get('camera_rois', {}).get(camera)
+    tiling_config = model_config.get('tiling')
+    if roi is None and tiling_config is None:
+        return None
+    tiling_config = tiling_config or {}
+    return TileLayout(
+        roi=roi,
+        rows=tiling_config.get('rows', 1),
+        columns=tiling_config.get('columns', 1),
+        overlap=tiling_config.get('overlap', 0.0),
+        full_frame=tiling_config.get('full_frame', False)
+    )
+
+def init_yolo_detector(camera=None):
     """
     Initializes and returns a YOLOv8OVMS object for object detection.
 
+    Args:
+        camera (str): The name of the camera in the "cameras" configuration, or None for the default "rtsp_url".
+
     Returns:
         YOLOv8OVMS: The initialized YOLOv8OVMS object.
     """
     model_config = config["yolov8n"]
     color_palette = np.random.uniform(0, 255, size=(len(model_config['class_names']), 3))
     return YOLOv8OVMS(
-        rtsp_url=model_config['rtsp_url'],
+        rtsp_url=get_rtsp_url(model_config, camera),
         class_names=model_config['class_names'],
         input_shape=model_config['input_shape'],
         color_palette=color_palette,
@@ -46,13 +189,20 @@ def init_yolo_detector():
         ovms_url=ovms_url, 
         save_img_loc=False,
         verbose=False,
-        skip_rate=10
+        skip_rate=10,
+        batch_scheduler=get_batch_scheduler("yolov8n"),
+        capture_options=model_config.get('capture'),
+        backend=get_backend("yolov8n"),
+        tile_layout=get_tile_layout(model_config, camera)
     )
 
-def init_yolo_safety_detector():
+def init_yolo_safety_detector(camera=None):
     """
     Initializes and returns a YOLOv8OVMS object for safety detection.
 
+    Args:
+        camera (str): The name of the camera in the "cameras" configuration, or None for the default "rtsp_url".
+
     Returns:
         YOLOv8OVMS: The initialized YOLOv8OVMS object.
 
@@ -62,7 +212,7 @@ def init_yolo_safety_detector():
     model_config = config["safety-yolo8"]
     color_palette = np.random.uniform(0, 255, size=(len(model_config['class_names']), 3))
     return YOLOv8OVMS(
-        rtsp_url=model_config['rtsp_url'],
+        rtsp_url=get_rtsp_url(model_config, camera),
         class_names=model_config['class_names'],
         input_shape=model_config['input_shape'],
         color_palette=color_palette,
@@ -72,7 +222,11 @@ def init_yolo_safety_detector():
         ovms_url=ovms_url, 
         save_img_loc=False,
         verbose=False,
-        skip_rate=2
+        skip_rate=2,
+        batch_scheduler=get_batch_scheduler("safety-yolo8"),
+        capture_options=model_config.get('capture'),
+        backend=get_backend("safety-yolo8"),
+        tile_layout=get_tile_layout(model_config, camera)
     )
 
 def init_welding_detector():
@@ -92,7 +246,9 @@ def init_welding_detector():
         model_name="weld-porosity-detection", 
         ovms_url=ovms_url, 
         verbose=False,
-        skip_rate=10
+        skip_rate=10,
+        capture_options=model_config.get('capture'),
+        backend=get_backend("weld-porosity-detection")
     )
 
 def init_pose_estimator():
@@ -113,7 +269,12 @@ def init_pose_estimator():
         ovms_url=ovms_url,
         skip_rate=2,
         default_skeleton=model_config['default_skeleton'],
-        colors=model_config['colors']
+        colors=model_config['colors'],
+        capture_options=model_config.get('capture'),
+        backend=get_backend("human-pose-estimation"),
+        nms_kernel=model_config.get('nms_kernel', 3),
+        keyframe_interval=model_config.get('keyframe_interval', 1),
+        min_tracking_confidence=model_config.get('min_tracking_confidence', 0.5)
     )
 
 def init_bolt_detector():
@@ -132,7 +293,9 @@ def init_bolt_detector():
         model_name="bolt-detection", 
         ovms_url=ovms_url, 
         verbose=False,
-        skip_rate=10
+        skip_rate=10,
+        capture_options=model_config.get('capture'),
+        backend=get_backend("bolt-detection")
     )
 
 @app.route('/show_iframe')
@@ -141,12 +304,81 @@ def show_iframe():
     url = request.args.get('url', 'https://google.com')
     return render_template('index.html', iframe_url=url)
 
-def gen_frames(video_name): 
+def create_pipeline(video_key):
+    """
+    Creates the detector for a video and its pipeline.
+
+    Args:
+        video_key (str): The name of the video, optionally followed by "@" and the name of a camera.
+
+    Returns:
+        DetectorPipeline: The pipeline, not started yet, or None if the video name or camera is unknown.
+    """
+    global config
+
+    # Reload configuration for changes with GitOps
+    config = reload_config()
+
+    video_name, _, camera = video_key.partition('@')
+    camera = camera or None
+
+    detector = None
+    try:
+        if video_name == "yolov8n":
+            detector = init_yolo_detector(camera)
+        elif video_name == "safety-yolo8":
+            detector = init_yolo_safety_detector(camera)
+        elif camera is not None:
+            # Only the YOLOv8 models support several cameras
+            detector = None
+        elif video_name == "welding":
+            detector = init_bolt_detector()
+        elif video_name == "human-pose-estimation":
+            detector = init_pose_estimator()
+    except KeyError:
+        print(f"Camera {camera} is not configured for {video_name}")
+        return None
+
+    if detector is None:
+        return None
+
+    # Number of predict calls kept in flight against OVMS for this model
+    model_config = config.get(detector.model_name, {})
+    max_in_flight = model_config.get('max_in_flight', 1)
+
+    # Replace the fixed skip_rate by adaptive skipping when the model has a target FPS or latency
+    skip_scheduler = None
+    if model_config.get('target_fps') or model_config.get('target_latency_ms'):
+        skip_scheduler = AdaptiveSkipScheduler(
+            target_fps=model_config.get('target_fps', 0),
+            target_latency_ms=model_config.get('target_latency_ms', 0),
+            max_in_flight=max_in_flight
+        )
+
+    # Reuse the last result instead of running inference while the scene does not change
+    motion_gate = None
+    motion_gate_config = model_config.get('motion_gate')
+    if motion_gate_config is not None:
+        motion_gate = MotionGate(
+            threshold=motion_gate_config.get('threshold', 0.01),
+            pixel_threshold=motion_gate_config.get('pixel_threshold', 12),
+            width=motion_gate_config.get('width', 64),
+            max_static_frames=motion_gate_config.get('max_static_frames', 30)
+        )
+    return DetectorPipeline(detector, max_in_flight=max_in_flight, skip_scheduler=skip_scheduler, event_bus=event_bus, motion_gate=motion_gate,
+                            raw_fps=raw_stream_fps, raw_width=raw_stream_width, raw_quality=raw_stream_quality,
+                            fmp4_encoder=FMP4Encoder(bitrate=fmp4_bitrate, fps=fmp4_fps, gop_seconds=fmp4_gop_seconds, width=fmp4_width, ffmpeg=ffmpeg_path))
+
+pool = DetectorPool(create_pipeline, max_detectors=warm_pool_size, max_memory_mb=warm_pool_memory_mb) # Keeps recently used pipelines warm
+hub = BroadcastHub(pool) # Runs one pipeline per model being watched and shares its frames with every viewer
+
+def gen_frames(video_name, camera=None): 
     """
     Generate frames from a video stream.
 
     Args:
         video_name (str): The name of the video.
+        camera (str): The name of the camera, or None for the default camera of the model.
 
     Yields:
         bytes: The processed frame in JPEG format.
@@ -154,41 +386,64 @@ def gen_frames(video_name):
     Returns:
         None
     """
-    global latest_choice_detector  
+    video_key = video_name if camera is None else f"{video_name}@{camera}"
+    for frame in hub.frames(video_key):
+        yield (b'--frame\r\n'
+            b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
 
-    # Add a check in case of failed intit model
-    if 'latest_choice_detector' not in locals() and 'latest_choice_detector' not in globals():
-        latest_choice_detector = None
+def gen_fmp4(video_name, camera=None):
+    """
+    Generate the annotated video stream as H.264 fragmented MP4.
 
-    # Check if the video name is different from the current model name
-    if(latest_choice_detector is None or latest_choice_detector.model_name != video_name):
-        # Call the destructor first
-        del latest_choice_detector
+    Args:
+        video_name (str): The name of the video.
+        camera (str): The name of the camera, or None for the default camera of the model.
 
-        # Reload configuration for changes with GitOps
-        config = reload_config()
+    Yields:
+        bytes: The initialization segment, then the MP4 fragments.
+    """
+    video_key = video_name if camera is None else f"{video_name}@{camera}"
+    yield from hub.fmp4(video_key)
 
-        if video_name == "yolov8n":
-            latest_choice_detector = init_yolo_detector()
-        elif video_name == "safety-yolo8":
-            latest_choice_detector = init_yolo_safety_detector()
-        elif video_name == "welding":
-            latest_choice_detector = init_bolt_detector()
-        elif video_name == "human-pose-estimation":
-              latest_choice_detector = init_pose_estimator()
+def gen_raw_frames(video_name, camera=None):
+    """
+    Generate the raw frames of a video stream, without overlay, at the reduced raw stream rate and size.
+
+    Args:
+        video_name (str): The name of the video.
+        camera (str): The name of the camera, or None for the default camera of the model.
 
-    while video_name != "":
-        processed_frame = latest_choice_detector.run()
-        if processed_frame is not None:
-            ret, buffer = cv2.imencode('.jpg', processed_frame)
-            frame = buffer.tobytes()
-            yield (b'--frame\r\n'
-                b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+    Yields:
+        bytes: The raw frame in JPEG format, with its frame number in the X-Frame header of the part.
+    """
+    video_key = video_name if camera is None else f"{video_name}@{camera}"
+    for sequence, frame in hub.raw_frames(video_key):
+        yield (b'--frame\r\n'
+            b'Content-Type: image/jpeg\r\n'
+            b'Content-Length: %d\r\n'
+            b'X-Frame: %d\r\n\r\n' % (len(frame), sequence) + frame + b'\r\n')
+
+def gen_detections(video_name, camera=None):
+    """
+    Generate the detection metadata of a video stream as Server-Sent Events.
+
+    Args:
+        video_name (str): The name of the video.
+        camera (str): The name of the camera, or None for the default camera of the model.
+
+    Yields:
+        bytes: One event per processed frame, its detections in JSON format.
+    """
+    video_key = video_name if camera is None else f"{video_name}@{camera}"
+    for metadata in hub.metadata(video_key):
+        yield b'data: ' + metadata + b'\n\n'
 
 @app.route('/video_feed')
 def video_feed():
     """
-    Stream video frames based on the provided video name parameter.
+    Stream video frames based on the provided video name and optional camera parameters.
+
+    The format parameter selects MJPEG ("mjpeg", the default) or H.264 fragmented MP4 ("fmp4").
 
     Returns:
         Response: The response object containing the video frames.
@@ -196,8 +451,69 @@ def video_feed():
     video_name = request.args.get('video')
     if video_name is None:
         return Response('Video name parameter is missing', status=400)
+    camera = request.args.get('camera')
+    stream_format = request.args.get('format', 'mjpeg')
+
+    if stream_format == 'fmp4':
+        return Response(gen_fmp4(video_name, camera), mimetype='video/mp4', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    if stream_format != 'mjpeg':
+        return Response(f'Unsupported format {stream_format}, use mjpeg or fmp4', status=400)
+    return Response(gen_frames(video_name, camera), mimetype='multipart/x-mixed-replace; boundary=frame')  # stream the video frames
+
+@app.route('/raw_feed')
+def raw_feed():
+    """
+    Stream the raw video frames, without overlay, for clients drawing the detections from /detections themselves.
 
-    return Response(gen_frames(video_name), mimetype='multipart/x-mixed-replace; boundary=frame')  # stream the video frames
+    Returns:
+        Response: The response object containing the raw video frames.
+    """
+    video_name = request.args.get('video')
+    if video_name is None:
+        return Response('Video name parameter is missing', status=400)
+    camera = request.args.get('camera')
+
+    return Response(gen_raw_frames(video_name, camera), mimetype='multipart/x-mixed-replace; boundary=frame')
+
+@app.route('/detections')
+def detections():
+    """
+    Stream the per-frame detections (boxes, classes, scores or pose keypoints) as Server-Sent Events.
+
+    Returns:
+        Response: The event stream response.
+    """
+    video_name = request.args.get('video')
+    if video_name is None:
+        return Response('Video name parameter is missing', status=400)
+    camera = request.args.get('camera')
+
+    # Disable proxy buffering so every event reaches the browser as soon as it is published
+    return Response(gen_detections(video_name, camera), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/stats')
+def stats():
+    """
+    Returns the statistics of every running pipeline, including the achieved inference concurrency,
+    of the warm detector pool, of the cross-camera batch schedulers and of the detector event sinks.
+
+    Returns:
+        Response: The JSON response containing the pipeline statistics keyed by video name and the pool statistics.
+    """
+    with shared_lock:
+        batching = {model_name: scheduler.stats() for model_name, (_, scheduler) in batch_schedulers.items()}
+    return Response(json.dumps({"pipelines": hub.stats(), "pool": pool.stats(), "batching": batching, "events": event_bus.stats()}), status=200, mimetype='application/json')
+
+@app.route('/metrics')
+def metrics():
+    """
+    Returns the per-stage duration histograms, dropped frames and queue depths of every pipeline
+    in the warm detector pool, active or idle, in the Prometheus text format.
+
+    Returns:
+        Response: The metrics in the Prometheus text exposition format.
+    """
+    return Response(format_prometheus(pool.pipelines()), status=200, mimetype='text/plain; version=0.0.4')
 
 @app.route('/')
 def index():
@@ -253,6 +569,7 @@ def get_iframe_url():
 
 if __name__ == '__main__':
     config = reload_config()
+    pool.preload(preload_videos)
     app.run(debug=False, host="0.0.0.0", port=5001)
 
 # Release the video capture object and close all windows
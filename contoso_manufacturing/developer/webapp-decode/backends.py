@@ -0,0 +1,105 @@
+import threading
+from ovmsclient import make_grpc_client
+
+class OVMSBackend:
+    """Runs inference on OpenVINO Model Server over gRPC."""
+
+    def __init__(self, ovms_url, model_name):
+        """
+        Args:
+            ovms_url (str): The address of the OVMS gRPC endpoint.
+            model_name (str): The name of the model served by OVMS.
+        """
+        self.model_name = model_name
+        self.grpc_client = make_grpc_client(ovms_url)
+
+    def predict(self, inputs):
+        """
+        Runs inference on the model inputs.
+
+        Args:
+            inputs (dict): The input tensors keyed by input name.
+
+        Returns:
+            The output tensor, or a dict of output tensors keyed by output name for models with several outputs.
+        """
+        return self.grpc_client.predict(inputs, self.model_name)
+
+class OpenVINOBackend:
+    """
+    Runs inference in process with the OpenVINO runtime, on the same IR models OVMS serves.
+
+    Skips the tensor serialization and network round trip to OVMS, so single-node deployments
+    do not need the OVMS pod. Each thread calling predict() gets its own infer request, which
+    lets the AsyncInferenceClient keep several inferences in flight on the compiled model.
+    Outputs are returned in the same form as ovmsclient: a single array, or a dict keyed by
+    output name when the model has several outputs.
+
+    Requires the openvino package (pip install openvino).
+    """
+
+    def __init__(self, model_path, device="CPU", performance_hint="LATENCY"):
+        """
+        Args:
+            model_path (str): Path to the model, e.g. the .xml file of the OpenVINO IR.
+            device (str): The OpenVINO device to compile the model for.
+            performance_hint (str): The OpenVINO performance hint, "LATENCY" or "THROUGHPUT".
+        """
+        try:
+            import openvino as ov
+        except ImportError as e:
+            raise ImportError("The openvino backend requires the openvino package: pip install openvino") from e
+
+        core = ov.Core()
+        model = core.read_model(model_path)
+        self.compiled_model = core.compile_model(model, device, {"PERFORMANCE_HINT": performance_hint})
+        self.outputs = self.compiled_model.outputs
+        self.output_names = [output.get_any_name() for output in self.outputs]
+        self.local = threading.local()
+
+    def predict(self, inputs):
+        """
+        Runs inference on the model inputs.
+
+        Args:
+            inputs (dict): The input tensors keyed by input name.
+
+        Returns:
+            The output tensor, or a dict of output tensors keyed by output name for models with several outputs.
+        """
+        request = getattr(self.local, 'request', None)
+        if request is None:
+            request = self.local.request = self.compiled_model.create_infer_request()
+        request.infer(inputs)
+
+        # The output buffers belong to the infer request and are overwritten by its next inference
+        outputs = [request.get_tensor(output).data.copy() for output in self.outputs]
+        if len(outputs) == 1:
+            return outputs[0]
+        return dict(zip(self.output_names, outputs))
+
+def make_backend(model_name, model_config, ovms_url):
+    """
+    Creates the inference backend selected in the model configuration.
+
+    Args:
+        model_name (str): The name of the model.
+        model_config (dict): The configuration of the model. Its optional "backend" entry selects
+            "ovms" (default) or "openvino" as "type"; the openvino backend also takes "model_path",
+            "device" and "performance_hint".
+        ovms_url (str): The address of the OVMS gRPC endpoint, used by the ovms backend.
+
+    Returns:
+        OVMSBackend or OpenVINOBackend: The backend.
+    """
+    backend_config = model_config.get('backend') or {}
+    backend_type = backend_config.get('type', 'ovms')
+    if backend_type == 'ovms':
+        return OVMSBackend(ovms_url, model_name)
+    if backend_type == 'openvino':
+        return OpenVINOBackend(
+            model_path=backend_config['model_path'],
+            device=backend_config.get('device', 'CPU'),
+            performance_hint=backend_config.get('performance_hint', 'LATENCY')
+        )
+    raise ValueError(f"Unknown inference backend for {model_name}: {backend_type}")
@@ -0,0 +1,160 @@
+import collections
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+
+class BatchScheduler:
+    """
+    Combines preprocessed frames from several camera pipelines into one batched OVMS predict call.
+
+    Each camera submits its 1x3xHxW tensor (or Tx3xHxW with T tiles) and waits for its own
+    result. A scheduler thread starts a batch with the oldest waiting frame, keeps collecting
+    frames until the batch is full or the oldest frame has waited max_wait_ms, sends one request
+    with all their tensors and splits the outputs back per camera. The model served by OVMS must accept a dynamic (or large enough) batch dimension.
+
+    Raising max_wait_ms fills batches better and increases throughput at the cost of latency;
+    stats() reports both the batch fill rate and the latency added by waiting.
+
+    After close(), the frames still submitted, e.g. by pipelines created before the batching
+    configuration changed, are sent one by one without batching.
+    """
+
+    def __init__(self, predict, input_name, max_batch_size=8, max_wait_ms=10, name="batch"):
+        """
+        Args:
+            predict (callable): Function that takes the batched inputs dict and returns the batched outputs.
+            input_name (str): Name of the model input the frames are stacked into.
+            max_batch_size (int): Maximum number of frames per predict call.
+            max_wait_ms (float): Maximum time the oldest frame waits for the batch to fill.
+            name (str): Name used for the scheduler thread.
+        """
+        self.predict_batch = predict
+        self.input_name = input_name
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max_wait_ms / 1000.0
+        self.pending = collections.deque()
+        self.condition = threading.Condition()
+        self.closed = False
+
+        # Statistics used to trade latency for throughput
+        self.batches = 0
+        self.frames = 0
+        self.total_wait = 0.0
+        self.max_observed_wait = 0.0
+        self.failed = 0
+
+        self.thread = threading.Thread(target=self._loop, name=f"{name}-scheduler", daemon=True)
+        self.thread.start()
+
+    def submit(self, tensor):
+        """
+        Queues one preprocessed frame for the next batch.
+
+        Args:
+            tensor (np.ndarray): The model input of a single frame, with a batch dimension of 1 or its number of tiles.
+
+        Returns:
+            Future: Resolves to the model outputs of this frame, with the batch dimension of its tensor.
+        """
+        future = Future()
+        with self.condition:
+            if not self.closed:
+                self.pending.append((tensor, time.perf_counter(), future))
+                self.condition.notify()
+                return future
+        try:
+            future.set_result(self.predict_batch({self.input_name: tensor}))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def predict(self, inputs):
+        """
+        Runs inference for a single frame as part of a batch, blocking until its result is available.
+
+        Args:
+            inputs (dict): The model inputs of a single frame.
+
+        Returns:
+            The model outputs of this frame.
+        """
+        return self.submit(inputs[self.input_name]).result()
+
+    def _next_batch(self):
+        with self.condition:
+            self.condition.wait_for(lambda: self.pending or self.closed)
+            if not self.pending:
+                return None
+            deadline = self.pending[0][1] + self.max_wait
+            while len(self.pending) < self.max_batch_size and not self.closed:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            count = min(len(self.pending), self.max_batch_size)
+            return [self.pending.popleft() for _ in range(count)]
+
+    def _loop(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            dispatched = time.perf_counter()
+            waits = [dispatched - enqueued for _, enqueued, _ in batch]
+            try:
+                outputs = self.predict_batch({self.input_name: np.concatenate([tensor for tensor, _, _ in batch], axis=0)})
+            except Exception as e:
+                with self.condition:
+                    self.failed += len(batch)
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            start = 0
+            for tensor, _, future in batch:
+                future.set_result(self._split(outputs, start, start + len(tensor)))
+                start += len(tensor)
+
+            with self.condition:
+                self.batches += 1
+                self.frames += len(batch)
+                self.total_wait += sum(waits)
+                self.max_observed_wait = max(self.max_observed_wait, max(waits))
+
+    def close(self):
+        """Dispatches the frames already waiting and stops the scheduler thread."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+
+    @staticmethod
+    def _split(outputs, start, stop):
+        # Outputs are a single array or a dict of arrays for models with several outputs
+        if isinstance(outputs, dict):
+            return {name: output[start:stop] for name, output in outputs.items()}
+        return outputs[start:stop]
+
+    def stats(self):
+        """
+        Returns the batching statistics since the scheduler was created.
+
+        Returns:
+            dict: Number of batches and frames, mean batch size, fill rate (mean batch size over
+                max_batch_size) and the mean and maximum latency added by waiting for a batch.
+        """
+        with self.condition:
+            mean_batch = self.frames / self.batches if self.batches else 0.0
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "batches": self.batches,
+                "frames": self.frames,
+                "failed": self.failed,
+                "mean_batch_size": mean_batch,
+                "fill_rate": mean_batch / self.max_batch_size,
+                "mean_wait_ms": 1000 * self.total_wait / self.frames if self.frames else 0.0,
+                "max_wait_observed_ms": 1000 * self.max_observed_wait,
+                "pending": len(self.pending),
+            }
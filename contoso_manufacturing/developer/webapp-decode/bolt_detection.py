@@ -2,9 +2,11 @@ import math
 from math import atan2
 import cv2
 import numpy as np
-from ovmsclient import make_grpc_client
+from detector import Detector
+from backends import OVMSBackend
 
 # GLOBAL Variables
+# Area of the bounding rectangle of an object in source pixels, scaled with the decode size
 OBJECT_AREA_MIN = 9000
 OBJECT_AREA_MAX = 50000
 LOW_H = 0
@@ -18,10 +20,19 @@ HIGH_V = 255
 # for color thresholding to detect the object
 LOWER_COLOR_RANGE = (0, 0, 0)
 UPPER_COLOR_RANGE = (174, 73, 255)
+# Structuring element of the morphological opening and closing, created once
+MORPH_KERNEL = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+# Canny parameters of the crack detection
+CRACK_LOW_THRESHOLD = 130
+CRACK_RATIO = 3
+CRACK_KERNEL_SIZE = 3
+# Margin around the objects within which the shared planes are computed, wider than the
+# blur, Canny and opening neighbourhoods so that the planes inside the objects are exact
+PLANES_MARGIN = 8
 
 
-class BoltDetection:
-    def __init__(self, rtsp_url, input_shape, confidence_thres, iou_thres, model_name, ovms_url, skip_rate, verbose=False):
+class BoltDetection(Detector):
+    def __init__(self, rtsp_url, input_shape, confidence_thres, iou_thres, model_name, ovms_url, skip_rate, verbose=False, capture_options=None, backend=None):
         print(f"Initializing B with RTSP URL: {rtsp_url}")
         self.rtsp_url = rtsp_url
         self.input_width, self.input_height = input_shape
@@ -34,19 +45,13 @@ class BoltDetection:
         self.count_object=0
         self.skip_rate=skip_rate
         self.one_pixel_length = 0.0264583333
+        # Measurements of the last object, kept apart from the model input size the source is decoded at
+        self.length_mm = 0.0
+        self.width_mm = 0.0
+        self.capture_options = capture_options
 
-        self.cap = cv2.VideoCapture(rtsp_url)
-        self.grpc_client = make_grpc_client(ovms_url)
-        
-        if not self.cap.isOpened():
-            print("Error: Unable to open video source.")
-        else:
-            # Lee un frame para determinar el tamaño de los frames del video
-            ret, frame = self.cap.read()
-            if ret:
-                self.img_height, self.img_width = frame.shape[:2]
-            else:
-                print("Failed to grab frame to set image dimensions")
+        self.backend = backend if backend is not None else OVMSBackend(ovms_url, model_name)
+        self.open_source(rtsp_url)
 
     def dimensions(self, box):
         """
@@ -77,12 +82,8 @@ class BoltDetection:
         :param contours: contour of the object from the frame
         :return: angle of orientation of the object in radians
         """
-        size_points = len(contours)
         # data_pts stores contour values in 2D
-        data_pts = np.empty((size_points, 2), dtype=np.float64)
-        for i in range(data_pts.shape[0]):
-            data_pts[i, 0] = contours[i, 0, 0]
-            data_pts[i, 1] = contours[i, 0, 1]
+        data_pts = contours.reshape(-1, 2).astype(np.float64)
         # Use PCA algorithm to find angle of the data points
         mean, eigenvector = cv2.PCACompute(data_pts, mean=None)
         angle = atan2(eigenvector[0, 1], eigenvector[0, 0])
@@ -108,110 +109,165 @@ class BoltDetection:
             defect_flag = True
             # cv2.putText(frame, "Frame Number : {}".format(self.count_object), (5, 50), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (255, 255, 255), 2)
             # cv2.putText(frame, "Defect: {}".format(defect), (5, 140), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (255, 255, 255), 2)
-            # cv2.putText(frame, "Length (mm): {}".format(self.input_height), (5, 80), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (255, 255, 255), 2)
-            # cv2.putText(frame, "Width (mm): {}".format(self.input_width), (5, 110), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (255, 255, 255), 2)
+            # cv2.putText(frame, "Length (mm): {}".format(self.length_mm), (5, 80), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (255, 255, 255), 2)
+            # cv2.putText(frame, "Width (mm): {}".format(self.width_mm), (5, 110), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (255, 255, 255), 2)
 
         return frame, defect_flag, defect
 
-    def detect_color(self, frame, cnt):
+    def feature_planes(self, frame, rect=None):
+        """
+        Computes the planes shared by the defect checks of all the objects of a frame,
+        within the given rectangle of the frame. The frame itself is not modified.
+        Step 1: Increase the brightness of a copy of the frame and convert it to HSV.
+        Step 2: Threshold it on the defect color range and apply a morphological
+                opening to remove small noise.
+        Step 3: Convert the frame to gray scale, blur it and find its edges.
+
+        :param frame: Input frame from the video
+        :param rect: x, y, width and height of the region to compute, the whole frame when omitted
+        :return: dict with the "color_mask" and "edges" planes of the region and its "origin" in the frame
+        """
+        if rect is None:
+            rect = (0, 0, frame.shape[1], frame.shape[0])
+        x, y, w, h = rect
+        region = frame[y:y + h, x:x + w]
+        # Increase the brightness of the image
+        img = cv2.convertScaleAbs(region, None, 1, 20)
+        # Convert the captured frame from BGR to HSV
+        img_hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+        # Threshold the image
+        color_mask = cv2.inRange(img_hsv, LOWER_COLOR_RANGE, UPPER_COLOR_RANGE)
+        # Morphological opening (remove small objects from the foreground)
+        color_mask = cv2.morphologyEx(color_mask, cv2.MORPH_OPEN, MORPH_KERNEL)
+
+        # Convert the captured frame from BGR to GRAY
+        img_gray = cv2.cvtColor(region, cv2.COLOR_BGR2GRAY)
+        img_gray = cv2.blur(img_gray, (7, 7))
+        # Find the edges
+        edges = cv2.Canny(img_gray, CRACK_LOW_THRESHOLD, CRACK_LOW_THRESHOLD * CRACK_RATIO, apertureSize=CRACK_KERNEL_SIZE)
+        return {"color_mask": color_mask, "edges": edges, "origin": (x, y)}
+
+    @staticmethod
+    def plane_roi(planes, name, cnt):
+        """
+        Returns the part of a shared plane inside the bounding rectangle of an object.
+
+        :param planes: Planes of the frame from feature_planes()
+        :param name: Name of the plane
+        :param cnt: Contours of the object
+        :return: the plane ROI and the position of its top left corner in the frame
+        """
+        x, y, w, h = cv2.boundingRect(cnt)
+        origin_x, origin_y = planes["origin"]
+        plane = planes[name]
+        x0, y0 = max(x - origin_x, 0), max(y - origin_y, 0)
+        return plane[y0:y - origin_y + h, x0:x - origin_x + w], (origin_x + x0, origin_y + y0)
+
+    def detect_color(self, frame, cnt, planes=None):
         """
         Identifies the color defect W.R.T the set default color of the object.
-        Step 1: Increase the brightness of the image.
-        Step 2: Convert the image to HSV Format. HSV color space gives more
-                information about the colors of the image.
-                It helps to identify distinct colors in the image.
-        Step 3: Threshold the image based on the color using "inRange" function.
-                Range of the color, which is considered as a defect for object, is
-                passed as one of the argument to inRange function to create a mask.
-        Step 4: Morphological opening and closing is done on the mask to remove
-                noises and fill the gaps.
-        Step 5: Find the contours on the mask image. Contours are filtered based on
-                the area to get the contours of defective area. Contour of the
-                defective area is then drawn on the original image to visualize.
-        Step 6: Save the image in "color" folder if it has a color defect.
+        Step 1: Take the defect color mask of the frame from feature_planes().
+        Step 2: Find the contours on the mask inside the bounding rectangle of the object.
+                Contours are filtered based on the area to get the contours of defective
+                area. Contour of the defective area is then drawn on the original image
+                to visualize.
 
         :param frame: Input frame from the video
         :param cnt: Contours of the object
+        :param planes: Planes of the frame from feature_planes(), computed when omitted
         :return: color_flag, defect
         """
         defect = "Color"
         color_flag = False
-        # Increase the brightness of the image
-        cv2.convertScaleAbs(frame, frame, 1, 20)
-        # Convert the captured frame from BGR to HSV
-        img_hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-        # Threshold the image
-        img_threshold = cv2.inRange(img_hsv, LOWER_COLOR_RANGE, UPPER_COLOR_RANGE)
-        # Morphological opening (remove small objects from the foreground)
-        img_threshold = cv2.erode(img_threshold, kernel=cv2.getStructuringElement( cv2.MORPH_ELLIPSE, (5, 5)))
-        img_threshold = cv2.dilate(img_threshold, kernel=cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5)))
-        contours, hierarchy = cv2.findContours(img_threshold, cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE)
-        
+        if planes is None:
+            planes = self.feature_planes(frame, self.objects_rect(frame, [cnt]))
+        mask, offset = self.plane_roi(planes, "color_mask", cnt)
+        contours, hierarchy = cv2.findContours(mask, cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE, offset=offset)
+
         for i in range(len(contours)):
             area = cv2.contourArea(contours[i])
             if 2000 < area < 10000:
-                cv2.drawContours(frame, contours[i], -1, (0, 0, 255), 2)
+                if self.should_draw():
+                    cv2.drawContours(frame, contours[i], -1, (0, 0, 255), 2)
                 color_flag = True
-        
-        if color_flag:
-            x, y, w, h = cv2.boundingRect(cnt)
-            # cv2.putText(frame, "Frame Number : {}".format(self.count_object), (5, 50), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (255, 255, 255), 2)
-            # cv2.putText(frame, "Defect: {}".format(defect), (5, 140), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (255, 255, 255), 2)
-            # cv2.putText(frame, "Length (mm): {}".format(self.input_height), (5, 80), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (255, 255, 255), 2)
-            # cv2.putText(frame, "Width (mm): {}".format(self.input_width), (5, 110), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (255, 255, 255), 2)
         return frame, color_flag, defect
 
-    def detect_crack(self, frame, cnt):
+    def detect_crack(self, frame, cnt, planes=None):
         """
         Identify the Crack defect on the object.
-        Step 1: Convert the image to gray scale.
-        Step 2: Blur the gray image to remove the noises.
-        Step 3: Find the edges on the blurred image to get the contours of
-                possible cracks.
-        Step 4: Filter the contours to get the contour of the crack.
-        Step 5: Draw the contour on the orignal image for visualization.
-        Step 6: Save the image in "crack" folder if it has crack defect.
+        Step 1: Take the edges of the blurred gray frame from feature_planes().
+        Step 2: Find the contours of possible cracks on the edges inside the bounding
+                rectangle of the object.
+        Step 3: Filter the contours to get the contour of the crack.
+        Step 4: Draw the contour on the orignal image for visualization.
 
         :param frame: Input frame from the video
         :param cnt: Contours of the object
+        :param planes: Planes of the frame from feature_planes(), computed when omitted
         :return: defect_flag, defect, cnt
         """
         defect = "Crack"
         defect_flag = False
-        low_threshold = 130
-        kernel_size = 3
-        ratio = 3
-        # Convert the captured frame from BGR to GRAY
-        img = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        img = cv2.blur(img, (7, 7))
-        # Find the edges
-        detected_edges = cv2.Canny(img, low_threshold,  low_threshold * ratio, kernel_size)
+        if planes is None:
+            planes = self.feature_planes(frame, self.objects_rect(frame, [cnt]))
         # Find the contours
-        contours, hierarchy = cv2.findContours(detected_edges, cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE)
+        edges, offset = self.plane_roi(planes, "edges", cnt)
+        contours, hierarchy = cv2.findContours(edges, cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE, offset=offset)
 
-        if len(contours) != 0:
-            for i in range(len(contours)):
-                area = cv2.contourArea(contours[i])
-                if area > 20 or area < 9:
+        for i in range(len(contours)):
+            area = cv2.contourArea(contours[i])
+            if area > 20 or area < 9:
+                if self.should_draw():
                     cv2.drawContours(frame, contours, i, (0, 255, 0), 2)
-                    defect_flag = True
-
-            if defect_flag:
-                x, y, w, h = cv2.boundingRect(cnt)
-                # cv2.putText(frame, "Frame Number : {}".format(self.count_object), (5, 50), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (255, 255, 255), 2)
-                # cv2.putText(frame, "Defect: {}".format(defect), (5, 140), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (255, 255, 255), 2)
-                # cv2.putText(frame, "Length (mm): {}".format(self.input_height), (5, 80), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (255, 255, 255), 2)
-                # cv2.putText(frame, "Width (mm): {}".format(self.input_width), (5, 110),cv2.FONT_HERSHEY_SIMPLEX, 0.75, (255, 255, 255), 2)
+                defect_flag = True
         return frame, defect_flag, defect
 
-    def preprocess(self):
+    @staticmethod
+    def objects_rect(frame, objects):
+        """
+        Returns the rectangle around the objects, widened by PLANES_MARGIN and clipped to the frame.
+
+        :param frame: Input frame from the video
+        :param objects: Contours of the objects
+        :return: x, y, width and height of the rectangle
+        """
+        points = np.concatenate([cnt.reshape(-1, 2) for cnt in objects])
+        x0, y0 = np.maximum(points.min(axis=0) - PLANES_MARGIN, 0)
+        x1, y1 = np.minimum(points.max(axis=0) + PLANES_MARGIN + 1, (frame.shape[1], frame.shape[0]))
+        return int(x0), int(y0), int(x1 - x0), int(y1 - y0)
+
+    @classmethod
+    def object_clusters(cls, frame, objects):
+        """
+        Groups the objects whose rectangles from objects_rect() overlap, so the planes are computed
+        once for nearby objects and the cost follows the area of the objects rather than their spread.
+
+        :param frame: Input frame from the video
+        :param objects: Contours of the objects
+        :return: list of the rectangle around each cluster and the indices of its objects
+        """
+        clusters = [(cls.objects_rect(frame, [cnt]), [i]) for i, cnt in enumerate(objects)]
+        merged = True
+        while merged:
+            merged = False
+            for a in range(len(clusters)):
+                for b in range(a + 1, len(clusters)):
+                    (ax, ay, aw, ah), a_members = clusters[a]
+                    (bx, by, bw, bh), b_members = clusters[b]
+                    if ax < bx + bw and bx < ax + aw and ay < by + bh and by < ay + ah:
+                        x0, y0 = min(ax, bx), min(ay, by)
+                        x1, y1 = max(ax + aw, bx + bw), max(ay + ah, by + bh)
+                        clusters[a] = ((x0, y0, x1 - x0, y1 - y0), a_members + b_members)
+                        del clusters[b]
+                        merged = True
+                        break
+                if merged:
+                    break
+        return clusters
+
+    def preprocess(self, img):
         if(self.verbose):
             print("Preprocessing the frame...")
-            
-        ret, img = self.cap.read()
-        if not ret:
-            print("Failed to grab frame")
-            return None
 
         # Convert BGR image to HSV color space
         img_hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
@@ -220,92 +276,84 @@ class BoltDetection:
         img_threshold = cv2.inRange(img_hsv, (LOW_H, LOW_S, LOW_V),(HIGH_H, HIGH_S, HIGH_V))
 
         # Morphological opening(remove small objects from the foreground)
-        img_threshold = cv2.erode(img_threshold, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5)))
-        img_threshold = cv2.dilate(img_threshold,cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5)))
+        img_threshold = cv2.erode(img_threshold, MORPH_KERNEL)
+        img_threshold = cv2.dilate(img_threshold, MORPH_KERNEL)
 
         # Morphological closing(fill small holes in the foreground)
-        img_threshold = cv2.dilate(img_threshold, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5)))
-        img_threshold = cv2.erode(img_threshold, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5)))
+        img_threshold = cv2.dilate(img_threshold, MORPH_KERNEL)
+        img_threshold = cv2.erode(img_threshold, MORPH_KERNEL)
 
         # Find the contours on the image
         contours, hierarchy = cv2.findContours(img_threshold, cv2.RETR_LIST,cv2.CHAIN_APPROX_NONE)
-        return contours, contours
+        return contours, None
+
+    def predict(self, contours):
+        # Bolt detection is classical computer vision on the contours, no model is called
+        return contours
     
-    def postprocess(self, frame, contours):
+    def postprocess(self, frame, contours, meta=None):
         if(self.verbose):
             print("Postprocessing the output...")
 
         OBJ_DEFECT = []
+        # Structured results of every object, published as the event of the frame
+        results = []
+        objects = []
+        # Frames decoded below the source resolution have smaller objects with larger pixels
+        scale = self.capture_scale()
+        area_min, area_max = OBJECT_AREA_MIN * scale * scale, OBJECT_AREA_MAX * scale * scale
+        one_pixel_length = self.one_pixel_length / scale
         for cnt in contours:
             x, y, w, h = cv2.boundingRect(cnt)
-            if OBJECT_AREA_MAX > w * h > OBJECT_AREA_MIN:
-                box = cv2.minAreaRect(cnt)
-                box = cv2.boxPoints(box)
-                height, width = self.dimensions(np.array(box, dtype='int'))
-                self.input_height = round(height * self.one_pixel_length * 10, 2)
-                self.input_width = round(width * self.one_pixel_length * 10, 2)
-                self.count_object += 1
-     
-                # Check for the orientation of the object
-                frame, orientation_flag, orientation_defect = self.detect_orientation(frame, cnt)
-                if orientation_flag:
-                    value = 1
-                    OBJ_DEFECT.append(str(orientation_defect))
-                else:
-                    value = 0
-
-                # Check for the color defect of the object
-                frame, color_flag, color_defect = self.detect_color(frame, cnt)
-                if color_flag:
-                    value = 1
-                    OBJ_DEFECT.append(str(color_defect))
-                else:
-                    value = 0
-
-                # Check for the crack defect of the object
-                frame, crack_flag, crack_defect = self.detect_crack(frame, cnt)
-                if crack_flag:
-                    value = 1
-                    OBJ_DEFECT.append(str(crack_defect))
-                else:
-                    value = 0
-
-                # Check if none of the defect is found
-                if not OBJ_DEFECT:
-                    value = 1
-                    defect = "No Defect"
-                    OBJ_DEFECT.append(defect)
-                    #cv2.putText(frame, "Length (mm): {}".format(self.input_height), (5, 80), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (255, 255, 255), 2)
-                    #cv2.putText(frame, "Width (mm): {}".format(self.input_width),(5, 110), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (255, 255, 255), 2)
-                else:
-                    value = 0
-            
+            if area_max > w * h > area_min:
+                objects.append(cnt)
+        # Planes shared by the defect checks of the objects, computed once per cluster of nearby objects
+        object_planes = {}
+        for rect, members in self.object_clusters(frame, objects):
+            planes = self.feature_planes(frame, rect)
+            for i in members:
+                object_planes[i] = planes
+
+        for i, cnt in enumerate(objects):
+            box = cv2.minAreaRect(cnt)
+            box = cv2.boxPoints(box)
+            height, width = self.dimensions(np.array(box, dtype='int'))
+            self.length_mm = round(height * one_pixel_length * 10, 2)
+            self.width_mm = round(width * one_pixel_length * 10, 2)
+            self.count_object += 1
+            object_defects = []
+            planes = object_planes[i]
+
+            # Check for the orientation of the object
+            frame, orientation_flag, orientation_defect = self.detect_orientation(frame, cnt)
+            if orientation_flag:
+                OBJ_DEFECT.append(str(orientation_defect))
+                object_defects.append(orientation_defect)
+
+            # Check for the color defect of the object
+            frame, color_flag, color_defect = self.detect_color(frame, cnt, planes)
+            if color_flag:
+                OBJ_DEFECT.append(str(color_defect))
+                object_defects.append(color_defect)
+
+            # Check for the crack defect of the object
+            frame, crack_flag, crack_defect = self.detect_crack(frame, cnt, planes)
+            if crack_flag:
+                OBJ_DEFECT.append(str(crack_defect))
+                object_defects.append(crack_defect)
+
+            # Check if none of the defect is found
             if not OBJ_DEFECT:
-                continue
+                OBJ_DEFECT.append("No Defect")
+            results.append({"defects": object_defects, "length_mm": self.length_mm, "width_mm": self.width_mm})
 
         all_defects = " ".join(OBJ_DEFECT)
-        cv2.putText(frame, "Frame Number : {}".format(self.count_object), (5, 50), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (255, 255, 255), 2)
-        cv2.putText(frame, "Defect: {}".format(all_defects), (5, 140), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (255, 255, 255), 2)
-        cv2.putText(frame, "Length (mm): {}".format(self.input_height), (5, 80),  cv2.FONT_HERSHEY_SIMPLEX, 0.75, (255, 255, 255), 2)
-        cv2.putText(frame, "Width (mm): {}".format(self.input_width), (5, 110), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (255, 255, 255), 2)
-        return frame
-    
-    def run(self):
-        if(self.verbose):
-            print("Running detection...")
-        
-        self.frame_number += 1
-        # If mod = 0, i will get the frame and skip it
-        if self.frame_number % self.skip_rate == 0:
-            self.cap.read()
-            return None
-
-        contours, hierarchy = self.preprocess()
-        frame = self.postprocess(self.cap.read()[1], contours)
+        self.publish_event(objects=results, defects=sorted({defect for result in results for defect in result["defects"]}))
+        if not self.should_draw():
+            return frame
+        with self.timed("draw"):
+            cv2.putText(frame, "Frame Number : {}".format(self.count_object), (5, 50), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (255, 255, 255), 2)
+            cv2.putText(frame, "Defect: {}".format(all_defects), (5, 140), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (255, 255, 255), 2)
+            cv2.putText(frame, "Length (mm): {}".format(self.length_mm), (5, 80),  cv2.FONT_HERSHEY_SIMPLEX, 0.75, (255, 255, 255), 2)
+            cv2.putText(frame, "Width (mm): {}".format(self.width_mm), (5, 110), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (255, 255, 255), 2)
         return frame
-
-    def __del__(self):
-        print("Releasing resources...")
-        self.cap.release()
-        cv2.destroyAllWindows()
-        print("Released video capture and destroyed all windows.")
\ No newline at end of file
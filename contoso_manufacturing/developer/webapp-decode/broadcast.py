@@ -0,0 +1,218 @@
+import threading
+
+class FrameBroadcaster:
+    """
+    Shares the latest encoded frame of a pipeline with any number of subscribers.
+
+    The producer publishes each frame once and never waits for the subscribers. Every subscriber
+    reads the most recent frame when it is ready for the next one, so a slow client skips the
+    frames it could not keep up with instead of stalling the producer or the other clients.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.frame = None
+        self.sequence = 0
+        self.subscribers = 0
+        self.dropped = 0
+        self.closed = False
+
+    def publish(self, frame):
+        """
+        Replaces the latest frame and wakes up the waiting subscribers.
+
+        Args:
+            frame (bytes): The encoded frame.
+        """
+        with self.condition:
+            self.frame = frame
+            self.sequence += 1
+            self.condition.notify_all()
+
+    def subscribe(self, timeout=0.5):
+        """
+        Yields every new frame published while the subscriber keeps up, and the latest one when it does not.
+
+        Args:
+            timeout (float): Number of seconds between checks whether the broadcaster was closed.
+
+        Yields:
+            bytes: The latest encoded frame.
+        """
+        with self.condition:
+            self.subscribers += 1
+            last_sequence = 0
+        try:
+            while True:
+                with self.condition:
+                    self.condition.wait_for(lambda: self.sequence != last_sequence or self.closed, timeout)
+                    if self.closed:
+                        return
+                    if self.sequence == last_sequence:
+                        continue
+                    if last_sequence:
+                        self.dropped += self.sequence - last_sequence - 1
+                    frame, last_sequence = self.frame, self.sequence
+                yield frame
+        finally:
+            with self.condition:
+                self.subscribers -= 1
+
+    def close(self):
+        """Ends every subscription."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+class BroadcastHub:
+    """
+    Runs a single pipeline per active model and shares its output with every viewer of that model.
+
+    The pipeline is checked out of the DetectorPool by the first viewer of a model and checked
+    back in when its last viewer disconnects. Viewers never drive inference themselves, so any
+    number of browser tabs can watch the same model without stealing frames from each other.
+
+    Creating a pipeline can take seconds, so the pool is called outside the hub lock: other
+    models stay available meanwhile, and the viewers of the same model wait for the pipeline
+    being checked out or in instead of creating a second one.
+    """
+
+    def __init__(self, pool):
+        """
+        Args:
+            pool (DetectorPool): The pool that creates the pipelines and keeps idle ones warm.
+        """
+        self.pool = pool
+        self.pipelines = {}
+        self.viewers = {}
+        self.pending = {}  # Events set once the pipeline of a video has been checked out or in
+        self.lock = threading.Lock()
+
+    def acquire(self, video_name):
+        """
+        Returns the running pipeline for a video, creating it for the first viewer.
+
+        Args:
+            video_name (str): The name of the video.
+
+        Returns:
+            DetectorPipeline: The running pipeline, or None if the video name is unknown.
+        """
+        while True:
+            with self.lock:
+                pipeline = self.pipelines.get(video_name)
+                if pipeline is not None:
+                    self.viewers[video_name] += 1
+                    return pipeline
+                pending = self.pending.get(video_name)
+                if pending is None:
+                    pending = self.pending[video_name] = threading.Event()
+                    break
+            pending.wait()
+
+        pipeline = None
+        try:
+            pipeline = self.pool.checkout(video_name)
+        finally:
+            with self.lock:
+                del self.pending[video_name]
+                if pipeline is not None:
+                    self.pipelines[video_name] = pipeline
+                    self.viewers[video_name] = 1
+            pending.set()
+        return pipeline
+
+    def release(self, video_name):
+        """
+        Releases a viewer of a video and returns its pipeline to the pool after the last viewer left.
+
+        Args:
+            video_name (str): The name of the video.
+        """
+        with self.lock:
+            self.viewers[video_name] -= 1
+            if self.viewers[video_name] > 0:
+                return
+            del self.pipelines[video_name]
+            del self.viewers[video_name]
+            pending = self.pending[video_name] = threading.Event()
+        print(f"Pausing pipeline for {video_name}, no viewers left")
+        try:
+            self.pool.checkin(video_name)
+        finally:
+            with self.lock:
+                del self.pending[video_name]
+            pending.set()
+
+    def frames(self, video_name):
+        """
+        Yields the encoded frames of a video for one viewer.
+
+        Args:
+            video_name (str): The name of the video.
+
+        Yields:
+            bytes: The processed frame in JPEG format.
+        """
+        yield from self._stream(video_name, lambda pipeline: pipeline.frames())
+
+    def fmp4(self, video_name):
+        """
+        Yields the annotated video of a video as fragmented MP4 for one viewer.
+
+        Args:
+            video_name (str): The name of the video.
+
+        Yields:
+            bytes: The MP4 data.
+        """
+        yield from self._stream(video_name, lambda pipeline: pipeline.fmp4())
+
+    def metadata(self, video_name):
+        """
+        Yields the detection metadata of a video for one viewer.
+
+        Args:
+            video_name (str): The name of the video.
+
+        Yields:
+            bytes: The detections of a frame in JSON format.
+        """
+        yield from self._stream(video_name, lambda pipeline: pipeline.metadata())
+
+    def raw_frames(self, video_name):
+        """
+        Yields the raw, reduced rate frames of a video for one viewer.
+
+        Args:
+            video_name (str): The name of the video.
+
+        Yields:
+            tuple: The frame number and the raw frame in JPEG format.
+        """
+        yield from self._stream(video_name, lambda pipeline: pipeline.raw_frames())
+
+    def _stream(self, video_name, stream):
+        pipeline = self.acquire(video_name)
+        if pipeline is None:
+            return
+        try:
+            yield from stream(pipeline)
+        finally:
+            self.release(video_name)
+
+    def stats(self):
+        """
+        Returns the statistics of every running pipeline.
+
+        Returns:
+            dict: The pipeline statistics and number of viewers keyed by video name.
+        """
+        with self.lock:
+            pipelines = dict(self.pipelines)
+            viewers = dict(self.viewers)
+        stats = {}
+        for video_name, pipeline in pipelines.items():
+            stats[video_name] = pipeline.stats()
+            stats[video_name]["viewers"] = viewers[video_name]
+        return stats
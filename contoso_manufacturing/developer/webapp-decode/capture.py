@@ -0,0 +1,152 @@
+import os
+import subprocess
+import cv2
+import numpy as np
+
+ffmpeg_path = os.environ.get('FFMPEG_PATH', 'ffmpeg')
+
+class FFmpegCapture:
+    """
+    Video source that decodes through an FFmpeg subprocess, scaled to a small frame size.
+
+    FFmpeg writes raw BGR frames of exactly width x height to a pipe, so frames are never
+    converted or copied at the full camera resolution. Use the model input resolution (or the
+    resolution the overlay is streamed at) to save the full-resolution color conversion of
+    every frame, including the skipped ones. Implements the subset of the cv2.VideoCapture
+    interface used by the detectors: isOpened(), grab(), read() and release().
+
+    The overlay and the streams are produced at the decode size too. scale is the ratio of the
+    decode width to the source width, for detectors with thresholds in source pixels.
+    """
+
+    def __init__(self, source, size, source_size=None):
+        """
+        Args:
+            source (str): The RTSP URL or local file path of the video source.
+            size (tuple): The (width, height) the frames are decoded at.
+            source_size (tuple): The (width, height) of the source frames, None if unknown.
+        """
+        self.width, self.height = size
+        self.scale = self.width / source_size[0] if source_size else 1.0
+        self.frame_bytes = self.width * self.height * 3
+        self.discard = bytearray(self.frame_bytes)
+
+        command = [ffmpeg_path, '-loglevel', 'error', '-nostdin']
+        if source.startswith('rtsp://'):
+            command += ['-rtsp_transport', 'tcp']
+        command += ['-i', source, '-an', '-vf', f'scale={self.width}:{self.height}',
+                    '-pix_fmt', 'bgr24', '-f', 'rawvideo', 'pipe:1']
+        try:
+            self.process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=self.frame_bytes)
+        except OSError as e:
+            print(f"Error: Unable to start FFmpeg: {e}")
+            self.process = None
+
+    def isOpened(self):
+        return self.process is not None and self.process.poll() is None
+
+    def _read_into(self, buffer):
+        if self.process is None:
+            return False
+        view = memoryview(buffer).cast('B')
+        received = 0
+        while received < self.frame_bytes:
+            count = self.process.stdout.readinto(view[received:])
+            if not count:
+                return False
+            received += count
+        return True
+
+    def grab(self):
+        """
+        Consumes the next frame without returning it.
+
+        Returns:
+            bool: True if a frame was read.
+        """
+        return self._read_into(self.discard)
+
+    def read(self):
+        """
+        Reads the next frame.
+
+        Returns:
+            tuple: (True, frame) or (False, None) at the end of the stream or on error.
+        """
+        frame = np.empty((self.height, self.width, 3), np.uint8)
+        if not self._read_into(frame):
+            return False, None
+        return True, frame
+
+    def release(self):
+        if self.process is None:
+            return
+        self.process.kill()
+        self.process.stdout.close()
+        self.process.wait()
+        self.process = None
+
+def probe_frame_size(source):
+    """
+    Returns the frame size of a video source as reported by OpenCV.
+
+    Args:
+        source (str): The RTSP URL or local file path of the video source.
+
+    Returns:
+        tuple: The (width, height) of the frames, or None if the source could not be opened.
+    """
+    cap = cv2.VideoCapture(source)
+    try:
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    finally:
+        cap.release()
+    if width <= 0 or height <= 0:
+        return None
+    return width, height
+
+def fit_size(frame_size, target_size):
+    """
+    Scales a frame size down to fit a target size, keeping the aspect ratio and even dimensions.
+
+    Args:
+        frame_size (tuple): The (width, height) of the source frames.
+        target_size (tuple): The (width, height) the frames must fit in.
+
+    Returns:
+        tuple: The scaled (width, height).
+    """
+    scale = min(1.0, target_size[0] / frame_size[0], target_size[1] / frame_size[1])
+    return max(2, int(frame_size[0] * scale) // 2 * 2), max(2, int(frame_size[1] * scale) // 2 * 2)
+
+def open_capture(source, options=None, input_shape=None):
+    """
+    Opens a video source with the capture backend selected in the model configuration.
+
+    Args:
+        source (str): The RTSP URL or local file path of the video source.
+        options (dict): The "capture" configuration of the model: "backend" is "opencv" (default)
+            or "ffmpeg"; the FFmpeg backend decodes at "width" x "height", by default the source
+            size scaled down to fit input_shape.
+        input_shape (tuple): The (width, height) of the model input.
+
+    Returns:
+        cv2.VideoCapture or FFmpegCapture: The opened video source.
+    """
+    options = options or {}
+    backend = options.get('backend', 'opencv')
+    if backend == 'opencv':
+        return cv2.VideoCapture(source)
+    if backend != 'ffmpeg':
+        raise ValueError(f"Unknown capture backend: {backend}")
+
+    frame_size = probe_frame_size(source)
+    if 'width' in options and 'height' in options:
+        size = (options['width'], options['height'])
+    else:
+        if frame_size is None:
+            print("Error: Unable to determine the frame size of the video source.")
+            frame_size = input_shape
+        size = fit_size(frame_size, input_shape) if input_shape else frame_size
+    return FFmpegCapture(source, size, frame_size)
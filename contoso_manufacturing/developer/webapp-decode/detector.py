@@ -0,0 +1,244 @@
+import contextlib
+import cv2
+import datetime
+import time
+from capture import open_capture
+
+class Detector:
+    """
+    Base class for the webapp-decode detectors.
+
+    A detector reads frames from its video source and turns each one into an annotated frame
+    in three steps: preprocess (frame -> model inputs), predict (model inputs -> model outputs,
+    on the inference backend) and postprocess (frame + model outputs -> annotated frame). Every
+    frame is decoded once by read() and the same frame object is carried through all three steps,
+    so the overlay is always drawn on the frame that was sent to the model.
+    """
+
+    def open_source(self, rtsp_url):
+        """
+        Opens the video source with the configured capture backend and reads one frame to
+        determine the frame dimensions.
+
+        Args:
+            rtsp_url (str): The RTSP URL or local file path of the video source.
+        """
+        if getattr(self, 'cap', None) is not None:
+            self.cap.release()
+        input_shape = (int(self.input_width), int(self.input_height))
+        self.cap = open_capture(rtsp_url, getattr(self, 'capture_options', None), input_shape)
+
+        if not self.cap.isOpened():
+            print("Error: Unable to open video source.")
+        else:
+            # Read a frame to determine the size of the video frames
+            ret, frame = self.cap.read()
+            if ret:
+                self.img_height, self.img_width = frame.shape[:2]
+                print(f"Image dimensions: {self.img_width}x{self.img_height}")
+            else:
+                print("Failed to grab frame to set image dimensions")
+
+    def capture_scale(self):
+        """
+        Returns the ratio of the width the frames are decoded at to the width of the video source.
+
+        Returns:
+            float: 1.0 unless the FFmpeg capture backend scales the frames down.
+        """
+        return getattr(getattr(self, 'cap', None), 'scale', 1.0)
+
+    def should_skip(self):
+        """
+        Decides whether the next frame of the source is skipped.
+
+        Frames are skipped by the AdaptiveSkipScheduler when one is attached to the detector,
+        otherwise every skip_rate-th frame is skipped.
+
+        Returns:
+            bool: True if the frame should be skipped.
+        """
+        self.frame_number += 1
+        skip_scheduler = getattr(self, 'skip_scheduler', None)
+        if skip_scheduler is not None:
+            return not skip_scheduler.should_process()
+        # If mod = 0, the frame is read and skipped
+        return (self.skip_rate > 0) and (self.frame_number % self.skip_rate == 0)
+
+    def skip_ratio(self):
+        """
+        Returns the fraction of source frames that are currently skipped.
+
+        Returns:
+            float: The effective skip ratio.
+        """
+        skip_scheduler = getattr(self, 'skip_scheduler', None)
+        if skip_scheduler is not None:
+            return skip_scheduler.skip_ratio
+        return 1.0 / self.skip_rate if self.skip_rate > 0 else 0.0
+
+    def read(self):
+        """
+        Reads the next frame that should be processed, consuming the frames skipped by should_skip().
+
+        Returns:
+            np.ndarray: The decoded frame, or None if the video source failed.
+        """
+        while True:
+            if self.should_skip():
+                # Skipped frames are only grabbed, never color converted and copied into an image by retrieve()
+                if not self.cap.grab():
+                    print("Failed to grab frame")
+                    return None
+                continue
+
+            ret, img = self.cap.read()
+            if not ret:
+                print("Failed to grab frame")
+                return None
+            return img
+
+    def reserve_input_buffers(self, count):
+        """
+        Makes the preprocessor rotate through enough input tensors for count frames in flight.
+
+        Args:
+            count (int): The number of frames that can be preprocessed or in flight at the same time.
+        """
+        preprocessor = getattr(self, 'preprocessor', None)
+        if preprocessor is not None:
+            preprocessor.reserve(count)
+
+    def preprocess(self, img):
+        """
+        Converts a frame into model inputs.
+
+        Args:
+            img (np.ndarray): The frame returned by read().
+
+        Returns:
+            tuple: The inputs dict passed to predict() and a metadata object passed to postprocess().
+                The inputs are None when the detector annotates the frame without inference, in
+                which case postprocess() receives empty outputs.
+        """
+        raise NotImplementedError
+
+    def predict(self, inputs):
+        """
+        Runs inference on the model inputs.
+
+        Args:
+            inputs (dict): The inputs returned by preprocess().
+
+        Returns:
+            The model outputs.
+        """
+        return self.backend.predict(inputs)
+
+    def postprocess(self, img, outputs, meta=None):
+        """
+        Draws the model outputs on the frame.
+
+        Args:
+            img (np.ndarray): The frame the inputs were created from.
+            outputs: The outputs returned by predict().
+            meta: The metadata returned by preprocess().
+
+        Returns:
+            np.ndarray: The annotated frame.
+        """
+        raise NotImplementedError
+
+    def process(self, img):
+        """
+        Runs preprocess, predict and postprocess on a single frame.
+
+        Args:
+            img (np.ndarray): The frame returned by read().
+
+        Returns:
+            np.ndarray: The annotated frame.
+        """
+        inputs, meta = self.preprocess(img)
+        outputs = self.predict(inputs) if inputs is not None else {}
+        return self.postprocess(img, outputs, meta)
+
+    def run(self):
+        """
+        Reads and processes the next frame.
+
+        Returns:
+            np.ndarray: The annotated frame, or None if the video source failed.
+        """
+        self.log("Running detection...")
+
+        img = self.read()
+        if img is None:
+            return None
+        return self.process(img)
+
+    def timed(self, stage):
+        """
+        Returns a context manager recording the time spent in its block in the pipeline metrics.
+
+        Args:
+            stage (str): The stage name, e.g. "draw".
+
+        Returns:
+            A context manager, which records nothing when the detector does not run in a pipeline.
+        """
+        metrics = getattr(self, 'metrics', None)
+        if metrics is None:
+            return contextlib.nullcontext()
+        return metrics.time(stage)
+
+    def should_draw(self):
+        """
+        Tells whether postprocess() should draw the overlay on the frame.
+
+        The pipeline turns drawing off while nobody watches the annotated video, e.g. when every
+        viewer renders the overlay itself from the detection metadata.
+
+        Returns:
+            bool: True if the overlay should be drawn.
+        """
+        return getattr(self, 'draw_overlay', True)
+
+    def record_detections(self, **fields):
+        """
+        Records the detections of the frame being postprocessed, streamed by the pipeline as metadata.
+
+        Args:
+            **fields: The detections, JSON serializable, e.g. the boxes, classes and scores.
+        """
+        self.detections = fields
+
+    def publish_event(self, **fields):
+        """
+        Publishes the structured results of a frame on the event bus attached by the pipeline.
+
+        The results are also recorded as the detections of the frame.
+
+        Args:
+            **fields: The results, JSON serializable, e.g. the defects or the class and probability.
+                The timestamp and the model name are added.
+        """
+        self.record_detections(**fields)
+        event_bus = getattr(self, 'event_bus', None)
+        if event_bus is None:
+            return
+        event = {"timestamp": round(time.time(), 3), "model_name": self.model_name}
+        event.update(fields)
+        event_bus.publish(event)
+
+    def log(self, message):
+        """Logs a message with a timestamp if verbose is true."""
+        if self.verbose:
+            timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            print(f"{timestamp} - {message}")
+
+    def __del__(self):
+        print("Releasing resources...")
+        self.cap.release()
+        cv2.destroyAllWindows()
+        print("Released video capture and destroyed all windows.")
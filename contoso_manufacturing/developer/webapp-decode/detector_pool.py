@@ -0,0 +1,145 @@
+import collections
+import threading
+
+class DetectorPool:
+    """
+    Keeps recently used detector pipelines warm so switching models does not rebuild them.
+
+    Creating a pipeline re-reads the configuration, opens the RTSP stream, builds the gRPC client
+    and runs a warm-up inference, which takes seconds. When the last viewer of a model leaves, its
+    pipeline is paused instead of stopped: the video source stays connected and the next viewer
+    gets it back in milliseconds. Idle pipelines are stopped in least recently used order whenever
+    the pool exceeds its connection or memory budget.
+    """
+
+    def __init__(self, create_pipeline, max_detectors=3, max_memory_mb=0):
+        """
+        Args:
+            create_pipeline (callable): Function that takes a video name and returns a new
+                DetectorPipeline that was not started yet, or None if the video name is unknown.
+            max_detectors (int): Maximum number of pipelines (and RTSP / gRPC connections) kept open.
+            max_memory_mb (float): Maximum estimated frame buffer memory of all pipelines, 0 for no limit.
+        """
+        self.create_pipeline = create_pipeline
+        self.max_detectors = max(1, int(max_detectors))
+        self.max_memory_bytes = float(max_memory_mb) * 1024 * 1024
+        self.active = {}
+        self.idle = collections.OrderedDict()  # Least recently used first
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def checkout(self, video_name):
+        """
+        Returns a running pipeline for a video, resuming a warm one if available.
+
+        Args:
+            video_name (str): The name of the video.
+
+        Returns:
+            DetectorPipeline: The running pipeline, or None if the video name is unknown.
+        """
+        with self.lock:
+            pipeline = self.idle.pop(video_name, None)
+            if pipeline is not None:
+                self.hits += 1
+                pipeline.resume()
+                self.active[video_name] = pipeline
+                return pipeline
+            self.misses += 1
+
+        pipeline = self.create_pipeline(video_name)
+        if pipeline is None:
+            return None
+        pipeline.warm_up()
+        pipeline.start()
+
+        with self.lock:
+            self.active[video_name] = pipeline
+            evicted = self._evict()
+        self._stop(evicted)
+        return pipeline
+
+    def checkin(self, video_name):
+        """
+        Pauses the pipeline of a video that has no viewers left and keeps it warm.
+
+        Args:
+            video_name (str): The name of the video.
+        """
+        with self.lock:
+            pipeline = self.active.pop(video_name, None)
+            if pipeline is None:
+                return
+            pipeline.pause()
+            self.idle[video_name] = pipeline
+            evicted = self._evict()
+        self._stop(evicted)
+
+    def preload(self, video_names):
+        """
+        Creates and warms up the pipelines of the given videos without any viewer.
+
+        Args:
+            video_names (list): The names of the videos.
+        """
+        for video_name in video_names:
+            if self.checkout(video_name) is not None:
+                self.checkin(video_name)
+
+    def pipelines(self):
+        """
+        Returns every pipeline in the pool.
+
+        Returns:
+            dict: The active and idle pipelines keyed by video name.
+        """
+        with self.lock:
+            pipelines = dict(self.idle)
+            pipelines.update(self.active)
+            return pipelines
+
+    def _memory_bytes(self):
+        pipelines = list(self.active.values()) + list(self.idle.values())
+        return sum(pipeline.memory_bytes() for pipeline in pipelines)
+
+    def _over_budget(self):
+        if len(self.active) + len(self.idle) > self.max_detectors:
+            return True
+        return self.max_memory_bytes > 0 and self._memory_bytes() > self.max_memory_bytes
+
+    def _evict(self):
+        # Only idle pipelines are evicted; pipelines with viewers always keep running
+        evicted = []
+        while self.idle and self._over_budget():
+            video_name, pipeline = self.idle.popitem(last=False)
+            self.evictions += 1
+            evicted.append((video_name, pipeline))
+        return evicted
+
+    def _stop(self, evicted):
+        # Stopping joins the stage threads, and a capture blocked on a dead camera would hang the
+        # viewer request that triggered the eviction, so evicted pipelines are stopped in the background
+        for video_name, pipeline in evicted:
+            print(f"Evicting idle pipeline for {video_name}")
+            threading.Thread(target=pipeline.stop, name=f"{video_name}-evict", daemon=True).start()
+
+    def stats(self):
+        """
+        Returns the pool statistics.
+
+        Returns:
+            dict: The active and idle video names, hits, misses, evictions and estimated memory.
+        """
+        with self.lock:
+            return {
+                "active": list(self.active),
+                "idle": list(self.idle),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "max_detectors": self.max_detectors,
+                "memory_mb": self._memory_bytes() / (1024 * 1024),
+                "max_memory_mb": self.max_memory_bytes / (1024 * 1024),
+            }
@@ -0,0 +1,284 @@
+import collections
+import json
+import threading
+import time
+
+class EventBus:
+    """
+    In-process publish/subscribe bus for the structured per-frame results of the detectors.
+
+    The detectors publish one small dict per processed frame (timestamp, model, defects,
+    dimensions, class and probability) next to the overlay they burn into the frame, so
+    downstream systems can count defects without decoding the video. publish() only hands the
+    event to every subscriber, which must return quickly: sinks that write to a file or a
+    broker buffer the events and write them in batches on their own thread.
+    """
+
+    def __init__(self):
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self.published = 0
+
+    def subscribe(self, subscriber):
+        """
+        Adds a subscriber.
+
+        Args:
+            subscriber (callable): Called with every published event.
+        """
+        with self.lock:
+            self.subscribers = self.subscribers + [subscriber]
+
+    def unsubscribe(self, subscriber):
+        """
+        Removes a subscriber.
+
+        Args:
+            subscriber (callable): A subscriber added with subscribe().
+        """
+        with self.lock:
+            self.subscribers = [s for s in self.subscribers if s is not subscriber]
+
+    def publish(self, event):
+        """
+        Hands an event to every subscriber.
+
+        Args:
+            event (dict): The event, JSON serializable.
+        """
+        with self.lock:
+            subscribers = self.subscribers
+            self.published += 1
+        for subscriber in subscribers:
+            try:
+                subscriber(event)
+            except Exception as e:
+                print(f"Error delivering event to {subscriber}: {e}")
+
+    def close(self):
+        """Closes every subscriber that has a close() method, which flushes the batched sinks."""
+        with self.lock:
+            subscribers, self.subscribers = self.subscribers, []
+        for subscriber in subscribers:
+            close = getattr(subscriber, 'close', None)
+            if close is not None:
+                close()
+
+    def stats(self):
+        """
+        Returns the bus statistics.
+
+        Returns:
+            dict: The number of published events and the statistics of every sink.
+        """
+        with self.lock:
+            subscribers = self.subscribers
+            published = self.published
+        sinks = [s.stats() for s in subscribers if hasattr(s, 'stats')]
+        return {"published": published, "sinks": sinks}
+
+class BatchedEventSink:
+    """
+    Subscriber of the EventBus that writes the events in batches on a background thread.
+
+    A batch is written when max_batch_size events are buffered or when the oldest buffered
+    event is max_interval seconds old, whichever comes first. When the writer cannot keep up,
+    at most max_buffered events are kept and the oldest ones are dropped, so a slow or
+    unreachable broker never blocks the detectors.
+    """
+
+    def __init__(self, writer, max_batch_size=100, max_interval=1.0, max_buffered=10000):
+        """
+        Args:
+            writer: The JSONLWriter or MQTTWriter that writes a list of events.
+            max_batch_size (int): Number of events that triggers a write.
+            max_interval (float): Maximum number of seconds an event waits for its batch to be written.
+            max_buffered (int): Maximum number of events buffered, the oldest are dropped beyond it.
+        """
+        self.writer = writer
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_interval = max_interval
+        self.events = collections.deque(maxlen=max_buffered)
+        self.condition = threading.Condition()
+        self.oldest_time = None
+        self.closed = False
+
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+        self.errors = 0
+
+        self.thread = threading.Thread(target=self._flush_loop, name=f"events-{writer.name}", daemon=True)
+        self.thread.start()
+
+    def __call__(self, event):
+        """
+        Buffers an event.
+
+        Args:
+            event (dict): The event published on the bus.
+        """
+        with self.condition:
+            if self.closed:
+                return
+            if len(self.events) == self.events.maxlen:
+                self.dropped += 1
+            if not self.events:
+                self.oldest_time = time.monotonic()
+            self.events.append(event)
+            if len(self.events) >= self.max_batch_size:
+                self.condition.notify()
+
+    def _batch_ready(self):
+        if self.closed or len(self.events) >= self.max_batch_size:
+            return True
+        return bool(self.events) and time.monotonic() - self.oldest_time >= self.max_interval
+
+    def _flush_loop(self):
+        while True:
+            with self.condition:
+                while not self._batch_ready():
+                    timeout = self.max_interval
+                    if self.events:
+                        timeout = max(0.0, self.oldest_time + self.max_interval - time.monotonic())
+                    self.condition.wait(timeout)
+                batch = [self.events.popleft() for _ in range(min(self.max_batch_size, len(self.events)))]
+                if self.events:
+                    # The remaining events are newer, the next batch is due max_interval after now at the latest
+                    self.oldest_time = time.monotonic()
+                closing = self.closed and not self.events
+            if batch:
+                self._write(batch)
+            if closing:
+                return
+
+    def _write(self, batch):
+        try:
+            self.writer.write(batch)
+        except Exception as e:
+            print(f"Error writing {len(batch)} events to {self.writer.name}: {e}")
+            with self.condition:
+                self.errors += 1
+            return
+        with self.condition:
+            self.written += len(batch)
+            self.batches += 1
+
+    def close(self):
+        """Writes the buffered events and stops the background thread."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+        self.writer.close()
+
+    def stats(self):
+        """
+        Returns the sink statistics.
+
+        Returns:
+            dict: The writer name, the number of events written, batches written, events
+                dropped because the buffer was full, failed writes and events still buffered.
+        """
+        with self.condition:
+            return {
+                "sink": self.writer.name,
+                "written": self.written,
+                "batches": self.batches,
+                "dropped": self.dropped,
+                "errors": self.errors,
+                "buffered": len(self.events),
+            }
+
+class JSONLWriter:
+    """Appends events to a file, one JSON object per line."""
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): The file to append to.
+        """
+        self.name = f"jsonl:{path}"
+        self.file = open(path, "a")
+
+    def write(self, events):
+        """
+        Appends a batch of events.
+
+        Args:
+            events (list): The events.
+        """
+        self.file.write("".join(json.dumps(event, separators=(",", ":")) + "\n" for event in events))
+        self.file.flush()
+
+    def close(self):
+        """Closes the file."""
+        self.file.close()
+
+class MQTTWriter:
+    """
+    Publishes each batch of events as one MQTT message, a JSON array of the events.
+
+    Requires the paho-mqtt package (pip install paho-mqtt).
+    """
+
+    def __init__(self, host, port=1883, topic="contoso/defects", qos=0, client_id=""):
+        """
+        Args:
+            host (str): The MQTT broker host.
+            port (int): The MQTT broker port.
+            topic (str): The topic the batches are published to.
+            qos (int): The MQTT quality of service of the messages.
+            client_id (str): The MQTT client id, generated by the broker when empty.
+        """
+        try:
+            import paho.mqtt.client as mqtt
+        except ImportError as e:
+            raise ImportError("The MQTT event sink requires the paho-mqtt package: pip install paho-mqtt") from e
+
+        self.name = f"mqtt://{host}:{port}/{topic}"
+        self.topic = topic
+        self.qos = qos
+        if hasattr(mqtt, 'CallbackAPIVersion'):
+            self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id)
+        else:
+            self.client = mqtt.Client(client_id=client_id)
+        # Connects in the background and reconnects automatically, messages are queued meanwhile
+        self.client.connect_async(host, port)
+        self.client.loop_start()
+
+    def write(self, events):
+        """
+        Publishes a batch of events.
+
+        Args:
+            events (list): The events.
+        """
+        self.client.publish(self.topic, json.dumps(events, separators=(",", ":")), qos=self.qos)
+
+    def close(self):
+        """Disconnects from the broker."""
+        self.client.loop_stop()
+        self.client.disconnect()
+
+def make_event_sinks(jsonl_path="", mqtt_url="", mqtt_topic="contoso/defects", max_batch_size=100, max_interval=1.0):
+    """
+    Creates the batched sinks of the detector events.
+
+    Args:
+        jsonl_path (str): The JSON Lines file to append the events to, or empty for none.
+        mqtt_url (str): The host[:port] of the MQTT broker to publish the events to, or empty for none.
+        mqtt_topic (str): The MQTT topic.
+        max_batch_size (int): Number of events that triggers a write.
+        max_interval (float): Maximum number of seconds an event waits for its batch to be written.
+
+    Returns:
+        list: The BatchedEventSinks, to subscribe to the EventBus.
+    """
+    writers = []
+    if jsonl_path:
+        writers.append(JSONLWriter(jsonl_path))
+    if mqtt_url:
+        host, _, port = mqtt_url.partition(':')
+        writers.append(MQTTWriter(host, int(port or 1883), mqtt_topic))
+    return [BatchedEventSink(writer, max_batch_size, max_interval) for writer in writers]
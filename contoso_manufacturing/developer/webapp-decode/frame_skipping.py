@@ -0,0 +1,143 @@
+import threading
+import time
+
+class AdaptiveSkipScheduler:
+    """
+    Decides which captured frames are sent to inference to meet a target FPS or end-to-end latency.
+
+    The pipeline reports how long each frame spends in preprocess, predict and postprocess and
+    its latency from capture to annotated frame. From these the scheduler estimates how many
+    frames per second the pipeline can sustain and keeps just enough frames of the source to
+    stay within that capacity and the optional target FPS. When a target latency is set, the
+    keep ratio is additionally lowered multiplicatively while the measured latency is above the
+    target and raised slowly again once it is comfortably below it.
+
+    Frames are kept with an error accumulator rather than a modulus, so any skip ratio between
+    0 and max_skip_ratio is spread evenly over the stream.
+    """
+
+    STAGES = ("preprocess", "predict", "postprocess")
+
+    def __init__(self, target_fps=0, target_latency_ms=0, max_in_flight=1, max_skip_ratio=0.95, smoothing=0.1, headroom=0.9):
+        """
+        Args:
+            target_fps (float): Maximum number of frames per second to process, 0 for as many as the pipeline sustains.
+            target_latency_ms (float): Target latency from capture to annotated frame, 0 for no latency target.
+            max_in_flight (int): Number of predict calls the pipeline keeps in flight.
+            max_skip_ratio (float): Maximum fraction of the source frames that may be skipped.
+            smoothing (float): Weight of a new measurement in the moving averages, between 0 and 1.
+            headroom (float): Fraction of the estimated capacity the scheduler aims for, leaving room for jitter.
+        """
+        self.target_fps = float(target_fps)
+        self.target_latency = float(target_latency_ms) / 1000.0
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.min_keep_ratio = 1.0 - max_skip_ratio
+        self.smoothing = smoothing
+        self.headroom = headroom
+        self.lock = threading.Lock()
+
+        # Moving averages of the stage times, the latency and the interval between source frames
+        self.stage_times = dict.fromkeys(self.STAGES, 0.0)
+        self.latency = 0.0
+        self.source_interval = 0.0
+        self.last_source_time = None
+
+        self.keep_ratio = 1.0
+        self.latency_scale = 1.0
+        self.credit = 0.0
+        self.seen = 0
+        self.skipped = 0
+
+    def _average(self, current, value):
+        return value if current == 0.0 else current + self.smoothing * (value - current)
+
+    def should_process(self):
+        """
+        Called for every frame read from the source.
+
+        Returns:
+            bool: True if the frame should be decoded and sent to inference, False if it should be skipped.
+        """
+        now = time.perf_counter()
+        with self.lock:
+            if self.last_source_time is not None:
+                self.source_interval = self._average(self.source_interval, now - self.last_source_time)
+            self.last_source_time = now
+            self.seen += 1
+
+            self.credit += self.keep_ratio
+            if self.credit >= 1.0:
+                self.credit -= 1.0
+                return True
+            self.skipped += 1
+            return False
+
+    def record_stage(self, stage, seconds):
+        """
+        Records the time a frame spent in one stage.
+
+        Args:
+            stage (str): One of "preprocess", "predict" or "postprocess".
+            seconds (float): The time spent in the stage.
+        """
+        with self.lock:
+            self.stage_times[stage] = self._average(self.stage_times[stage], seconds)
+
+    def record_frame(self, latency):
+        """
+        Records the latency of a processed frame and updates the keep ratio.
+
+        Args:
+            latency (float): Seconds from capture of the frame until its annotation finished.
+        """
+        with self.lock:
+            self.latency = self._average(self.latency, latency)
+
+            if self.target_latency > 0:
+                if self.latency > self.target_latency:
+                    self.latency_scale = max(self.min_keep_ratio, self.latency_scale * 0.9)
+                elif self.latency < 0.8 * self.target_latency:
+                    self.latency_scale = min(1.0, self.latency_scale + 0.02)
+
+            self.keep_ratio = min(1.0, max(self.min_keep_ratio, self._fps_keep_ratio() * self.latency_scale))
+
+    def _fps_keep_ratio(self):
+        if self.source_interval <= 0:
+            return 1.0
+        source_fps = 1.0 / self.source_interval
+
+        # The stages run concurrently, so the slowest stage bounds the throughput
+        bottleneck = max(
+            self.stage_times["preprocess"],
+            self.stage_times["predict"] / self.max_in_flight,
+            self.stage_times["postprocess"],
+        )
+        fps = self.headroom / bottleneck if bottleneck > 0 else source_fps
+        if self.target_fps > 0:
+            fps = min(fps, self.target_fps)
+        return fps / source_fps
+
+    @property
+    def skip_ratio(self):
+        """float: The fraction of source frames currently skipped."""
+        return 1.0 - self.keep_ratio
+
+    def stats(self):
+        """
+        Returns the scheduler statistics.
+
+        Returns:
+            dict: The targets, effective skip ratio, source FPS, smoothed stage times and latency,
+                and the number of frames seen and skipped.
+        """
+        with self.lock:
+            return {
+                "target_fps": self.target_fps,
+                "target_latency_ms": 1000 * self.target_latency,
+                "skip_ratio": 1.0 - self.keep_ratio,
+                "source_fps": 1.0 / self.source_interval if self.source_interval > 0 else 0.0,
+                "stage_ms": {stage: 1000 * seconds for stage, seconds in self.stage_times.items()},
+                "latency_ms": 1000 * self.latency,
+                "frames_seen": self.seen,
+                "frames_skipped": self.skipped,
+            }
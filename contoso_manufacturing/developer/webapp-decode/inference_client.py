@@ -0,0 +1,151 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+class AsyncInferenceClient:
+    """
+    Keeps several predict calls in flight for one model and hands the results back in order.
+
+    The synchronous ovmsclient predict() leaves OVMS idle during every network round trip and
+    while the next frame is preprocessed. This client runs up to max_in_flight predict() calls on
+    worker threads, so new requests are already queued on the server while earlier responses are
+    on the wire. Results are returned by next_result() in submission order, which keeps the
+    postprocess stage and the output stream in frame order.
+    """
+
+    def __init__(self, predict, max_in_flight=1, name="ovms"):
+        """
+        Args:
+            predict (callable): Function that takes the model inputs and returns the model outputs.
+            max_in_flight (int): Maximum number of predict calls submitted but not yet consumed.
+            name (str): Name used for the worker threads.
+        """
+        self.predict = predict
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix=f"{name}-predict")
+        self.slots = threading.Semaphore(self.max_in_flight)
+        self.pending = queue.Queue()
+        self.lock = threading.Lock()
+
+        # Track the number of running predict calls over time to report the achieved concurrency
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.in_flight_seconds = 0.0
+        self.total_latency = 0.0
+        self.completed = 0
+        self.failed = 0
+        self.start_time = time.perf_counter()
+        self.last_change = self.start_time
+
+    def _update_in_flight(self, delta):
+        with self.lock:
+            now = time.perf_counter()
+            self.in_flight_seconds += self.in_flight * (now - self.last_change)
+            self.last_change = now
+            self.in_flight += delta
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def _run(self, inputs):
+        self._update_in_flight(1)
+        start = time.perf_counter()
+        try:
+            return self.predict(inputs)
+        finally:
+            latency = time.perf_counter() - start
+            self._update_in_flight(-1)
+            with self.lock:
+                self.total_latency += latency
+
+    def submit(self, inputs, context=None, timeout=None):
+        """
+        Starts a predict call, waiting for a free slot if max_in_flight calls are outstanding.
+
+        Args:
+            inputs (dict): The model inputs.
+            context: Any object that should be returned together with the outputs, e.g. the frame.
+            timeout (float): Maximum number of seconds to wait for a free slot, or None to wait forever.
+
+        Returns:
+            bool: True if the call was submitted, False if no slot became free within the timeout.
+        """
+        if not self.slots.acquire(timeout=timeout):
+            return False
+        self.pending.put((self.executor.submit(self._run, inputs), context, True))
+        return True
+
+    def submit_result(self, outputs, context=None, timeout=None):
+        """
+        Queues outputs that need no predict call, so next_result() returns them in submission order.
+
+        Args:
+            outputs: The outputs to return, e.g. empty outputs for a frame annotated without inference.
+            context: Any object that should be returned together with the outputs.
+            timeout (float): Maximum number of seconds to wait for a free slot, or None to wait forever.
+
+        Returns:
+            bool: True if the outputs were queued, False if no slot became free within the timeout.
+        """
+        if not self.slots.acquire(timeout=timeout):
+            return False
+        future = Future()
+        future.set_result(outputs)
+        self.pending.put((future, context, False))
+        return True
+
+    def next_result(self, timeout=None):
+        """
+        Waits for the oldest submitted call to finish and returns its result.
+
+        Args:
+            timeout (float): Maximum number of seconds to wait for a submitted call, or None to wait forever.
+
+        Returns:
+            tuple: (outputs, context) of the oldest call, or None if nothing was submitted within the timeout.
+                outputs is None if the predict call raised an exception.
+        """
+        try:
+            future, context, predicted = self.pending.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+        try:
+            outputs = future.result()
+            if predicted:
+                with self.lock:
+                    self.completed += 1
+        except Exception as e:
+            print(f"Inference request failed: {e}")
+            outputs = None
+            with self.lock:
+                self.failed += 1
+        finally:
+            self.slots.release()
+        return outputs, context
+
+    def stats(self):
+        """
+        Returns the inference statistics since the client was created.
+
+        Returns:
+            dict: Completed and failed calls, current and peak in-flight calls, the achieved
+                concurrency (time-averaged number of running predict calls), mean latency and throughput.
+        """
+        with self.lock:
+            now = time.perf_counter()
+            elapsed = now - self.start_time
+            in_flight_seconds = self.in_flight_seconds + self.in_flight * (now - self.last_change)
+            return {
+                "max_in_flight": self.max_in_flight,
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "concurrency": in_flight_seconds / elapsed if elapsed > 0 else 0.0,
+                "completed": self.completed,
+                "failed": self.failed,
+                "mean_latency_ms": 1000 * self.total_latency / self.completed if self.completed else 0.0,
+                "throughput_fps": self.completed / elapsed if elapsed > 0 else 0.0,
+            }
+
+    def close(self):
+        """Waits for the running predict calls and shuts down the worker threads."""
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,165 @@
+import bisect
+import contextlib
+import threading
+import time
+
+# Upper bounds in seconds of the stage duration histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+class Histogram:
+    """Thread-safe histogram with fixed buckets, in the layout of a Prometheus histogram."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        Args:
+            buckets (tuple): The sorted upper bounds of the buckets, +Inf is added automatically.
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        """
+        Records a value.
+
+        Args:
+            value (float): The value to record.
+        """
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        """
+        Returns a consistent copy of the histogram.
+
+        Returns:
+            tuple: The cumulative count per bucket (the last one being +Inf), the sum and the count.
+        """
+        with self.lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+        cumulative = []
+        running = 0
+        for bucket_count in counts:
+            running += bucket_count
+            cumulative.append(running)
+        return cumulative, total, count
+
+class PipelineMetrics:
+    """
+    Per-stage duration histograms of one detector pipeline.
+
+    The pipeline records capture, preprocess, predict, postprocess and encode for every frame;
+    the detectors record draw, the part of postprocess that annotates the frame.
+    """
+
+    STAGES = ("capture", "preprocess", "predict", "postprocess", "draw", "encode", "encode_raw", "encode_fmp4")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.histograms = {stage: Histogram(buckets) for stage in self.STAGES}
+
+    def observe(self, stage, seconds):
+        """
+        Records the time a frame spent in a stage.
+
+        Args:
+            stage (str): One of STAGES.
+            seconds (float): The time spent in the stage.
+        """
+        self.histograms[stage].observe(seconds)
+
+    @contextlib.contextmanager
+    def time(self, stage):
+        """
+        Context manager recording the time spent in its block.
+
+        Args:
+            stage (str): One of STAGES.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+def _labels(**labels):
+    return ",".join(f'{name}="{value}"' for name, value in labels.items())
+
+def _format_bucket(bound):
+    return "+Inf" if bound is None else repr(float(bound))
+
+def format_prometheus(pipelines):
+    """
+    Formats the metrics of the pipelines in the Prometheus text exposition format.
+
+    Args:
+        pipelines (dict): The DetectorPipelines keyed by video name.
+
+    Returns:
+        str: The metrics text.
+    """
+    lines = [
+        "# HELP webapp_stage_duration_seconds Time a frame spent in each pipeline stage.",
+        "# TYPE webapp_stage_duration_seconds histogram",
+    ]
+    stats = {}
+    for video_name, pipeline in pipelines.items():
+        stats[video_name] = pipeline.stats()
+        for stage, histogram in pipeline.metrics.histograms.items():
+            cumulative, total, count = histogram.snapshot()
+            labels = _labels(video=video_name, model=pipeline.model_name, stage=stage)
+            for bound, bucket_count in zip(list(histogram.buckets) + [None], cumulative):
+                lines.append(f'webapp_stage_duration_seconds_bucket{{{labels},le="{_format_bucket(bound)}"}} {bucket_count}')
+            lines.append(f"webapp_stage_duration_seconds_sum{{{labels}}} {total}")
+            lines.append(f"webapp_stage_duration_seconds_count{{{labels}}} {count}")
+
+    lines += [
+        "# HELP webapp_dropped_frames_total Frames replaced in a stage queue or skipped by a slow viewer before being consumed.",
+        "# TYPE webapp_dropped_frames_total counter",
+    ]
+    for video_name, pipeline_stats in stats.items():
+        for queue, dropped in pipeline_stats["dropped_frames"].items():
+            lines.append(f"webapp_dropped_frames_total{{{_labels(video=video_name, queue=queue)}}} {dropped}")
+
+    lines += [
+        "# HELP webapp_queue_depth Frames waiting in each stage queue, and predict calls in flight.",
+        "# TYPE webapp_queue_depth gauge",
+    ]
+    for video_name, pipeline_stats in stats.items():
+        for queue, depth in pipeline_stats["queue_depth"].items():
+            lines.append(f"webapp_queue_depth{{{_labels(video=video_name, queue=queue)}}} {depth}")
+
+    per_pipeline = [
+        ("webapp_inference_failed_total", "counter", "Predict calls that raised an exception.", "failed"),
+        ("webapp_skip_ratio", "gauge", "Fraction of source frames skipped before inference.", "skip_ratio"),
+        ("webapp_subscribers", "gauge", "Viewers streaming the pipeline output.", "subscribers"),
+    ]
+    for name, metric_type, description, key in per_pipeline:
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} {metric_type}"]
+        for video_name, pipeline_stats in stats.items():
+            lines.append(f"{name}{{{_labels(video=video_name)}}} {pipeline_stats[key]}")
+
+    lines += [
+        "# HELP webapp_stream_subscribers Viewers streaming the annotated video, the detection metadata or the raw video.",
+        "# TYPE webapp_stream_subscribers gauge",
+    ]
+    for video_name, pipeline_stats in stats.items():
+        for stream, subscribers in pipeline_stats["stream_subscribers"].items():
+            lines.append(f"webapp_stream_subscribers{{{_labels(video=video_name, stream=stream)}}} {subscribers}")
+
+    motion_gate = [
+        ("webapp_motion_gated_frames_total", "Frames of a static scene annotated with the last result instead of inference.", "gated"),
+        ("webapp_motion_saved_seconds_total", "Estimated preprocess and predict time saved by the motion gate.", "saved_seconds"),
+    ]
+    for name, description, key in motion_gate:
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} counter"]
+        for video_name, pipeline_stats in stats.items():
+            if "motion_gate" in pipeline_stats:
+                lines.append(f"{name}{{{_labels(video=video_name)}}} {pipeline_stats['motion_gate'][key]}")
+
+    return "\n".join(lines) + "\n"
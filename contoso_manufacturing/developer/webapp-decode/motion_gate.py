@@ -0,0 +1,96 @@
+import threading
+import cv2
+import numpy as np
+
+class MotionGate:
+    """
+    Decides whether a frame changed enough since the last inferred frame to run the model again.
+
+    Every frame is reduced to a small gray thumbnail (area interpolation averages out the sensor
+    noise) and compared with the thumbnail of the last frame sent to inference. When less than
+    threshold of the thumbnail pixels changed by more than pixel_threshold gray levels, the scene
+    is static and the pipeline reuses the last detection result instead of calling the model.
+    Comparing with the last inferred frame rather than the previous frame keeps slow changes,
+    e.g. a part creeping along a conveyor, from slipping through one small step at a time.
+    After max_static_frames gated frames in a row the model runs anyway, so the overlay
+    recovers from changes too small for the gate.
+    """
+
+    def __init__(self, threshold=0.01, pixel_threshold=12, width=64, max_static_frames=30):
+        """
+        Args:
+            threshold (float): Fraction of the thumbnail pixels that must change for the frame to be inferred.
+            pixel_threshold (int): Gray level difference above which a thumbnail pixel counts as changed.
+            width (int): Width of the thumbnail in pixels, its height keeps the aspect ratio of the frame.
+            max_static_frames (int): Maximum number of frames gated in a row, 0 for no limit.
+        """
+        self.threshold = threshold
+        self.pixel_threshold = pixel_threshold
+        self.width = max(1, int(width))
+        self.max_static_frames = max_static_frames
+        self.lock = threading.Lock()
+
+        self.reference = None
+        self.static_frames = 0
+        self.change = 1.0
+        self.inferred = 0
+        self.gated = 0
+
+    def thumbnail(self, frame):
+        """
+        Reduces a frame to the gray thumbnail the gate compares.
+
+        Args:
+            frame (np.ndarray): The BGR frame.
+
+        Returns:
+            np.ndarray: The thumbnail.
+        """
+        height = max(1, round(frame.shape[0] * self.width / frame.shape[1]))
+        small = cv2.resize(frame, (self.width, height), interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+
+    def should_infer(self, frame):
+        """
+        Called for every frame before it is preprocessed.
+
+        Args:
+            frame (np.ndarray): The frame.
+
+        Returns:
+            bool: True if the frame should be sent to inference, False if the last result can be reused.
+        """
+        thumbnail = self.thumbnail(frame)
+        with self.lock:
+            if self.reference is not None and self.reference.shape == thumbnail.shape:
+                self.change = np.count_nonzero(cv2.absdiff(thumbnail, self.reference) > self.pixel_threshold) / thumbnail.size
+                if self.change < self.threshold and (self.max_static_frames <= 0 or self.static_frames < self.max_static_frames):
+                    self.static_frames += 1
+                    self.gated += 1
+                    return False
+            self.reference = thumbnail
+            self.static_frames = 0
+            self.inferred += 1
+            return True
+
+    def reset(self):
+        """Makes the next frame run the model, e.g. when the last result could not be produced."""
+        with self.lock:
+            self.reference = None
+
+    def stats(self):
+        """
+        Returns the gate statistics.
+
+        Returns:
+            dict: The numbers of inferred and gated frames, the fraction of frames gated and the
+                fraction of the thumbnail that changed on the last frame.
+        """
+        with self.lock:
+            total = self.inferred + self.gated
+            return {
+                "inferred": self.inferred,
+                "gated": self.gated,
+                "gated_ratio": self.gated / total if total else 0.0,
+                "change": self.change,
+            }
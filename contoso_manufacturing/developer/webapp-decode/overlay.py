@@ -0,0 +1,177 @@
+import collections
+import cv2
+import numpy as np
+
+class OverlayRenderer:
+    """
+    Draws the detector overlays with as little work per frame as possible.
+
+    Labels are pre-rendered once into small sprites (the filled background with the text on it),
+    cached by text and style, and copied into the frame on the following frames. Pose limbs are
+    drawn with one polylines call per limb type for all people, and the semi-transparent limb
+    layer is blended only inside the rectangles around the poses instead of over the whole frame.
+    """
+
+    def __init__(self, max_sprites=512):
+        """
+        Args:
+            max_sprites (int): Number of label sprites kept, the least recently used are dropped.
+        """
+        self.max_sprites = max_sprites
+        self.sprites = collections.OrderedDict()
+
+    def _sprite(self, text, font_face, font_scale, thickness, text_color, background_color, padding):
+        key = (text, font_face, font_scale, thickness, text_color, background_color, padding)
+        sprite = self.sprites.get(key)
+        if sprite is not None:
+            self.sprites.move_to_end(key)
+            return sprite
+
+        (text_width, text_height), _ = cv2.getTextSize(text, font_face, font_scale, thickness)
+        left, top, right, bottom = padding
+        # Same extent as cv2.rectangle() with both corners included
+        image = np.empty((top + text_height + bottom + 1, left + text_width + right + 1, 3), dtype=np.uint8)
+        image[:] = background_color
+        cv2.putText(image, text, (left, top + text_height), font_face, font_scale, text_color, thickness, cv2.LINE_AA)
+        sprite = (image, text_width, text_height)
+
+        self.sprites[key] = sprite
+        if len(self.sprites) > self.max_sprites:
+            self.sprites.popitem(last=False)
+        return sprite
+
+    @staticmethod
+    def _blit(img, sprite, x, y):
+        # Copies the sprite with its top left corner at (x, y), clipped to the image
+        height, width = sprite.shape[:2]
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + width, img.shape[1]), min(y + height, img.shape[0])
+        if x0 < x1 and y0 < y1:
+            img[y0:y1, x0:x1] = sprite[y0 - y:y1 - y, x0 - x:x1 - x]
+
+    def text_size(self, text, font_face=cv2.FONT_HERSHEY_SIMPLEX, font_scale=1.0, thickness=1, text_color=(0, 0, 0), background_color=(0, 0, 255), padding=(0, 0, 0, 0)):
+        """
+        Returns the size of a label text, from the sprite cache.
+
+        Returns:
+            tuple: The width and height of the text as returned by cv2.getTextSize().
+        """
+        _, width, height = self._sprite(text, font_face, font_scale, thickness, text_color, background_color, padding)
+        return width, height
+
+    def label(self, img, text, origin, font_face=cv2.FONT_HERSHEY_SIMPLEX, font_scale=1.0, thickness=1, text_color=(0, 0, 0), background_color=(0, 0, 255), padding=(0, 0, 0, 0)):
+        """
+        Draws a text on a filled background.
+
+        Args:
+            img (np.ndarray): The frame to draw on.
+            text (str): The text.
+            origin (tuple): The bottom left corner of the text, as for cv2.putText().
+            font_face (int): The OpenCV font.
+            font_scale (float): The font scale.
+            thickness (int): The thickness of the text strokes.
+            text_color (tuple): The BGR color of the text.
+            background_color (tuple): The BGR color of the background.
+            padding (tuple): The background margins around the text: left, top, right and bottom.
+
+        Returns:
+            tuple: The width and height of the text as returned by cv2.getTextSize().
+        """
+        image, width, height = self._sprite(text, font_face, font_scale, thickness, text_color, background_color, padding)
+        self._blit(img, image, int(origin[0]) - padding[0], int(origin[1]) - height - padding[1])
+        return width, height
+
+    def poses(self, img, poses, skeleton, colors, point_score_threshold, stick_width=4, alpha=0.6, draw_ellipses=False):
+        """
+        Draws the joints and the semi-transparent limbs of poses.
+
+        Args:
+            img (np.ndarray): The frame to draw on.
+            poses (np.ndarray): The (people, joints, 3 or more) poses: x, y and score of every joint.
+            skeleton (list): The pairs of joints connected by a limb.
+            colors (list): The BGR color of every joint; a limb takes the color of its second joint.
+            point_score_threshold (float): Score above which a joint is drawn.
+            stick_width (int): The thickness of the limbs.
+            alpha (float): The opacity of the limbs.
+            draw_ellipses (bool): Draw the limbs as ellipses instead of lines.
+
+        Returns:
+            np.ndarray: The frame.
+        """
+        if poses.size == 0:
+            return img
+
+        points = poses[:, :, :2].astype(np.int32)
+        visible = poses[:, :, 2] > point_score_threshold
+        people = np.flatnonzero(visible.any(axis=1))
+        if people.size == 0:
+            return img
+
+        # The regions that can change around every pose, with a margin for the joint circles and
+        # the limb thickness, merged where they overlap so no pixel is blended twice
+        margin = stick_width + 2
+        size = np.array((img.shape[1], img.shape[0]))
+        rects = []
+        for person in people:
+            person_points = points[person, visible[person]]
+            rects.append(np.concatenate((
+                np.maximum(person_points.min(axis=0) - margin, 0),
+                np.minimum(person_points.max(axis=0) + margin + 1, size)
+            )))
+        rects = self._merge_rects(rects)
+        if not rects:
+            return img
+
+        # The limb layer only holds copies of the regions, the rest of it is never drawn on or read
+        x0, y0 = np.min(rects, axis=0)[:2]
+        x1, y1 = np.max(rects, axis=0)[2:]
+        limbs = np.empty((y1 - y0, x1 - x0, 3), dtype=img.dtype)
+        for rx0, ry0, rx1, ry1 in rects:
+            limbs[ry0 - y0:ry1 - y0, rx0 - x0:rx1 - x0] = img[ry0:ry1, rx0:rx1]
+        offset = np.array((x0, y0), dtype=np.int32)
+
+        # Joints are drawn on the frame and blended with the limb layer, which does not have them
+        for joint in range(points.shape[1]):
+            color = colors[joint]
+            for p in points[visible[:, joint], joint]:
+                cv2.circle(img, (int(p[0]), int(p[1])), 1, color, 2)
+
+        for i, j in skeleton:
+            both = visible[:, i] & visible[:, j]
+            if not both.any():
+                continue
+            segments = np.stack((points[both, i], points[both, j]), axis=1) - offset
+            if draw_ellipses:
+                for start, end in segments:
+                    middle = (start + end) // 2
+                    vec = start - end
+                    length = np.sqrt((vec * vec).sum())
+                    angle = int(np.arctan2(vec[1], vec[0]) * 180 / np.pi)
+                    polygon = cv2.ellipse2Poly((int(middle[0]), int(middle[1])), (int(length / 2), min(int(length / 50), stick_width)), angle, 0, 360, 1)
+                    cv2.fillConvexPoly(limbs, polygon, colors[j])
+            else:
+                cv2.polylines(limbs, list(segments), False, colors[j], thickness=stick_width)
+
+        for rx0, ry0, rx1, ry1 in rects:
+            roi = img[ry0:ry1, rx0:rx1]
+            roi[:] = cv2.addWeighted(roi, 1 - alpha, limbs[ry0 - y0:ry1 - y0, rx0 - x0:rx1 - x0], alpha, 0)
+        return img
+
+    @staticmethod
+    def _merge_rects(rects):
+        # Merges overlapping (x0, y0, x1, y1) rectangles into their bounding rectangles until none overlap
+        rects = [[int(v) for v in rect] for rect in rects if rect[0] < rect[2] and rect[1] < rect[3]]
+        merged = True
+        while merged:
+            merged = False
+            for a in range(len(rects)):
+                for b in range(a + 1, len(rects)):
+                    ra, rb = rects[a], rects[b]
+                    if ra[0] < rb[2] and rb[0] < ra[2] and ra[1] < rb[3] and rb[1] < ra[3]:
+                        rects[a] = [min(ra[0], rb[0]), min(ra[1], rb[1]), max(ra[2], rb[2]), max(ra[3], rb[3])]
+                        del rects[b]
+                        merged = True
+                        break
+                if merged:
+                    break
+        return rects
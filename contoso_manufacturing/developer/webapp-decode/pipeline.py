@@ -0,0 +1,452 @@
+import collections
+import json
+import os
+import threading
+import time
+import cv2
+from inference_client import AsyncInferenceClient
+from broadcast import FrameBroadcaster
+from metrics import PipelineMetrics
+
+# Outputs queued for a frame gated by the MotionGate, replaced by the last result in frame order
+REUSE_LAST_RESULT = object()
+
+# Frame rate local video files are grabbed at while paused when the capture does not report it
+DEFAULT_FILE_FPS = 30.0
+
+class LatestFrameQueue:
+    """
+    Bounded queue between two pipeline stages that always keeps the newest items.
+
+    put() never blocks: when the queue is full the oldest item is dropped, so a slow consumer
+    always gets the most recent frame instead of falling further and further behind.
+    """
+
+    def __init__(self, maxsize=1):
+        self.items = collections.deque(maxlen=maxsize)
+        self.condition = threading.Condition()
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, item):
+        """
+        Adds an item, dropping the oldest one if the queue is full.
+
+        Args:
+            item: The item to add.
+        """
+        with self.condition:
+            if len(self.items) == self.items.maxlen:
+                self.dropped += 1
+            self.items.append(item)
+            self.condition.notify()
+
+    def get(self, timeout=None):
+        """
+        Removes and returns the oldest item, waiting until one is available.
+
+        Args:
+            timeout (float): Maximum number of seconds to wait, or None to wait forever.
+
+        Returns:
+            The item, or None if the timeout expired or the queue was closed.
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.items or self.closed, timeout):
+                return None
+            if not self.items:
+                return None
+            return self.items.popleft()
+
+    def clear(self):
+        """Removes every queued item."""
+        with self.condition:
+            self.items.clear()
+
+    def close(self):
+        """Wakes up every waiting consumer; get() returns None once the queue is drained."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def __len__(self):
+        return len(self.items)
+
+class DetectorPipeline:
+    """
+    Runs a detector as stages on their own threads: capture, inference, postprocess and encode.
+
+    The stages are linked by LatestFrameQueues, so each stage works on the newest frame handed
+    over by the previous one and throughput is bounded by the slowest stage rather than by the
+    sum of all stages. Each frame is decoded once by the capture stage and the same frame object
+    is annotated by the postprocess stage and JPEG encoded by the encode stage, which publishes
+    it once to a FrameBroadcaster shared by every viewer.
+
+    The inference stage preprocesses frames and submits them to an AsyncInferenceClient, which
+    keeps up to max_in_flight predict calls running and returns the results to the postprocess
+    stage in frame order.
+
+    Every stage records its time per frame in the PipelineMetrics histograms, which are also
+    attached to the detector so it can record the time spent drawing the overlay. When an
+    AdaptiveSkipScheduler is given, it is attached to the detector to choose the frames read by
+    the capture stage, and the preprocess, predict and postprocess times are reported to it.
+    When an EventBus is given, it is attached to the detector, which publishes the structured
+    results of every frame it postprocesses on it.
+
+    When a MotionGate is given, frames of a static scene skip preprocess and predict: they are
+    annotated by postprocess with the outputs and metadata of the last inferred frame.
+
+    Besides the annotated video, the pipeline streams the detections of every frame as compact
+    JSON metadata, and the raw frames at a lower rate, size and JPEG quality, for viewers that
+    draw the overlay themselves. The overlay is only drawn and the annotated frames only
+    encoded while somebody watches the annotated video, so metadata-only viewers cost the
+    pipeline neither drawing nor full-size encoding.
+
+    When an FMP4Encoder is given, the annotated video is also streamed as H.264 fragmented MP4,
+    encoded once by FFmpeg for all its viewers. FFmpeg only runs while the stream has viewers,
+    and the frames are only JPEG encoded while the MJPEG stream has viewers.
+    """
+
+    def __init__(self, detector, queue_size=1, retry_delay=0.1, max_in_flight=1, skip_scheduler=None, metrics=None, event_bus=None, motion_gate=None,
+                 raw_fps=5.0, raw_width=640, raw_quality=70, fmp4_encoder=None):
+        self.detector = detector
+        self.model_name = detector.model_name
+        self.retry_delay = retry_delay
+        self.skip_scheduler = skip_scheduler
+        self.motion_gate = motion_gate
+        self.last_result = None
+        self.metrics = metrics if metrics is not None else PipelineMetrics()
+        detector.metrics = self.metrics
+        if skip_scheduler is not None:
+            detector.skip_scheduler = skip_scheduler
+        if event_bus is not None:
+            detector.event_bus = event_bus
+        self.client = AsyncInferenceClient(self._predict, max_in_flight, name=self.model_name)
+        # Input tensors are reused, one per in-flight call plus the one being preprocessed
+        detector.reserve_input_buffers(self.client.max_in_flight + 1)
+        self.captured = LatestFrameQueue(queue_size)
+        self.processed = LatestFrameQueue(queue_size)
+        self.broadcaster = FrameBroadcaster()
+        # Detections of every frame as JSON, and the raw frames for the viewers drawing the overlay themselves
+        self.metadata_broadcaster = FrameBroadcaster()
+        self.raw_broadcaster = FrameBroadcaster()
+        self.raw_interval = 1.0 / raw_fps if raw_fps > 0 else 0.0
+        self.raw_width = raw_width
+        self.raw_quality = raw_quality
+        self.next_raw_time = 0.0
+        self.fmp4_encoder = fmp4_encoder
+        self.frame_sequence = 0
+        self.running = False
+        self.paused = False
+        self.paused_interval = 0.0
+        self.threads = []
+
+    def warm_up(self):
+        """
+        Reads and processes one frame synchronously so the video source, the gRPC channel and the
+        model are ready before the stage threads start.
+        """
+        frame = self.detector.read()
+        if frame is None:
+            print(f"Warm-up of {self.model_name} skipped, no frame available")
+            return
+        try:
+            self.detector.process(frame)
+        except Exception as e:
+            print(f"Warm-up inference for {self.model_name} failed: {e}")
+
+    def pause(self):
+        """Stops feeding frames to inference while keeping the video source connected."""
+        self.paused_interval = self._file_frame_interval()
+        self.paused = True
+
+    def resume(self):
+        """Resumes feeding frames to inference after pause(), starting with a frame captured from now on."""
+        self.captured.clear()
+        self.paused = False
+
+    def _file_frame_interval(self):
+        # A live stream paces grab() itself, a local file would be decoded as fast as the CPU allows
+        if not os.path.isfile(self.detector.rtsp_url):
+            return 0.0
+        cap = self.detector.cap
+        fps = cap.get(cv2.CAP_PROP_FPS) if hasattr(cap, 'get') else 0.0
+        return 1.0 / (fps if fps > 0 else DEFAULT_FILE_FPS)
+
+    def memory_bytes(self):
+        """
+        Estimates the memory held by the frame buffers of the pipeline.
+
+        Returns:
+            int: The estimated number of bytes.
+        """
+        frame_bytes = getattr(self.detector, 'img_width', 0) * getattr(self.detector, 'img_height', 0) * 3
+        frames = self.captured.items.maxlen + self.processed.items.maxlen + self.client.max_in_flight + 1
+        return frame_bytes * frames
+
+    def start(self):
+        """Starts the capture, inference, postprocess and encode threads."""
+        if self.running:
+            return
+        self.running = True
+        self.threads = [
+            threading.Thread(target=self._capture_loop, name=f"{self.model_name}-capture", daemon=True),
+            threading.Thread(target=self._inference_loop, name=f"{self.model_name}-inference", daemon=True),
+            threading.Thread(target=self._postprocess_loop, name=f"{self.model_name}-postprocess", daemon=True),
+            threading.Thread(target=self._encode_loop, name=f"{self.model_name}-encode", daemon=True),
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        """Stops every stage and waits for the threads to finish."""
+        self.running = False
+        for queue in (self.captured, self.processed):
+            queue.close()
+        for broadcaster in (self.broadcaster, self.metadata_broadcaster, self.raw_broadcaster):
+            broadcaster.close()
+        for thread in self.threads:
+            if thread is not threading.current_thread():
+                thread.join()
+        self.threads = []
+        # Closed once the encode thread finished, so no frame is written to FFmpeg while it is stopped
+        if self.fmp4_encoder is not None:
+            self.fmp4_encoder.close()
+        self.client.close()
+
+    def _capture_loop(self):
+        while self.running:
+            if self.paused:
+                # Keep draining the stream so it stays connected and current, without decoding frames for inference
+                if not self.detector.cap.grab():
+                    time.sleep(self.retry_delay)
+                    self.detector.open_source(self.detector.rtsp_url)
+                elif self.paused_interval:
+                    time.sleep(self.paused_interval)
+                continue
+
+            start = time.perf_counter()
+            frame = self.detector.read()
+            if frame is None:
+                # Give the video source a moment to recover, then reconnect (or rewind a local file)
+                time.sleep(self.retry_delay)
+                self.detector.open_source(self.detector.rtsp_url)
+                continue
+            captured_time = time.perf_counter()
+            self._record_stage("capture", start, captured_time)
+            self.captured.put((frame, captured_time))
+
+    def _record_stage(self, stage, start, end=None):
+        seconds = (end or time.perf_counter()) - start
+        self.metrics.observe(stage, seconds)
+        if self.skip_scheduler is not None and stage in self.skip_scheduler.STAGES:
+            self.skip_scheduler.record_stage(stage, seconds)
+
+    def _predict(self, inputs):
+        start = time.perf_counter()
+        try:
+            return self.detector.predict(inputs)
+        finally:
+            self._record_stage("predict", start)
+
+    def _inference_loop(self):
+        while self.running:
+            item = self.captured.get(timeout=self.retry_delay)
+            if item is None:
+                continue
+            frame, captured_time = item
+            if self.motion_gate is not None and not self.motion_gate.should_infer(frame):
+                # Static scene, the frame keeps its place in the frame order and reuses the last result
+                while self.running and not self.client.submit_result(REUSE_LAST_RESULT, (frame, None, captured_time), timeout=self.retry_delay):
+                    pass
+                continue
+            start = time.perf_counter()
+            try:
+                inputs, meta = self.detector.preprocess(frame)
+            except Exception as e:
+                print(f"Error preprocessing frame for {self.model_name}: {e}")
+                continue
+            self._record_stage("preprocess", start)
+            context = (frame, meta, captured_time)
+            if inputs is None:
+                # The detector annotates this frame without inference, it only keeps its place in the frame order
+                while self.running and not self.client.submit_result({}, context, timeout=self.retry_delay):
+                    pass
+                continue
+            # Wait for a free in-flight slot, giving up on this frame if the pipeline is stopped
+            while self.running and not self.client.submit(inputs, context, timeout=self.retry_delay):
+                pass
+
+    def _postprocess_loop(self):
+        while self.running:
+            result = self.client.next_result(timeout=self.retry_delay)
+            if result is None:
+                continue
+            outputs, (frame, meta, captured_time) = result
+            if outputs is REUSE_LAST_RESULT:
+                if self.last_result is None:
+                    continue
+                outputs, meta = self.last_result
+            elif outputs is None:
+                if self.motion_gate is not None:
+                    # The result the gate would reuse is missing, infer the next frame
+                    self.motion_gate.reset()
+                continue
+            elif self.motion_gate is not None:
+                self.last_result = (outputs, meta)
+
+            # The overlay is only drawn for the viewers of the annotated video
+            annotated = self.broadcaster.subscribers > 0 or self._fmp4_subscribers() > 0
+            self.detector.draw_overlay = annotated
+            raw_frame = None
+            if self.raw_broadcaster.subscribers > 0 and captured_time >= self.next_raw_time:
+                self.next_raw_time = captured_time + self.raw_interval
+                raw_frame = frame.copy() if annotated else frame
+            height, width = frame.shape[:2]
+
+            self.detector.detections = None
+            start = time.perf_counter()
+            try:
+                frame = self.detector.postprocess(frame, outputs, meta)
+            except Exception as e:
+                print(f"Error postprocessing frame for {self.model_name}: {e}")
+                continue
+            self._record_stage("postprocess", start)
+            if self.skip_scheduler is not None:
+                self.skip_scheduler.record_frame(time.perf_counter() - captured_time)
+            self.frame_sequence += 1
+            if self.metadata_broadcaster.subscribers > 0:
+                self._publish_metadata(width, height)
+            if annotated or raw_frame is not None:
+                self.processed.put((frame if annotated else None, raw_frame, self.frame_sequence))
+
+    def _publish_metadata(self, width, height):
+        # The frame number is also sent with the raw frames, so a viewer draws the detections of the frame it shows
+        metadata = {
+            "frame": self.frame_sequence,
+            "timestamp": round(time.time(), 3),
+            "model_name": self.model_name,
+            "width": width,
+            "height": height,
+        }
+        metadata.update(self.detector.detections or {})
+        self.metadata_broadcaster.publish(json.dumps(metadata, separators=(",", ":")).encode())
+
+    def _encode_loop(self):
+        while self.running:
+            item = self.processed.get(timeout=self.retry_delay)
+            if self.fmp4_encoder is not None and self._fmp4_subscribers() == 0:
+                # Stop FFmpeg after the last viewer left, it restarts with a new stream for the next one
+                self.fmp4_encoder.stop()
+            if item is None:
+                continue
+            frame, raw_frame, sequence = item
+            if frame is not None and self.broadcaster.subscribers > 0:
+                start = time.perf_counter()
+                ret, buffer = cv2.imencode('.jpg', frame)
+                self._record_stage("encode", start)
+                if ret:
+                    self.broadcaster.publish(buffer.tobytes())
+            if frame is not None and self._fmp4_subscribers() > 0:
+                start = time.perf_counter()
+                self.fmp4_encoder.encode(frame)
+                self._record_stage("encode_fmp4", start)
+            if raw_frame is not None:
+                start = time.perf_counter()
+                height, width = raw_frame.shape[:2]
+                if self.raw_width and width > self.raw_width:
+                    raw_frame = cv2.resize(raw_frame, (self.raw_width, round(height * self.raw_width / width)), interpolation=cv2.INTER_AREA)
+                ret, buffer = cv2.imencode('.jpg', raw_frame, [cv2.IMWRITE_JPEG_QUALITY, self.raw_quality])
+                self._record_stage("encode_raw", start)
+                if ret:
+                    self.raw_broadcaster.publish((sequence, buffer.tobytes()))
+
+    def frames(self):
+        """
+        Yields the latest encoded frames to one viewer without triggering extra inference or encoding.
+
+        Yields:
+            bytes: The annotated frame in JPEG format.
+        """
+        yield from self.broadcaster.subscribe(timeout=self.retry_delay)
+
+    def fmp4(self):
+        """
+        Yields the annotated video as fragmented MP4 to one viewer.
+
+        Yields:
+            bytes: The initialization segment, then the fragments from the next keyframe on.
+        """
+        if self.fmp4_encoder is None:
+            return
+        yield from self.fmp4_encoder.broadcaster.subscribe(timeout=self.retry_delay)
+
+    def _fmp4_subscribers(self):
+        return self.fmp4_encoder.broadcaster.subscribers if self.fmp4_encoder is not None else 0
+
+    def metadata(self):
+        """
+        Yields the detections of the latest processed frames to one viewer.
+
+        Yields:
+            bytes: The detections of a frame in JSON format, with its frame number, timestamp,
+                model name and frame size.
+        """
+        yield from self.metadata_broadcaster.subscribe(timeout=self.retry_delay)
+
+    def raw_frames(self):
+        """
+        Yields the latest raw frames, without overlay, at the reduced rate and size to one viewer.
+
+        Yields:
+            tuple: The frame number, as in the detection metadata, and the raw frame in JPEG format.
+        """
+        yield from self.raw_broadcaster.subscribe(timeout=self.retry_delay)
+
+    def stats(self):
+        """
+        Returns the pipeline statistics.
+
+        Returns:
+            dict: The inference client statistics plus the number of frames dropped between stages,
+                the queue depths and the effective skip ratio.
+        """
+        stats = self.client.stats()
+        stats["model_name"] = self.model_name
+        stats["dropped_frames"] = {
+            "captured": self.captured.dropped,
+            "processed": self.processed.dropped,
+            "subscribers": self.broadcaster.dropped,
+            "metadata_subscribers": self.metadata_broadcaster.dropped,
+            "raw_subscribers": self.raw_broadcaster.dropped,
+        }
+        stats["queue_depth"] = {
+            "captured": len(self.captured),
+            "in_flight": stats["in_flight"],
+            "processed": len(self.processed),
+        }
+        stats["subscribers"] = self.broadcaster.subscribers
+        stats["stream_subscribers"] = {
+            "annotated": self.broadcaster.subscribers,
+            "metadata": self.metadata_broadcaster.subscribers,
+            "raw": self.raw_broadcaster.subscribers,
+            "fmp4": self._fmp4_subscribers(),
+        }
+        if self.fmp4_encoder is not None:
+            stats["fmp4"] = self.fmp4_encoder.stats()
+            stats["dropped_frames"]["fmp4_subscribers"] = stats["fmp4"]["dropped"]
+        stats["skip_ratio"] = self.detector.skip_ratio()
+        if self.skip_scheduler is not None:
+            stats["skip_scheduler"] = self.skip_scheduler.stats()
+        if self.motion_gate is not None:
+            stats["motion_gate"] = self.motion_gate.stats()
+            # Estimated from the mean preprocess and predict times of the inferred frames
+            saved = 0.0
+            for stage in ("preprocess", "predict"):
+                _, total, count = self.metrics.histograms[stage].snapshot()
+                saved += total / count if count else 0.0
+            stats["motion_gate"]["saved_seconds"] = saved * stats["motion_gate"]["gated"]
+        tracker = getattr(self.detector, 'tracker', None)
+        if tracker is not None:
+            stats["tracking"] = tracker.stats()
+        return stats
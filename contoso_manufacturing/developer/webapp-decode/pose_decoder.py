@@ -2,35 +2,69 @@ import numpy as np
 from scipy.optimize import linear_sum_assignment
 import cv2
 
-class Pose:
-    def __init__(self, num_joints, tag_size=1):
-        self.num_joints = num_joints
-        self.tag_size = tag_size
+class PoseGroups:
+    """
+    The candidate poses of one image, kept in arrays preallocated for the most poses grouping can create.
+
+    Each pose stores its joints and the sums of the tags and positions of its joints along with
+    their count, so adding joints is a vectorized update and the mean tags and centers of all
+    poses are one division each, without a Python object per pose.
+    """
+
+    def __init__(self, num_joints, tag_size, capacity):
+        """
+        Args:
+            num_joints (int): Number of joints of a pose.
+            tag_size (int): Size of the tag embedding of a joint.
+            capacity (int): Maximum number of poses.
+        """
         # 2 is for x, y and 1 is for joint confidence
-        self.pose = np.zeros((num_joints, 2 + 1 + tag_size), dtype=np.float32)
-        self.pose_tag = np.zeros(tag_size, dtype=np.float32)
-        self.valid_points_num = 0
-        self.c = np.zeros(2, dtype=np.float32)
-
-    def add(self, idx, joint, tag):
-        self.pose[idx] = joint
-        self.c = self.c * self.valid_points_num + joint[:2]
-        self.pose_tag = (self.pose_tag * self.valid_points_num) + tag
-        self.valid_points_num += 1
-        self.c /= self.valid_points_num
-        self.pose_tag /= self.valid_points_num
+        self.poses = np.zeros((capacity, num_joints, 2 + 1 + tag_size), dtype=np.float32)
+        self.tag_sums = np.zeros((capacity, tag_size), dtype=np.float32)
+        self.center_sums = np.zeros((capacity, 2), dtype=np.float32)
+        self.counts = np.zeros((capacity, 1), dtype=np.float32)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, pose_ids, idx, joints, tags):
+        """
+        Adds a joint to each of the given poses.
+
+        Args:
+            pose_ids (numpy.ndarray): The distinct poses to add a joint to.
+            idx (int): The joint type.
+            joints (numpy.ndarray): The joints, one per pose.
+            tags (numpy.ndarray): The tags of the joints.
+        """
+        self.poses[pose_ids, idx] = joints
+        self.tag_sums[pose_ids] += tags
+        self.center_sums[pose_ids] += joints[:, :2]
+        self.counts[pose_ids] += 1
+
+    def append(self, idx, joints, tags):
+        """
+        Starts a new pose from each of the joints.
+
+        Args:
+            idx (int): The joint type.
+            joints (numpy.ndarray): The joints.
+            tags (numpy.ndarray): The tags of the joints.
+        """
+        start = self.size
+        self.size += len(joints)
+        self.add(np.arange(start, self.size), idx, joints, tags)
 
     @property
-    def tag(self):
-        if self.valid_points_num > 0:
-            return self.pose_tag
-        return None
+    def tags(self):
+        """numpy.ndarray: The mean tag of every pose."""
+        return self.tag_sums[:self.size] / self.counts[:self.size]
 
     @property
-    def center(self):
-        if self.valid_points_num > 0:
-            return self.c
-        return None
+    def centers(self):
+        """numpy.ndarray: The mean position of the joints of every pose."""
+        return self.center_sums[:self.size] / self.counts[:self.size]
 
 class AssociativeEmbeddingDecoder:
     def __init__(self, num_joints, max_num_people, detection_threshold, use_detection_val,
@@ -57,15 +91,16 @@ class AssociativeEmbeddingDecoder:
 
     @staticmethod
     def _max_match(scores):
-        r, c = linear_sum_assignment(scores)
-        return np.stack((r, c), axis=1)
+        # linear_sum_assignment solves rectangular matrices directly, the rows it leaves out are unassigned
+        return linear_sum_assignment(scores)
 
     def _match_by_tag(self, inp):
         tag_k, loc_k, val_k = inp
         embd_size = tag_k.shape[2]
         all_joints = np.concatenate((loc_k, val_k[..., None], tag_k), -1)
 
-        poses = []
+        # Every joint type can start at most one pose per candidate
+        poses = PoseGroups(self.num_joints, embd_size, len(self.joint_order) * val_k.shape[1])
         for idx in self.joint_order:
             tags = tag_k[idx]
             joints = all_joints[idx]
@@ -74,23 +109,20 @@ class AssociativeEmbeddingDecoder:
             joints = joints[mask]
 
             if len(poses) == 0:
-                for tag, joint in zip(tags, joints):
-                    pose = Pose(self.num_joints, embd_size)
-                    pose.add(idx, joint, tag)
-                    poses.append(pose)
+                poses.append(idx, joints, tags)
                 continue
 
             if joints.shape[0] == 0 or (self.ignore_too_much and len(poses) == self.max_num_people):
                 continue
 
-            poses_tags = np.stack([p.tag for p in poses], axis=0)
+            poses_tags = poses.tags
             diff = tags[:, None] - poses_tags[None, :]
             diff_normed = np.linalg.norm(diff, ord=2, axis=2)
             diff_saved = np.copy(diff_normed)
 
             if self.dist_reweight:
                 # Reweight cost matrix to prefer nearby points among all that are close enough in a tag space.
-                centers = np.stack([p.center for p in poses], axis=0)[None]
+                centers = poses.centers[None]
                 dists = np.linalg.norm(joints[:, :2][:, None, :] - centers, ord=2, axis=2)
                 close_tags_masks = diff_normed < self.tag_threshold
                 min_dists = np.min(dists, axis=0, keepdims=True)
@@ -99,29 +131,35 @@ class AssociativeEmbeddingDecoder:
 
             if self.use_detection_val:
                 diff_normed = np.round(diff_normed) * 100 - joints[:, 2:3]
-            num_added = diff.shape[0]
-            num_grouped = diff.shape[1]
-            if num_added > num_grouped:
-                diff_normed = np.pad(diff_normed, ((0, 0), (0, num_added - num_grouped)),
-                                     mode='constant', constant_values=1e10)
-
-            pairs = self._max_match(diff_normed)
-            for row, col in pairs:
-                if row < num_added and col < num_grouped and diff_saved[row][col] < self.tag_threshold:
-                    poses[col].add(idx, joints[row], tags[row])
-                else:
-                    pose = Pose(self.num_joints, embd_size)
-                    pose.add(idx, joints[row], tags[row])
-                    poses.append(pose)
-
-        ans = np.asarray([p.pose for p in poses], dtype=np.float32).reshape(-1, self.num_joints, 2 + 1 + embd_size)
-        tags = np.asarray([p.tag for p in poses], dtype=np.float32).reshape(-1, embd_size)
-        return ans, tags
+
+            rows, cols = self._max_match(diff_normed)
+            matched = diff_saved[rows, cols] < self.tag_threshold
+            poses.add(cols[matched], idx, joints[rows[matched]], tags[rows[matched]])
+            # Unassigned joints and joints too far in tag space from their pose start new poses, in order
+            new = np.ones(len(joints), dtype=bool)
+            new[rows[matched]] = False
+            poses.append(idx, joints[new], tags[new])
+
+        return poses.poses[:len(poses)], poses.tags
+
+    def _top_k_indices(self, heatmap):
+        k = self.max_num_people
+        if np.count_nonzero(heatmap) > heatmap.size // 4:
+            return heatmap.argpartition(-k)[-k:]
+        candidates = np.flatnonzero(heatmap)
+        # After the heatmap NMS only the peaks are nonzero. Partitioning them alone avoids the
+        # ties of the suppressed pixels, which make argpartition an order of magnitude slower.
+        if candidates.size < k:
+            # Fill up with the lowest pixel, which stays below the detection threshold
+            return np.concatenate((candidates, np.full(k - candidates.size, heatmap.argmin())))
+        return candidates[heatmap[candidates].argpartition(-k)[-k:]]
 
     def top_k(self, heatmaps, tags):
         N, K, H, W = heatmaps.shape
         heatmaps = heatmaps.reshape(N, K, -1)
-        ind = heatmaps.argpartition(-self.max_num_people, axis=2)[:, :, -self.max_num_people:]
+        ind = np.empty((N, K, self.max_num_people), dtype=np.intp)
+        for n, k in np.ndindex(N, K):
+            ind[n, k] = self._top_k_indices(heatmaps[n, k])
         val_k = np.take_along_axis(heatmaps, ind, axis=2)
         subind = np.argsort(-val_k, axis=2)
         ind = np.take_along_axis(ind, subind, axis=2)
@@ -137,20 +175,30 @@ class AssociativeEmbeddingDecoder:
         return tag_k, loc_k, val_k
 
     @staticmethod
-    def adjust(ans, heatmaps):
+    def _shift_to_neighbors(heatmaps, joints, x, y):
+        # Moves each joint a quarter pixel towards its higher horizontal and vertical neighbor.
+        # heatmaps is indexed by joints, the joints not inside the 1-pixel border are left unchanged.
         H, W = heatmaps.shape[-2:]
+        inside = (x > 1) & (x < W - 1) & (y > 1) & (y < H - 1)
+        k, x, y = joints[inside], x[inside], y[inside]
+        diff = np.stack((
+            heatmaps[k, y, x + 1] - heatmaps[k, y, x - 1],
+            heatmaps[k, y + 1, x] - heatmaps[k, y - 1, x]
+        ), axis=-1)
+        return inside, np.sign(diff) * .25
+
+    @staticmethod
+    def adjust(ans, heatmaps):
         for batch_idx, people in enumerate(ans):
-            for person in people:
-                for k, joint in enumerate(person):
-                    heatmap = heatmaps[batch_idx, k]
-                    px = int(joint[0])
-                    py = int(joint[1])
-                    if 1 < px < W - 1 and 1 < py < H - 1:
-                        diff = np.array([
-                            heatmap[py, px + 1] - heatmap[py, px - 1],
-                            heatmap[py + 1, px] - heatmap[py - 1, px]
-                        ])
-                        joint[:2] += np.sign(diff) * .25
+            if people.size == 0:
+                continue
+            # Gather the neighbors of every joint of every person at once
+            num_people, num_joints = people.shape[:2]
+            joints = np.broadcast_to(np.arange(num_joints), (num_people, num_joints))
+            x = people[..., 0].astype(int)
+            y = people[..., 1].astype(int)
+            inside, shift = AssociativeEmbeddingDecoder._shift_to_neighbors(heatmaps[batch_idx], joints, x, y)
+            people[inside, :2] += shift
         return ans
 
     @staticmethod
@@ -162,33 +210,37 @@ class AssociativeEmbeddingDecoder:
         if pose_tag is not None:
             prev_tag = pose_tag
         else:
-            tags = []
-            for i in range(K):
-                if keypoints[i, 2] > 0:
-                    x, y = keypoints[i][:2].astype(int)
-                    tags.append(tag[i, y, x])
-            prev_tag = np.mean(tags, axis=0)
-
-        for i, (_heatmap, _tag) in enumerate(zip(heatmap, tag)):
-            if keypoints[i, 2] > 0:
-                continue
-            # Get position with the closest tag value to the pose tag.
-            diff = np.abs(_tag[..., 0] - prev_tag) + 0.5
-            diff = diff.astype(np.int32).astype(_heatmap.dtype)
-            diff -= _heatmap
-            idx = diff.argmin()
-            y, x = np.divmod(idx, _heatmap.shape[-1])
-            # Corresponding keypoint detection score.
-            val = _heatmap[y, x]
-            if val > 0:
-                keypoints[i, :3] = x, y, val
-                if 1 < x < W - 1 and 1 < y < H - 1:
-                    diff = np.array([
-                        _heatmap[y, x + 1] - _heatmap[y, x - 1],
-                        _heatmap[y + 1, x] - _heatmap[y - 1, x]
-                    ])
-                    keypoints[i, :2] += np.sign(diff) * .25
-
+            found = np.flatnonzero(keypoints[:, 2] > 0)
+            x, y = keypoints[found, :2].astype(int).T
+            prev_tag = np.mean(tag[found, y, x], axis=0)
+
+        missing = np.flatnonzero(~(keypoints[:, 2] > 0))
+        if missing.size == 0:
+            return keypoints
+
+        # Get the position with the closest tag value to the pose tag for every missing joint.
+        # Each plane is scored in place in one reused buffer, which stays in cache; scoring the
+        # stacked (joints, H, W) planes at once is slower because of the larger temporaries.
+        diff = np.empty((H, W), heatmap.dtype)
+        idx = np.empty(missing.size, np.intp)
+        for j, i in enumerate(missing):
+            np.subtract(tag[i, ..., 0], prev_tag, out=diff)
+            np.abs(diff, out=diff)
+            diff += 0.5
+            np.floor(diff, out=diff)  # Same as truncating to int32, the values are positive
+            diff -= heatmap[i]
+            idx[j] = diff.argmin()
+        y, x = np.divmod(idx, W)
+        # Corresponding keypoint detection scores.
+        val = heatmap[missing, y, x]
+
+        detected = val > 0
+        missing, x, y, val = missing[detected], x[detected], y[detected], val[detected]
+        keypoints[missing, 0] = x
+        keypoints[missing, 1] = y
+        keypoints[missing, 2] = val
+        inside, shift = AssociativeEmbeddingDecoder._shift_to_neighbors(heatmap, missing, x, y)
+        keypoints[missing[inside], :2] += shift
         return keypoints
 
     def __call__(self, heatmaps, tags, nms_heatmaps):
@@ -203,9 +255,7 @@ class AssociativeEmbeddingDecoder:
 
         if self.delta != 0.0:
             for people in ans:
-                for person in people:
-                    for joint in person:
-                        joint[:2] += self.delta
+                people[..., :2] += self.delta
 
         ans = ans[0]
         scores = np.asarray([i[:, 2].mean() for i in ans])
@@ -221,6 +271,31 @@ class AssociativeEmbeddingDecoder:
 
         return ans, scores
 
+def heatmap_nms(heatmaps, kernel_size=3):
+    """
+    Keeps only the local maxima of the heatmaps, so every peak yields a single top_k candidate.
+
+    A pixel is kept when it equals the maximum of the kernel_size x kernel_size window around it
+    (a max pooling with stride 1), all other pixels are set to 0.
+
+    Args:
+        heatmaps (numpy.ndarray): The (N, K, H, W) heatmaps.
+        kernel_size (int): The odd size of the pooling window, 1 or less disables the suppression.
+
+    Returns:
+        numpy.ndarray: The suppressed heatmaps in a new array, or the heatmaps when the suppression is disabled.
+    """
+    if kernel_size <= 1:
+        return heatmaps
+    kernel = np.ones((kernel_size, kernel_size), np.uint8)
+    pooled = np.empty_like(heatmaps)
+    for index in np.ndindex(heatmaps.shape[:2]):
+        # Dilation with a rectangular kernel is a max pooling, the pixels outside the image are ignored
+        cv2.dilate(heatmaps[index], kernel, dst=pooled[index])
+    keep = heatmaps == pooled
+    np.multiply(heatmaps, keep, out=pooled)
+    return pooled
+
 def resize_image(image, size, keep_aspect_ratio=False, interpolation=cv2.INTER_LINEAR):
     if not keep_aspect_ratio:
         resized_frame = cv2.resize(image, size, interpolation=interpolation)
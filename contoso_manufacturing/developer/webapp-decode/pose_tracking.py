@@ -0,0 +1,137 @@
+import threading
+import cv2
+import numpy as np
+
+class PoseTracker:
+    """
+    Moves the joints of the poses found on a keyframe along the following frames with sparse optical flow.
+
+    Only every keyframe_interval-th frame runs the model and the associative embedding decoding.
+    On the frames in between, the visible joints of the last poses are tracked with pyramidal
+    Lucas-Kanade optical flow, checked forward and backward: a joint is kept when the backward
+    flow lands within max_error pixels of where it started, otherwise it is hidden until the next
+    keyframe. When less than min_confidence of the joints visible on the keyframe are still
+    tracked, the next frame is forced to be a keyframe.
+
+    next_is_keyframe() is called in frame order when frames are preprocessed; update() and
+    track() are called in frame order when they are postprocessed.
+    """
+
+    def __init__(self, keyframe_interval=5, min_confidence=0.5, point_score_threshold=0.1, max_error=2.0, win_size=21, max_level=3):
+        """
+        Args:
+            keyframe_interval (int): Number of frames from one keyframe to the next, 1 runs the model on every frame.
+            min_confidence (float): Fraction of the keyframe joints that must still be tracked to avoid a re-detect.
+            point_score_threshold (float): Score above which a joint is visible and tracked.
+            max_error (float): Maximum forward-backward error in pixels of a tracked joint.
+            win_size (int): Size of the Lucas-Kanade search window at each pyramid level.
+            max_level (int): Number of pyramid levels above the full resolution.
+        """
+        self.keyframe_interval = max(1, int(keyframe_interval))
+        self.min_confidence = min_confidence
+        self.point_score_threshold = point_score_threshold
+        self.max_error = max_error
+        self.lk_params = {
+            "winSize": (win_size, win_size),
+            "maxLevel": max_level,
+            "criteria": (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03),
+        }
+        self.lock = threading.Lock()
+
+        self.frames_since_keyframe = 0
+        self.force_keyframe = True
+        self.prev_gray = None
+        self.poses = np.empty((0, 0, 3), dtype=np.float32)
+        self.scores = np.empty(0, dtype=np.float32)
+        self.keyframe_joints = 0
+
+        self.keyframes = 0
+        self.tracked_frames = 0
+        self.forced_keyframes = 0
+        self.confidence = 1.0
+
+    def next_is_keyframe(self):
+        """
+        Decides whether the next frame runs the model.
+
+        Returns:
+            bool: True for a keyframe, False if the frame is annotated by track().
+        """
+        with self.lock:
+            if self.force_keyframe or self.frames_since_keyframe + 1 >= self.keyframe_interval:
+                self.force_keyframe = False
+                self.frames_since_keyframe = 0
+                return True
+            self.frames_since_keyframe += 1
+            return False
+
+    def update(self, frame, poses, scores):
+        """
+        Starts tracking the poses decoded on a keyframe.
+
+        Args:
+            frame (np.ndarray): The keyframe, before the overlay is drawn.
+            poses (np.ndarray): The (people, joints, 3 + tag size) poses in frame coordinates.
+            scores (np.ndarray): The score of every pose.
+        """
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        with self.lock:
+            self.prev_gray = gray
+            self.poses = poses.copy()
+            self.scores = scores
+            self.keyframe_joints = np.count_nonzero(poses[:, :, 2] > self.point_score_threshold)
+            self.keyframes += 1
+            self.confidence = 1.0
+
+    def track(self, frame):
+        """
+        Moves the poses of the last keyframe to a frame between keyframes.
+
+        Args:
+            frame (np.ndarray): The frame, before the overlay is drawn.
+
+        Returns:
+            tuple: The tracked poses, with the joints lost by the tracker hidden, and their scores.
+        """
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        with self.lock:
+            prev_gray, self.prev_gray = self.prev_gray, gray
+            self.tracked_frames += 1
+            visible = self.poses[:, :, 2] > self.point_score_threshold
+            if prev_gray is None or not visible.any():
+                return self.poses.copy(), self.scores
+
+            points = np.ascontiguousarray(self.poses[visible][:, :2], dtype=np.float32).reshape(-1, 1, 2)
+            new_points, status, _ = cv2.calcOpticalFlowPyrLK(prev_gray, gray, points, None, **self.lk_params)
+            back_points, back_status, _ = cv2.calcOpticalFlowPyrLK(gray, prev_gray, new_points, None, **self.lk_params)
+            error = np.linalg.norm((points - back_points).reshape(-1, 2), axis=1)
+            tracked = (status.ravel() == 1) & (back_status.ravel() == 1) & (error < self.max_error)
+
+            joints = self.poses[visible]
+            joints[tracked, :2] = new_points.reshape(-1, 2)[tracked]
+            # Lost joints are hidden until the next keyframe
+            joints[~tracked, 2] = 0
+            self.poses[visible] = joints
+
+            self.confidence = float(np.count_nonzero(tracked)) / self.keyframe_joints if self.keyframe_joints else 0.0
+            if self.confidence < self.min_confidence and not self.force_keyframe:
+                self.force_keyframe = True
+                self.forced_keyframes += 1
+            return self.poses.copy(), self.scores
+
+    def stats(self):
+        """
+        Returns the tracking statistics.
+
+        Returns:
+            dict: The keyframe interval, the number of keyframes, tracked frames and forced
+                re-detects, and the fraction of the keyframe joints tracked on the last frame.
+        """
+        with self.lock:
+            return {
+                "keyframe_interval": self.keyframe_interval,
+                "keyframes": self.keyframes,
+                "tracked_frames": self.tracked_frames,
+                "forced_keyframes": self.forced_keyframes,
+                "confidence": self.confidence,
+            }
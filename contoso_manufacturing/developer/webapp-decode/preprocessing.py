@@ -0,0 +1,141 @@
+import cv2
+import numpy as np
+
+class TensorPreprocessor:
+    """
+    Turns BGR frames into float32 NCHW model inputs without per-frame full-frame allocations.
+
+    The frame is resized into a preallocated uint8 buffer, then color swap, normalization and the
+    HWC -> NCHW transpose are done in one pass per channel: a ufunc call reads one channel of the
+    resized pixels through a strided view and writes it, scaled and converted, straight into its
+    plane of the preallocated float32 tensor. With keep_aspect_ratio the frame is letterboxed: it
+    is resized into the top left corner of the tensor and the bottom / right padding stays zero.
+
+    The returned tensor is owned by the preprocessor and reused. When predict calls run
+    asynchronously, reserve() one buffer per frame that can be in flight plus the one being
+    preprocessed, so a tensor is never overwritten before its request was sent.
+    """
+
+    def __init__(self, input_shape, swap_rb=False, scale=1.0, keep_aspect_ratio=False, interpolation=cv2.INTER_LINEAR, num_buffers=1):
+        """
+        Args:
+            input_shape (tuple): The (width, height) of the model input.
+            swap_rb (bool): Whether to convert the BGR frame to RGB.
+            scale (float): Factor the pixel values are multiplied by, e.g. 1 / 255.
+            keep_aspect_ratio (bool): Whether to letterbox the frame instead of stretching it.
+            interpolation (int): The OpenCV interpolation used for resizing.
+            num_buffers (int): Number of input tensors used in rotation.
+        """
+        self.input_width, self.input_height = input_shape
+        self.swap_rb = swap_rb
+        self.scale = np.float32(scale)
+        self.keep_aspect_ratio = keep_aspect_ratio
+        self.interpolation = interpolation
+        self.tensors = []
+        self.content_sizes = []
+        self.next_index = 0
+        self.batch_tensors = []
+        self.next_batch_index = 0
+        self.resized = None
+        self.reserve(num_buffers)
+
+    def reserve(self, count):
+        """
+        Makes sure at least count input tensors are used in rotation.
+
+        Args:
+            count (int): The number of input tensors.
+        """
+        while len(self.tensors) < count:
+            self.tensors.append(np.zeros((1, 3, self.input_height, self.input_width), np.float32))
+            self.content_sizes.append(None)
+
+    def resized_size(self, img):
+        """
+        Returns the size the frame is resized to before padding.
+
+        Args:
+            img (np.ndarray): The frame.
+
+        Returns:
+            tuple: The (width, height) of the resized frame.
+        """
+        if not self.keep_aspect_ratio:
+            return self.input_width, self.input_height
+        h, w = img.shape[:2]
+        scale = min(self.input_height / h, self.input_width / w)
+        return min(self.input_width, int(round(w * scale))), min(self.input_height, int(round(h * scale)))
+
+    def __call__(self, img):
+        """
+        Preprocesses a frame into the next input tensor.
+
+        Args:
+            img (np.ndarray): The BGR frame.
+
+        Returns:
+            tuple: The (1, 3, height, width) float32 input tensor and the (width, height) of the
+                resized frame inside it.
+        """
+        width, height = self.resized_size(img)
+
+        index = self.next_index
+        self.next_index = (index + 1) % len(self.tensors)
+        tensor = self.tensors[index]
+
+        # Clear the padding when the letterbox geometry changes, e.g. after the source was reconnected
+        if self.content_sizes[index] != (width, height):
+            if self.content_sizes[index] is not None:
+                tensor.fill(0)
+            self.content_sizes[index] = (width, height)
+
+        self._fill(img, tensor[0], (width, height))
+        return tensor, (width, height)
+
+    def batch(self, images):
+        """
+        Preprocesses several images, e.g. the tiles of a frame, into the next batched input tensor.
+
+        Batched tensors rotate like the single ones, one per reserved buffer, and are reallocated
+        only when the number of images changes.
+
+        Args:
+            images (list): The BGR images.
+
+        Returns:
+            tuple: The (len(images), 3, height, width) float32 input tensor and the (width, height)
+                of every resized image inside it.
+        """
+        while len(self.batch_tensors) < len(self.tensors):
+            self.batch_tensors.append(None)
+        index = self.next_batch_index % len(self.batch_tensors)
+        self.next_batch_index = index + 1
+        tensor = self.batch_tensors[index]
+        if tensor is None or tensor.shape[0] != len(images):
+            tensor = self.batch_tensors[index] = np.zeros((len(images), 3, self.input_height, self.input_width), np.float32)
+
+        sizes = []
+        for i, img in enumerate(images):
+            size = self.resized_size(img)
+            if size != (self.input_width, self.input_height):
+                # The letterbox padding of the previous image at this index may be larger
+                tensor[i].fill(0)
+            self._fill(img, tensor[i], size)
+            sizes.append(size)
+        return tensor, sizes
+
+    def _fill(self, img, target, size):
+        # Resizes the image and writes it into the top left corner of one (3, height, width) tensor
+        width, height = size
+        if self.resized is None or self.resized.shape[:2] != (height, width):
+            self.resized = np.empty((height, width, 3), np.uint8)
+        cv2.resize(img, (width, height), dst=self.resized, interpolation=self.interpolation)
+
+        # Writing whole contiguous planes is several times faster than one call through a transposed view
+        for channel in range(3):
+            source = self.resized[:, :, 2 - channel if self.swap_rb else channel]
+            plane = target[channel, :height, :width]
+            if self.scale == 1:
+                np.copyto(plane, source)
+            else:
+                np.multiply(source, self.scale, out=plane, dtype=np.float32)
@@ -0,0 +1,236 @@
+/**
+ * Draws the detections streamed by /detections on a canvas over the raw video of /raw_feed,
+ * so the server neither draws the overlay nor encodes the annotated frames.
+ *
+ * Every part of /raw_feed carries its frame number in an X-Frame header, so the overlay shows the
+ * detections of the frame on screen rather than the latest ones, which are up to a raw frame
+ * interval ahead.
+ */
+
+// Pairs of joints connected by a limb, as the default_skeleton of the human-pose-estimation model
+var POSE_SKELETON = [[15, 13], [13, 11], [16, 14], [14, 12], [11, 12], [5, 11], [6, 12], [5, 6], [5, 7], [6, 8],
+                     [7, 9], [8, 10], [1, 2], [0, 1], [0, 2], [1, 3], [2, 4], [3, 5], [4, 6]];
+var POSE_POINT_THRESHOLD = 0.5;
+// Detections kept for the raw frames still on their way, about ten seconds at 30 FPS
+var MAX_RECENT_DETECTIONS = 300;
+
+var detectionSource = null;
+var rawFeedController = null;
+var rawFrameUrl = null;
+var displayedFrame = null;
+var recentDetections = new Map();
+
+/**
+ * Returns whether the UI was opened with ?overlay=client to draw the overlay in the browser.
+ * @returns {boolean} True if the overlay is drawn client-side.
+ */
+function useClientOverlay() {
+    return new URLSearchParams(window.location.search).get("overlay") === "client";
+}
+
+/**
+ * Streams the raw video and the detections of a model into #imgVideoPreview and #canvasOverlay.
+ * @param {string} video - The video name.
+ */
+function startDetectionOverlay(video) {
+    stopDetectionOverlay();
+    rawFeedController = new AbortController();
+    streamRawFrames(`/raw_feed?video=${video}`, rawFeedController.signal);
+    detectionSource = new EventSource(`/detections?video=${video}`);
+    detectionSource.onmessage = function(event) {
+        var detections = JSON.parse(event.data);
+        recentDetections.set(detections.frame, detections);
+        if (recentDetections.size > MAX_RECENT_DETECTIONS) {
+            // Maps iterate in insertion order, the first key is the oldest frame
+            recentDetections.delete(recentDetections.keys().next().value);
+        }
+        if (detections.frame === displayedFrame) {
+            window.requestAnimationFrame(function() {
+                drawDetections(detections);
+            });
+        }
+    };
+}
+
+/**
+ * Closes the raw video and detection streams and clears the overlay.
+ */
+function stopDetectionOverlay() {
+    if (detectionSource !== null) {
+        detectionSource.close();
+        detectionSource = null;
+    }
+    if (rawFeedController !== null) {
+        rawFeedController.abort();
+        rawFeedController = null;
+    }
+    if (rawFrameUrl !== null) {
+        URL.revokeObjectURL(rawFrameUrl);
+        rawFrameUrl = null;
+    }
+    displayedFrame = null;
+    recentDetections.clear();
+    var canvas = document.getElementById("canvasOverlay");
+    if (canvas) {
+        canvas.getContext("2d").clearRect(0, 0, canvas.width, canvas.height);
+    }
+}
+
+/**
+ * Reads the multipart MJPEG stream of /raw_feed and shows every frame with its detections.
+ * An <img> hides the part headers, so the stream is parsed here to read the X-Frame numbers.
+ * @param {string} url - The URL of the raw feed.
+ * @param {AbortSignal} signal - Signal that ends the stream.
+ */
+async function streamRawFrames(url, signal) {
+    try {
+        var response = await fetch(url, { signal: signal });
+        var reader = response.body.getReader();
+        var buffer = new Uint8Array(0);
+        while (true) {
+            var result = await reader.read();
+            if (result.done) {
+                return;
+            }
+            var joined = new Uint8Array(buffer.length + result.value.length);
+            joined.set(buffer);
+            joined.set(result.value, buffer.length);
+            buffer = joined;
+            var part;
+            while ((part = nextRawPart(buffer)) !== null) {
+                buffer = buffer.subarray(part.end);
+                showRawFrame(part.frame, part.jpeg);
+            }
+        }
+    } catch (error) {
+        if (error.name !== "AbortError") {
+            console.error("Raw feed failed:", error);
+        }
+    }
+}
+
+/**
+ * Parses the next complete part of a multipart stream.
+ * @param {Uint8Array} buffer - The bytes received and not parsed yet.
+ * @returns {Object} The frame number, the JPEG bytes and the end offset of the part, or null if incomplete.
+ */
+function nextRawPart(buffer) {
+    var headerEnd = -1;
+    for (var i = 0; i + 3 < buffer.length; i++) {
+        if (buffer[i] === 13 && buffer[i + 1] === 10 && buffer[i + 2] === 13 && buffer[i + 3] === 10) {
+            headerEnd = i + 4;
+            break;
+        }
+    }
+    if (headerEnd < 0) {
+        return null;
+    }
+    var headers = new TextDecoder().decode(buffer.subarray(0, headerEnd));
+    var length = parseInt((headers.match(/Content-Length: *(\d+)/i) || [])[1], 10);
+    var frame = parseInt((headers.match(/X-Frame: *(\d+)/i) || [])[1], 10);
+    if (isNaN(length) || buffer.length < headerEnd + length + 2) {
+        return null;
+    }
+    // The part ends with a CRLF before the next boundary
+    return { frame: frame, jpeg: buffer.slice(headerEnd, headerEnd + length), end: headerEnd + length + 2 };
+}
+
+/**
+ * Shows a raw frame and draws the detections of the same frame, or the latest earlier ones.
+ * @param {number} frame - The frame number.
+ * @param {Uint8Array} jpeg - The JPEG image.
+ */
+function showRawFrame(frame, jpeg) {
+    var img = document.getElementById("imgVideoPreview");
+    if (!img) {
+        return;
+    }
+    if (rawFrameUrl !== null) {
+        URL.revokeObjectURL(rawFrameUrl);
+    }
+    var url = rawFrameUrl = URL.createObjectURL(new Blob([jpeg], { type: "image/jpeg" }));
+    img.onload = function() {
+        if (url !== rawFrameUrl) {
+            return;
+        }
+        displayedFrame = frame;
+        var detections = null;
+        recentDetections.forEach(function(candidate, candidateFrame) {
+            if (candidateFrame <= frame && (detections === null || candidateFrame > detections.frame)) {
+                detections = candidate;
+            }
+        });
+        if (detections !== null) {
+            drawDetections(detections);
+        }
+    };
+    img.src = url;
+}
+
+/**
+ * Draws the detections of one frame, scaled from the frame size to the size of the displayed video.
+ * @param {Object} detections - The detections of a frame from /detections.
+ */
+function drawDetections(detections) {
+    var canvas = document.getElementById("canvasOverlay");
+    var img = document.getElementById("imgVideoPreview");
+    if (!canvas || !img) {
+        return;
+    }
+    canvas.width = img.clientWidth;
+    canvas.height = img.clientHeight;
+    var ctx = canvas.getContext("2d");
+    ctx.clearRect(0, 0, canvas.width, canvas.height);
+    ctx.setTransform(canvas.width / detections.width, 0, 0, canvas.height / detections.height, 0, 0);
+    var scale = detections.width / canvas.width;
+
+    if (detections.boxes) {
+        ctx.lineWidth = 3 * scale;
+        ctx.strokeStyle = "#ff0000";
+        ctx.font = `${Math.round(16 * scale)}px sans-serif`;
+        detections.boxes.forEach(function(box, i) {
+            ctx.strokeRect(box[0], box[1], box[2], box[3]);
+            var label = `${detections.classes[i]}: ${detections.scores[i].toFixed(2)}`;
+            var labelHeight = 20 * scale;
+            var labelY = box[1] > labelHeight ? box[1] - labelHeight : box[1];
+            ctx.fillStyle = "#ff0000";
+            ctx.fillRect(box[0], labelY, ctx.measureText(label).width + 8 * scale, labelHeight);
+            ctx.fillStyle = "#000000";
+            ctx.fillText(label, box[0] + 4 * scale, labelY + 16 * scale);
+        });
+    }
+
+    if (detections.keypoints) {
+        ctx.lineWidth = 4 * scale;
+        ctx.strokeStyle = "rgba(0, 255, 255, 0.6)";
+        ctx.fillStyle = "#ffff00";
+        detections.keypoints.forEach(function(points) {
+            POSE_SKELETON.forEach(function(limb) {
+                var a = points[limb[0]];
+                var b = points[limb[1]];
+                if (a && b && a[2] > POSE_POINT_THRESHOLD && b[2] > POSE_POINT_THRESHOLD) {
+                    ctx.beginPath();
+                    ctx.moveTo(a[0], a[1]);
+                    ctx.lineTo(b[0], b[1]);
+                    ctx.stroke();
+                }
+            });
+            points.forEach(function(point) {
+                if (point[2] > POSE_POINT_THRESHOLD) {
+                    ctx.beginPath();
+                    ctx.arc(point[0], point[1], 3 * scale, 0, 2 * Math.PI);
+                    ctx.fill();
+                }
+            });
+        });
+    }
+
+    if (detections.defects || detections["class"]) {
+        // Bolt and weld results are shown as text, like the server-side overlay
+        var text = detections.defects ? `Defect: ${detections.defects.join(" ") || "No Defect"}`
+                                      : `Class '${detections["class"]}' - Probability ${detections.probability.toFixed(2)}`;
+        ctx.font = `${Math.round(20 * scale)}px sans-serif`;
+        ctx.fillStyle = "#ffffff";
+        ctx.fillText(text, 10 * scale, 30 * scale);
+    }
+}
@@ -132,6 +132,8 @@ function zoomToLevel(level, type = "", video = "", scenario = "") {
         $(".level3").hide();
         $(".bd-level3").hide();
         $("#imgContainer").hide();
+        stopDetectionOverlay();
+        stopFmp4Stream();
         $("#imgVideoPreview").attr("src", "/static/images/video_placeholder.png");
     } else if (level == 3) {
         $(".level0").hide();
@@ -142,7 +144,13 @@ function zoomToLevel(level, type = "", video = "", scenario = "") {
             $(".level2 .site").show();
             $(".level2 .enterprise").hide();
             $("#imgContainer").show();
-            $("#imgVideoPreview").attr("src", `/video_feed?video=${video}`);
+            if (useClientOverlay()) {
+                startDetectionOverlay(video);
+            } else if (useFmp4Stream()) {
+                startFmp4Stream(video);
+            } else {
+                $("#imgVideoPreview").attr("src", `/video_feed?video=${video}`);
+            }
             $("#caseContainer").addClass("col-md-6");
             $("#caseContainer").removeClass("col-md-12");
         } 
@@ -150,6 +158,8 @@ function zoomToLevel(level, type = "", video = "", scenario = "") {
             $(".bd-level2.enterprise").show();
             $(".level2 .site").hide();
             $(".level2 .enterprise").show();
+            stopDetectionOverlay();
+            stopFmp4Stream();
             if(video == "infra"){
                 video = "infra_monitoring";
                 $("#imgContainer").show();;
@@ -165,4 +175,45 @@ function zoomToLevel(level, type = "", video = "", scenario = "") {
         $(".bd-level3").html(scenario);
         $(".bd-level3").show();
     }
-}
\ No newline at end of file
+}
+
+/**
+ * Returns whether the UI was opened with ?stream=fmp4 to watch the annotated video as fragmented MP4.
+ * @returns {boolean} True if the fMP4 stream is used instead of MJPEG.
+ */
+function useFmp4Stream() {
+    return new URLSearchParams(window.location.search).get("stream") === "fmp4";
+}
+
+/**
+ * Plays the fragmented MP4 stream of a video in #videoPreview instead of the MJPEG image.
+ * @param {string} video - The video name.
+ */
+function startFmp4Stream(video) {
+    var player = document.getElementById("videoPreview");
+    $("#imgVideoPreview").hide();
+    $(player).show();
+    // The stream ends when the server restarts the encoder, e.g. on a new frame size: reconnect
+    player.onended = player.onerror = function() {
+        setTimeout(function() {
+            if ($(player).is(":visible")) {
+                player.src = `/video_feed?video=${video}&format=fmp4&t=${Date.now()}`;
+            }
+        }, 1000);
+    };
+    player.src = `/video_feed?video=${video}&format=fmp4`;
+}
+
+/**
+ * Stops the fragmented MP4 stream and shows the MJPEG image again.
+ */
+function stopFmp4Stream() {
+    var player = document.getElementById("videoPreview");
+    if (player && player.getAttribute("src")) {
+        player.onended = player.onerror = null;
+        player.removeAttribute("src");
+        player.load();
+    }
+    $(player).hide();
+    $("#imgVideoPreview").show();
+}
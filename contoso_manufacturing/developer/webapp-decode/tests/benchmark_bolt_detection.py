@@ -0,0 +1,168 @@
+"""
+Micro-benchmark for the defect checks of BoltDetection.postprocess.
+
+Compares the original checks, which converted, thresholded and searched the
+whole frame again for every object (and brightened the frame in place each
+time), against the checks on planes computed once per cluster of nearby
+objects and scoped to the bounding rectangle of each object. Runs on synthetic 1280x720 frames with an
+increasing number of bolts and reports the postprocess time per frame of each.
+
+The original checks searched the whole frame, so they also reported defects
+found outside the object; the defect lists of both are printed for the first
+frame to compare them.
+
+Usage:
+    python benchmark_bolt_detection.py
+    python benchmark_bolt_detection.py --objects 1 4 8 16 --size 1920 1080
+"""
+import argparse
+import math
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+# pylint: disable=wrong-import-position
+import bolt_detection
+from bolt_detection import BoltDetection
+
+
+def legacy_get_orientation(contours):
+    """The BoltDetection.get_orientation that copied the contour point by point."""
+    data_pts = np.empty((len(contours), 2), dtype=np.float64)
+    for i in range(data_pts.shape[0]):
+        data_pts[i, 0] = contours[i, 0, 0]
+        data_pts[i, 1] = contours[i, 0, 1]
+    mean, eigenvector = cv2.PCACompute(data_pts, mean=None)
+    return math.atan2(eigenvector[0, 1], eigenvector[0, 0])
+
+
+def legacy_detect_color(frame):
+    """The BoltDetection.detect_color that brightened and searched the whole frame for every object."""
+    color_flag = False
+    cv2.convertScaleAbs(frame, frame, 1, 20)
+    img_hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+    img_threshold = cv2.inRange(img_hsv, bolt_detection.LOWER_COLOR_RANGE, bolt_detection.UPPER_COLOR_RANGE)
+    img_threshold = cv2.erode(img_threshold, kernel=cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5)))
+    img_threshold = cv2.dilate(img_threshold, kernel=cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5)))
+    contours, _ = cv2.findContours(img_threshold, cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE)
+    for contour in contours:
+        if 2000 < cv2.contourArea(contour) < 10000:
+            cv2.drawContours(frame, contour, -1, (0, 0, 255), 2)
+            color_flag = True
+    return color_flag
+
+
+def legacy_detect_crack(frame):
+    """The BoltDetection.detect_crack that searched the edges of the whole frame for every object."""
+    defect_flag = False
+    img = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    img = cv2.blur(img, (7, 7))
+    detected_edges = cv2.Canny(img, 130, 390, 3)
+    contours, _ = cv2.findContours(detected_edges, cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE)
+    for i, contour in enumerate(contours):
+        area = cv2.contourArea(contour)
+        if area > 20 or area < 9:
+            cv2.drawContours(frame, contours, i, (0, 255, 0), 2)
+            defect_flag = True
+    return defect_flag
+
+
+def legacy_defects(frame, contours):
+    """The defect checks of the original BoltDetection.postprocess, without the dimensions and text."""
+    defects = []
+    for cnt in contours:
+        x, y, w, h = cv2.boundingRect(cnt)
+        if bolt_detection.OBJECT_AREA_MAX > w * h > bolt_detection.OBJECT_AREA_MIN:
+            if legacy_get_orientation(cnt) >= 0.5:
+                defects.append("Orientation")
+            if legacy_detect_color(frame):
+                defects.append("Color")
+            if legacy_detect_crack(frame):
+                defects.append("Crack")
+    return defects
+
+
+def defects(detector, frame, contours):
+    """The defect checks of BoltDetection.postprocess, without the dimensions and text."""
+    found = []
+    objects = [cnt for cnt in contours if bolt_detection.OBJECT_AREA_MAX > np.prod(cv2.boundingRect(cnt)[2:]) > bolt_detection.OBJECT_AREA_MIN]
+    object_planes = {}
+    for rect, members in detector.object_clusters(frame, objects):
+        planes = detector.feature_planes(frame, rect)
+        for i in members:
+            object_planes[i] = planes
+    for i, cnt in enumerate(objects):
+        planes = object_planes[i]
+        if detector.detect_orientation(frame, cnt)[1]:
+            found.append("Orientation")
+        if detector.detect_color(frame, cnt, planes)[1]:
+            found.append("Color")
+        if detector.detect_crack(frame, cnt, planes)[1]:
+            found.append("Crack")
+    return found
+
+
+def synthetic_frame(count, size, rng):
+    """Draws count gray bolts of random orientation and at most 200 pixels long, some with a scratch, on a dark noisy background."""
+    frame = rng.integers(0, 30, (size[1], size[0], 3), dtype=np.uint8)
+    columns = max(1, int(math.ceil(math.sqrt(count * size[0] / size[1]))))
+    rows = int(math.ceil(count / columns))
+    cell_w, cell_h = size[0] // columns, size[1] // rows
+    for n in range(count):
+        center = ((n % columns + 0.5) * cell_w, (n // columns + 0.5) * cell_h)
+        length = min(min(cell_w, cell_h) * 0.7, 200)
+        box = cv2.boxPoints((center, (length, length * 0.35), rng.uniform(0, 180))).astype(np.int32)
+        cv2.fillConvexPoly(frame, box, (int(rng.integers(120, 200)),) * 3)
+        if n % 2:
+            cv2.line(frame, tuple(box[0]), tuple(box[2]), (60, 60, 60), 2)
+    return frame
+
+
+def make_detector():
+    """Builds a BoltDetection instance without opening a video source."""
+    detector = BoltDetection.__new__(BoltDetection)
+    detector.verbose = False
+    detector.count_object = 0
+    detector.one_pixel_length = 0.0264583333
+    detector.cap = cv2.VideoCapture()
+    return detector
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, nargs=2, default=[1280, 720])
+    parser.add_argument("--objects", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    size = tuple(args.size)
+    rng = np.random.default_rng(0)
+    detector = make_detector()
+
+    print(f"Frame {size[0]}x{size[1]}")
+    for count in args.objects:
+        frame = synthetic_frame(count, size, rng)
+        contours, _ = detector.preprocess(frame)
+        timings = {}
+        found = {}
+        for name, func in (("legacy", lambda img: legacy_defects(img, contours)), ("shared", lambda img: defects(detector, img, contours))):
+            total = 0.0
+            for _ in range(args.repeat):
+                img = frame.copy()
+                start = time.perf_counter()
+                found[name] = func(img)
+                total += time.perf_counter() - start
+            timings[name] = total * 1000 / args.repeat
+        print(f"{count:3d} objects  legacy {timings['legacy']:8.2f} ms  shared planes {timings['shared']:7.2f} ms  speedup {timings['legacy'] / timings['shared']:5.1f}x")
+        if count == args.objects[0]:
+            print(f"    defects legacy: {' '.join(found['legacy'])}")
+            print(f"    defects shared: {' '.join(found['shared'])}")
+
+
+if __name__ == "__main__":
+    main()
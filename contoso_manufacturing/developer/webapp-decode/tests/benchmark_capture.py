@@ -0,0 +1,70 @@
+"""
+Benchmark for the capture backends on a local video file.
+
+Reads a video with a fixed skip rate the way Detector.read() does and reports
+the number of source frames consumed per second and the time per kept frame for:
+  - OpenCV, decoding skipped frames with read() (the previous behavior)
+  - OpenCV, consuming skipped frames with grab() only
+  - FFmpeg pipe, decoding at the model input resolution (requires ffmpeg, see FFMPEG_PATH)
+
+Usage:
+    python benchmark_capture.py --video ./videos/helmet.mp4 --skip-rate 2 --input-shape 640 640
+"""
+import argparse
+import os
+import sys
+import time
+
+import cv2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+# pylint: disable=wrong-import-position
+from capture import open_capture
+
+
+def consume(cap, skip_rate, max_frames, skip_with_grab):
+    """Reads up to max_frames source frames, skipping every skip_rate-th one. Returns (frames, kept, seconds, frame shape)."""
+    frames = kept = 0
+    shape = None
+    start = time.perf_counter()
+    while frames < max_frames:
+        if skip_rate > 0 and (frames + 1) % skip_rate == 0:
+            if not (cap.grab() if skip_with_grab else cap.read()[0]):
+                break
+        else:
+            ret, img = cap.read()
+            if not ret:
+                break
+            kept += 1
+            shape = img.shape
+        frames += 1
+    return frames, kept, time.perf_counter() - start, shape
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--video", required=True, help="Local video file")
+    parser.add_argument("--skip-rate", type=int, default=2, help="Every skip-rate-th frame is skipped, as in the detectors")
+    parser.add_argument("--input-shape", type=int, nargs=2, default=[640, 640], help="Model input (width, height)")
+    parser.add_argument("--max-frames", type=int, default=1000)
+    args = parser.parse_args()
+
+    cases = [
+        ("OpenCV read() skip", {}, False),
+        ("OpenCV grab() skip", {}, True),
+        ("FFmpeg pipe grab() skip", {"backend": "ffmpeg"}, True),
+    ]
+    for name, options, skip_with_grab in cases:
+        cap = open_capture(args.video, options, tuple(args.input_shape))
+        if not cap.isOpened():
+            print(f"{name}: unable to open {args.video}")
+            continue
+        frames, kept, seconds, shape = consume(cap, args.skip_rate, args.max_frames, skip_with_grab)
+        cap.release()
+        size = f"{shape[1]}x{shape[0]}" if shape else "-"
+        print(f"{name:26s} {frames / seconds:8.1f} source frames/s {1000 * seconds / max(kept, 1):8.3f} ms/kept frame  ({frames} frames, {kept} kept, {size})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,438 @@
+"""
+Glass-to-glass latency harness for the webapp-decode pipelines.
+
+Every source frame is stamped with the time it was captured, as a machine
+readable pattern: a grid of black and white cells holding the capture time in
+milliseconds and a checksum, sized relative to the frame width so it survives
+scaling, and drawn along the edges of the frame so one copy is usually left
+uncovered by the overlay. The annotated video streamed by /video_feed, as MJPEG
+or fragmented MP4, is decoded like a browser would and the pattern read back,
+so the latency covers capture buffering, inference, postprocessing, encoding,
+streaming and decoding. Frames whose every copy of the
+pattern was hidden by the overlay or damaged are counted as unreadable.
+
+By default the pipelines run in-process against the fake OVMS from
+fake_ovms.py. A local test video (synthetic when omitted) is played like a live
+camera at --fps, buffering at most --source-buffer frames for a reader that
+falls behind, and the output of every model is measured for every combination
+of --max-in-flight and --formats, with and without the motion gate with
+--motion-gate. The latency distribution (mean, p50, p90, p99, max) is reported
+per model and pipeline configuration.
+
+With --url the harness measures a running webapp-decode instead. With --serve it
+also publishes the stamped test video live with FFmpeg, e.g. to the RTSP server
+the models of the app read from (their rtsp_url must point to that stream).
+The harness and the app must share a clock, e.g. run on the same host.
+
+Usage:
+    python benchmark_latency.py
+    python benchmark_latency.py --detectors safety-yolo8 --max-in-flight 1 2 4 --formats mjpeg fmp4 --json latency.json
+    python benchmark_latency.py --detectors safety-yolo8 --motion-gate --latency-ms 30
+    python benchmark_latency.py --url http://localhost:5001 --detectors safety-yolo8 --serve rtsp://localhost:8554/latency
+"""
+import argparse
+import json
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+import zlib
+
+import cv2
+import numpy as np
+from tabulate import tabulate
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+# pylint: disable=wrong-import-position
+from pipeline import DetectorPipeline
+from motion_gate import MotionGate
+from fmp4 import FMP4Encoder
+from fake_ovms import FakeOVMSServer, default_outputs, synthetic_yolov8
+from benchmark_pipelines import DETECTORS, build_detector, generate_video
+
+# The pattern is a PATTERN_CELLS x PATTERN_CELLS grid, each cell CELL_FRACTION of the frame width,
+# one cell away from the frame edges: a white and a black reference cell, the 48 bit timestamp in
+# milliseconds, an 8 bit checksum and unused cells. It is drawn at every one of PATTERN_ANCHORS,
+# (x, y) fractions of the free space around it, so it can still be read when the overlay covers
+# some of the copies
+PATTERN_CELLS = 8
+CELL_FRACTION = 1 / 64
+PATTERN_ANCHORS = [(1.0, 1.0), (0.0, 1.0), (1.0, 0.0), (0.0, 0.0), (0.5, 1.0), (0.5, 0.0), (1.0, 0.5), (0.0, 0.5)]
+TIMESTAMP_BITS = 48
+CHECKSUM_BITS = 8
+
+
+def _pattern_cells(width, height, anchor):
+    """Yields the (x0, y0, x1, y1) rectangle of every cell of the copy of the pattern at an anchor, row by row."""
+    cell = width * CELL_FRACTION
+    left = cell + anchor[0] * (width - (PATTERN_CELLS + 2) * cell)
+    top = cell + anchor[1] * (height - (PATTERN_CELLS + 2) * cell)
+    for row in range(PATTERN_CELLS):
+        for column in range(PATTERN_CELLS):
+            yield (int(round(left + column * cell)), int(round(top + row * cell)),
+                   int(round(left + (column + 1) * cell)), int(round(top + (row + 1) * cell)))
+
+
+def _checksum(timestamp_ms):
+    return zlib.crc32(timestamp_ms.to_bytes(TIMESTAMP_BITS // 8, "big")) & ((1 << CHECKSUM_BITS) - 1)
+
+
+def stamp(frame, timestamp_ms):
+    """Draws the pattern of a timestamp in milliseconds on a frame, in place."""
+    timestamp_ms &= (1 << TIMESTAMP_BITS) - 1
+    payload = (timestamp_ms << CHECKSUM_BITS) | _checksum(timestamp_ms)
+    payload_bits = TIMESTAMP_BITS + CHECKSUM_BITS
+    bits = [1, 0] + [(payload >> (payload_bits - 1 - i)) & 1 for i in range(payload_bits)]
+    height, width = frame.shape[:2]
+    for anchor in PATTERN_ANCHORS:
+        for i, (x0, y0, x1, y1) in enumerate(_pattern_cells(width, height, anchor)):
+            frame[y0:y1, x0:x1] = 255 if i < len(bits) and bits[i] else 0
+
+
+def read_stamp(frame):
+    """Reads the timestamp in milliseconds back from a frame, or returns None if no copy of the pattern is readable."""
+    height, width = frame.shape[:2]
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    for anchor in PATTERN_ANCHORS:
+        timestamp_ms = _read_pattern(gray, width, height, anchor)
+        if timestamp_ms is not None:
+            return timestamp_ms
+    return None
+
+
+def _read_pattern(gray, width, height, anchor):
+    levels = []
+    for x0, y0, x1, y1 in _pattern_cells(width, height, anchor):
+        # The center half of the cell, away from the compression artifacts at its edges
+        dx, dy = (x1 - x0) // 4, (y1 - y0) // 4
+        cell = gray[y0 + dy:y1 - dy, x0 + dx:x1 - dx]
+        levels.append((int(cell.min()), int(cell.max())))
+    (white, _), (_, black) = levels[0], levels[1]
+    if white - black < 64:
+        return None
+    threshold = (white + black) / 2
+    payload = 0
+    for low, high in levels[2:2 + TIMESTAMP_BITS + CHECKSUM_BITS]:
+        # A cell crossed by a line of the overlay is neither white nor black throughout
+        if low <= threshold < high:
+            return None
+        payload = (payload << 1) | int(low > threshold)
+    timestamp_ms = payload >> CHECKSUM_BITS
+    if payload & ((1 << CHECKSUM_BITS) - 1) != _checksum(timestamp_ms):
+        return None
+    return timestamp_ms
+
+
+class StampedCapture:
+    """
+    Plays frames in a loop like a live camera, stamped with the time they were captured.
+
+    Frame n is captured at start + n / fps whether it is read or not. A reader that falls
+    behind gets the oldest of the last `buffered` frames, like the receive buffer of an RTSP
+    source, so the time frames wait in the source counts in the latency. Implements the subset
+    of the cv2.VideoCapture interface used by the detectors.
+    """
+
+    def __init__(self, frames, fps, buffered=1):
+        self.frames = frames
+        self.interval = 1.0 / fps
+        self.buffered = max(1, buffered)
+        self.start = None
+        self.index = 0
+
+    def isOpened(self):
+        return True
+
+    def _next(self):
+        now = time.time()
+        if self.start is None:
+            self.start = now
+        # Frames older than the buffer were overwritten
+        captured = int((now - self.start) / self.interval)
+        self.index = max(self.index, captured - self.buffered + 1)
+        captured_time = self.start + self.index * self.interval
+        if captured_time > now:
+            time.sleep(captured_time - now)
+        index = self.index
+        self.index += 1
+        return index, captured_time
+
+    def grab(self):
+        self._next()
+        return True
+
+    def read(self):
+        index, captured_time = self._next()
+        frame = self.frames[index % len(self.frames)].copy()
+        stamp(frame, int(captured_time * 1000))
+        return True, frame
+
+    def release(self):
+        pass
+
+
+def split_jpegs(chunks):
+    """Yields the JPEG images of an MJPEG byte stream, whatever the chunk boundaries."""
+    buffer = b""
+    for chunk in chunks:
+        buffer += chunk
+        while True:
+            start = buffer.find(b"\xff\xd8")
+            end = buffer.find(b"\xff\xd9", start + 2)
+            if start < 0 or end < 0:
+                break
+            yield buffer[start:end + 2]
+            buffer = buffer[end + 2:]
+
+
+def decode_mjpeg(chunks):
+    """Yields the decoded frames of an MJPEG byte stream."""
+    for jpeg in split_jpegs(chunks):
+        frame = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+        if frame is not None:
+            yield frame
+
+
+def decode_fmp4(chunks, ffmpeg):
+    """Yields the decoded frames of a fragmented MP4 byte stream, decoded by FFmpeg without buffering."""
+    process = subprocess.Popen([
+        ffmpeg, "-hide_banner", "-loglevel", "error", "-fflags", "nobuffer", "-flags", "low_delay",
+        "-f", "mp4", "-i", "pipe:0", "-f", "image2pipe", "-c:v", "bmp", "pipe:1"],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, bufsize=0)
+
+    def feed():
+        try:
+            for chunk in chunks:
+                process.stdin.write(chunk)
+        except (BrokenPipeError, OSError, ValueError):
+            pass
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+    threading.Thread(target=feed, daemon=True).start()
+    try:
+        while True:
+            # Every BMP image starts with "BM" and its size in bytes
+            header = _read_exactly(process.stdout, 6)
+            if header is None:
+                return
+            rest = _read_exactly(process.stdout, struct.unpack("<I", header[2:])[0] - 6)
+            if rest is None:
+                return
+            frame = cv2.imdecode(np.frombuffer(header + rest, np.uint8), cv2.IMREAD_COLOR)
+            if frame is not None:
+                yield frame
+    finally:
+        process.kill()
+        process.wait()
+
+
+def _read_exactly(stream, size):
+    data = b""
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def http_chunks(url):
+    """Yields the body of a streaming HTTP response as it arrives."""
+    with urllib.request.urlopen(url) as response:
+        while True:
+            chunk = response.read1(65536)
+            if not chunk:
+                return
+            yield chunk
+
+
+def measure(frames, duration, warmup):
+    """Reads the stamps of the decoded frames for duration seconds and returns the latencies in ms and unreadable frames."""
+    latencies = []
+    unreadable = 0
+    start = time.time()
+    for frame in frames:
+        now = time.time()
+        timestamp_ms = read_stamp(frame)
+        if now - start >= warmup:
+            if timestamp_ms is None:
+                unreadable += 1
+            else:
+                latencies.append(now * 1000 - timestamp_ms)
+        if now - start >= warmup + duration:
+            break
+    return latencies, unreadable
+
+
+def summarize(latencies):
+    """Returns the mean, p50, p90, p99 and max of the latencies in milliseconds."""
+    if not latencies:
+        return None
+    values = np.array(latencies)
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {"mean_ms": float(values.mean()), "p50_ms": float(p50), "p90_ms": float(p90), "p99_ms": float(p99), "max_ms": float(values.max())}
+
+
+def latency_outputs(config, outputs_dir, objects):
+    """
+    Returns the fake OVMS outputs, with the synthetic YOLOv8 outputs limited to a few objects.
+
+    The default synthetic outputs fill the frame with boxes, which would hide every copy of the pattern.
+    """
+    outputs = default_outputs(config, outputs_dir)
+    for model_name, model_config in config.items():
+        if "yolo" in model_name and not (outputs_dir and os.path.isdir(os.path.join(outputs_dir, model_name))):
+            outputs[model_name] = [synthetic_yolov8(len(model_config["class_names"]), model_config["input_shape"], num_objects=objects, seed=seed)
+                                   for seed in range(10)]
+    return outputs
+
+
+def run_pipeline(name, config, video, frames, args, ovms_url, max_in_flight, stream_format, motion_gate):
+    """Measures the latency of one detector pipeline configuration in-process."""
+    detector = build_detector(name, config, video, ovms_url)
+    detector.cap.release()
+    detector.cap = StampedCapture(frames, args.fps, args.source_buffer)
+    encoder = FMP4Encoder(fps=args.fps, ffmpeg=args.ffmpeg) if stream_format == "fmp4" else None
+    pipeline = DetectorPipeline(detector, max_in_flight=max_in_flight, motion_gate=MotionGate() if motion_gate else None, fmp4_encoder=encoder)
+    pipeline.start()
+    try:
+        if stream_format == "fmp4":
+            decoded = decode_fmp4(pipeline.fmp4(), args.ffmpeg)
+        else:
+            decoded = decode_mjpeg(pipeline.frames())
+        latencies, unreadable = measure(decoded, args.duration, args.warmup)
+        decoded.close()
+    finally:
+        pipeline.stop()
+    return latencies, unreadable
+
+
+def serve_source(url, frames, fps, ffmpeg, stop):
+    """Publishes the frames live with FFmpeg, stamped when they are handed to the encoder, until stop is set."""
+    height, width = frames[0].shape[:2]
+    output_format = "rtsp" if url.startswith("rtsp://") else "mpegts"
+    process = subprocess.Popen([
+        ffmpeg, "-hide_banner", "-loglevel", "error",
+        "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{width}x{height}", "-framerate", str(fps), "-i", "pipe:0",
+        "-c:v", "libx264", "-preset", "ultrafast", "-tune", "zerolatency", "-pix_fmt", "yuv420p", "-g", str(int(fps)),
+        "-f", output_format, url], stdin=subprocess.PIPE)
+    start = time.time()
+    index = 0
+    try:
+        while not stop.is_set():
+            captured_time = start + index / fps
+            time.sleep(max(0.0, captured_time - time.time()))
+            frame = frames[index % len(frames)].copy()
+            stamp(frame, int(time.time() * 1000))
+            process.stdin.write(frame.tobytes())
+            index += 1
+    except (BrokenPipeError, OSError) as e:
+        print(f"Publishing the source to {url} failed: {e}")
+    finally:
+        process.kill()
+        process.wait()
+
+
+def load_frames(video, count):
+    """Decodes up to count frames of a video into memory."""
+    cap = cv2.VideoCapture(video)
+    frames = []
+    while len(frames) < count:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--video", help="Local test video played as the source, a synthetic one is generated when omitted")
+    parser.add_argument("--source-frames", type=int, default=150, help="Number of frames of the video played in a loop")
+    parser.add_argument("--fps", type=float, default=30.0, help="Frame rate of the source")
+    parser.add_argument("--source-buffer", type=int, default=2, help="Frames the source buffers for a reader that falls behind")
+    parser.add_argument("--detectors", nargs="+", default=DETECTORS, help="Models (video names with --url) to measure")
+    parser.add_argument("--formats", nargs="+", default=["mjpeg"], choices=["mjpeg", "fmp4"])
+    parser.add_argument("--max-in-flight", type=int, nargs="+", default=[1, 2])
+    parser.add_argument("--motion-gate", action="store_true", help="Also measure every configuration with the default MotionGate")
+    parser.add_argument("--config", default=os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "config", "template_config_file.json"))
+    parser.add_argument("--outputs", help="Directory with one sub-directory of recorded outputs per model")
+    parser.add_argument("--objects", type=int, default=2, help="Objects in the synthetic YOLOv8 outputs, unless recorded with --outputs")
+    parser.add_argument("--latency-ms", type=float, default=10.0, help="Latency of every fake predict call")
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to measure each configuration")
+    parser.add_argument("--warmup", type=float, default=2.0, help="Seconds ignored at the start of each configuration")
+    parser.add_argument("--url", help="Base URL of a running webapp-decode to measure instead of in-process pipelines")
+    parser.add_argument("--serve", help="With --url, URL to publish the stamped source to with FFmpeg, e.g. rtsp://localhost:8554/latency")
+    parser.add_argument("--ffmpeg", default=os.environ.get("FFMPEG_PATH", "ffmpeg"), help="FFmpeg executable")
+    parser.add_argument("--json", help="File to write the results to")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        video = args.video
+        if video is None:
+            video = os.path.join(tmp, "synthetic.avi")
+            generate_video(video, frames=args.source_frames, size=(640, 360), fps=int(args.fps))
+        frames = load_frames(video, args.source_frames)
+
+        results = []
+        if args.url:
+            stop = threading.Event()
+            if args.serve:
+                threading.Thread(target=serve_source, args=(args.serve, frames, args.fps, args.ffmpeg, stop), daemon=True).start()
+            try:
+                for name in args.detectors:
+                    for stream_format in args.formats:
+                        chunks = http_chunks(f"{args.url.rstrip('/')}/video_feed?video={name}&format={stream_format}")
+                        decoded = decode_fmp4(chunks, args.ffmpeg) if stream_format == "fmp4" else decode_mjpeg(chunks)
+                        latencies, unreadable = measure(decoded, args.duration, args.warmup)
+                        decoded.close()
+                        results.append({"detector": name, "configuration": {"format": stream_format},
+                                        "latency": summarize(latencies), "frames": len(latencies), "unreadable": unreadable})
+            finally:
+                stop.set()
+        else:
+            with open(args.config) as config_file:
+                config = json.load(config_file)
+            with FakeOVMSServer(latency_outputs(config, args.outputs, args.objects), args.latency_ms, args.jitter_ms) as server:
+                for name in args.detectors:
+                    for max_in_flight in args.max_in_flight:
+                        for stream_format in args.formats:
+                            for motion_gate in ([False, True] if args.motion_gate else [False]):
+                                latencies, unreadable = run_pipeline(name, config, video, frames, args, server.url, max_in_flight, stream_format, motion_gate)
+                                configuration = {"max_in_flight": max_in_flight, "format": stream_format, "motion_gate": motion_gate}
+                                results.append({"detector": name, "configuration": configuration,
+                                                "latency": summarize(latencies), "frames": len(latencies), "unreadable": unreadable})
+
+    rows = []
+    for result in results:
+        configuration = " ".join(f"{key}={value}" for key, value in result["configuration"].items())
+        latency = result["latency"] or {}
+        rows.append([result["detector"], configuration] + [f"{latency[key]:.0f}" if key in latency else "-" for key in ("mean_ms", "p50_ms", "p90_ms", "p99_ms", "max_ms")]
+                    + [result["frames"], result["unreadable"]])
+    print(f"Source: {frames[0].shape[1]}x{frames[0].shape[0]} at {args.fps:g} FPS, buffering {args.source_buffer} frames")
+    print(tabulate(rows, headers=["Detector", "Configuration", "Mean (ms)", "p50", "p90", "p99", "Max", "Frames", "Unreadable"]))
+
+    if args.json:
+        report = {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "settings": {key: value for key, value in vars(args).items() if key != "json"},
+            "results": results,
+        }
+        with open(args.json, "w") as json_file:
+            json.dump(report, json_file, indent=2)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+Micro-benchmark for the overlay drawing of YOLOv8OVMS and PoseEstimator.
+
+Compares the original drawing code (cv2.getTextSize / putText per label and
+frame, one cv2.line per limb and a blend of the whole frame) against the
+OverlayRenderer in overlay.py, on a 1280x720 frame with synthetic detections
+and poses. Reports the time per frame of each and the fraction of pixels that
+differ between the two overlays.
+
+Usage:
+    python benchmark_overlay.py
+    python benchmark_overlay.py --boxes 30 --people 10 --size 1920 1080
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+# pylint: disable=wrong-import-position
+from overlay import OverlayRenderer
+from pose_estimator import PoseEstimator
+from yolov8 import YOLOv8OVMS
+
+
+def legacy_draw_detections(detector, img, box, score, class_id):
+    """The YOLOv8OVMS.draw_detections that drew every label with cv2.getTextSize and cv2.putText."""
+    x1, y1, w, h = box
+    cv2.rectangle(img, (int(x1), int(y1)), (int(x1 + w), int(y1 + h)), (0, 0, 255), 5)
+    label = f"{detector.class_names[class_id]}: {score:.2f}"
+    (label_width, label_height), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 1.2, 1)
+    label_x = x1
+    label_y = y1 - 10 if y1 - 10 > label_height else y1 + 20
+    cv2.rectangle(img, (label_x, label_y - label_height - 10), (label_x + label_width, label_y + 10), (0, 0, 255), cv2.FILLED)
+    cv2.putText(img, label, (label_x, label_y), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 0, 0), 1, cv2.LINE_AA)
+
+
+def legacy_draw_fps(detector, img):
+    """The YOLOv8OVMS.draw_fps that measured and drew every line on every frame."""
+    label_array = [f"FPS: {detector.total_fps:.02f}",
+                   f"FPS (inference): {detector.inference_fps:.02f}",
+                   f"Skipped frames: {detector.skip_ratio():.0%}",
+                   f"Input: {detector.img_width}x{detector.img_height}",
+                   f"Inferencing: {detector.input_width}x{detector.input_height}",
+                   f"Model: {detector.model_name}"]
+    pixel_border = 10
+    (label_x, label_y) = (30, 30)
+    for label in label_array:
+        (label_width, label_height), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 1.0, 1)
+        detector.log(f"Label: {label}, Width: {label_width}, Height: {label_height}")
+        cv2.rectangle(img, (label_x - pixel_border, label_y - pixel_border), (label_x + label_width + pixel_border, label_y + label_height + pixel_border), (0, 0, 255), cv2.FILLED)
+        cv2.putText(img, label, (label_x, label_y + label_height), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 0, 0), 1, cv2.LINE_AA)
+        label_y += (label_height + 2 * pixel_border)
+
+
+def legacy_draw_poses(estimator, img, poses, point_score_threshold, stick_width=4):
+    """The PoseEstimator.draw_poses that drew one line per limb and blended the whole frame."""
+    if poses.size == 0:
+        return img
+    img_limbs = np.copy(img)
+    for pose in poses:
+        points = pose[:, :2].astype(np.int32)
+        points_scores = pose[:, 2]
+        for i, (p, v) in enumerate(zip(points, points_scores)):
+            if v > point_score_threshold:
+                cv2.circle(img, tuple(p), 1, estimator.colors[i], 2)
+        for i, j in estimator.default_skeleton:
+            if points_scores[i] > point_score_threshold and points_scores[j] > point_score_threshold:
+                cv2.line(img_limbs, tuple(points[i]), tuple(points[j]), color=estimator.colors[j], thickness=stick_width)
+    cv2.addWeighted(img, 0.4, img_limbs, 0.6, 0, dst=img)
+    return img
+
+
+def make_yolo(size, class_names):
+    """Builds a YOLOv8OVMS instance without opening a video source or gRPC channel."""
+    detector = YOLOv8OVMS.__new__(YOLOv8OVMS)
+    detector.class_names = class_names
+    detector.color_palette = np.zeros((len(class_names), 3))
+    detector.img_width, detector.img_height = size
+    detector.input_width, detector.input_height = 640, 640
+    detector.model_name = "safety-yolo8"
+    detector.total_fps = 29.97
+    detector.inference_fps = 31.5
+    detector.skip_rate = 0
+    detector.verbose = False
+    detector.overlay = OverlayRenderer()
+    detector.tile_layout = None
+    detector.tile_count = 1
+    detector.cap = cv2.VideoCapture()
+    return detector
+
+
+def make_pose_estimator(config):
+    """Builds a PoseEstimator instance without opening a video source or gRPC channel."""
+    estimator = PoseEstimator.__new__(PoseEstimator)
+    estimator.default_skeleton = config["default_skeleton"]
+    estimator.colors = config["colors"]
+    estimator.overlay = OverlayRenderer()
+    estimator.cap = cv2.VideoCapture()
+    return estimator
+
+
+def synthetic_detections(count, size, num_classes, rng):
+    """Creates boxes (x, y, w, h), scores and class ids, with the scores rounded like the labels show them."""
+    x = rng.integers(0, size[0] - 200, count)
+    y = rng.integers(0, size[1] - 200, count)
+    boxes = np.stack((x, y, rng.integers(40, 200, count), rng.integers(40, 200, count)), axis=1)
+    scores = np.round(rng.uniform(0.5, 1.0, count), 2)
+    return boxes, scores, rng.integers(0, num_classes, count)
+
+
+def synthetic_poses(count, size, rng):
+    """Creates (people, 17, 3) poses around random centers with a few hidden joints."""
+    centers = rng.uniform((100, 100), (size[0] - 100, size[1] - 100), (count, 1, 2))
+    points = centers + rng.normal(0, 40, (count, 17, 2))
+    scores = np.where(rng.random((count, 17)) < 0.85, rng.uniform(0.3, 1.0, (count, 17)), 0.0)
+    return np.concatenate((points, scores[..., None]), axis=2).astype(np.float32)
+
+
+def time_it(func, frame, repeat):
+    """Returns the mean time of func(copy of frame) in milliseconds, excluding the copy, and the last result."""
+    total = 0.0
+    for _ in range(repeat):
+        img = frame.copy()
+        start = time.perf_counter()
+        func(img)
+        total += time.perf_counter() - start
+    return total * 1000 / repeat, img
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, nargs=2, default=[1280, 720])
+    parser.add_argument("--boxes", type=int, default=10)
+    parser.add_argument("--people", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--config", default=os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "config", "template_config_file.json"))
+    args = parser.parse_args()
+
+    with open(args.config) as config_file:
+        config = json.load(config_file)
+    size = tuple(args.size)
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 255, (size[1], size[0], 3), dtype=np.uint8)
+
+    yolo = make_yolo(size, config["safety-yolo8"]["class_names"])
+    boxes, scores, class_ids = synthetic_detections(args.boxes, size, len(yolo.class_names), rng)
+
+    def legacy_yolo(img):
+        for box, score, class_id in zip(boxes, scores, class_ids):
+            legacy_draw_detections(yolo, img, box, score, class_id)
+        legacy_draw_fps(yolo, img)
+
+    def yolo_overlay(img):
+        for box, score, class_id in zip(boxes, scores, class_ids):
+            yolo.draw_detections(img, box, score, class_id)
+        yolo.draw_fps(img)
+
+    estimator = make_pose_estimator(config["human-pose-estimation"])
+    poses = synthetic_poses(args.people, size, rng)
+    threshold = config["human-pose-estimation"]["conf_thres"]
+
+    rows = [
+        ("YOLOv8 labels", lambda img: legacy_yolo(img), yolo_overlay),
+        ("Poses", lambda img: legacy_draw_poses(estimator, img, poses, threshold), lambda img: estimator.draw_poses(img, poses, threshold)),
+    ]
+    print(f"Frame {size[0]}x{size[1]}, {args.boxes} boxes, {args.people} people")
+    for name, legacy, renderer in rows:
+        renderer(frame.copy())  # Fill the sprite cache like the frames before
+        legacy_ms, legacy_img = time_it(legacy, frame, args.repeat)
+        renderer_ms, renderer_img = time_it(renderer, frame, args.repeat)
+        differ = np.any(legacy_img != renderer_img, axis=2).mean()
+        print(f"{name:14s} legacy {legacy_ms:7.3f} ms  renderer {renderer_ms:7.3f} ms  speedup {legacy_ms / renderer_ms:5.1f}x  pixels differing {differ:.3%}")
+
+
+if __name__ == "__main__":
+    main()
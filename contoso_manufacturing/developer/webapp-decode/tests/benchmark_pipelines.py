@@ -0,0 +1,266 @@
+"""
+Offline benchmark of the webapp-decode detector pipelines.
+
+Replays a local video through YOLOv8OVMS, PoseEstimator, WeldPorosity and
+BoltDetection, each running in a DetectorPipeline against the in-process fake
+OVMS from fake_ovms.py, and reports per detector:
+  - output FPS (frames received by one viewer)
+  - p50 / p99 time per stage (capture, preprocess, predict, postprocess, draw, encode, encode_raw)
+  - dropped frames and the resident memory of the process
+No OVMS, camera or network is needed. When no video is given, a synthetic one is
+generated. Use --json to write machine-readable results that can be compared
+between releases.
+
+Usage:
+    python benchmark_pipelines.py
+    python benchmark_pipelines.py --video ./videos/helmet.mp4 --latency-ms 15 --duration 20 --json results.json
+    python benchmark_pipelines.py --detectors safety-yolo8 human-pose-estimation --outputs ./recorded_outputs
+    python benchmark_pipelines.py --static-ratio 0.8 --motion-gate
+    python benchmark_pipelines.py --client-overlay
+
+With --client-overlay the viewer subscribes to the detection metadata and the
+raw video instead of the annotated video, as a browser drawing the overlay
+itself does; the FPS is then the rate of detection messages.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+from tabulate import tabulate
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+# pylint: disable=wrong-import-position
+from yolov8 import YOLOv8OVMS
+from welding import WeldPorosity
+from pose_estimator import PoseEstimator
+from bolt_detection import BoltDetection
+from pipeline import DetectorPipeline
+from motion_gate import MotionGate
+from metrics import PipelineMetrics
+from fake_ovms import FakeOVMSServer, default_outputs
+
+DETECTORS = ["safety-yolo8", "yolov8n", "weld-porosity-detection", "human-pose-estimation", "bolt-detection"]
+
+# BoltDetection is not part of the template configuration
+BOLT_CONFIG = {"conf_thres": 0.5, "iou_thres": 0.5, "input_shape": [640, 640]}
+
+
+class RecordingMetrics(PipelineMetrics):
+    """PipelineMetrics that also keeps every sample to compute exact percentiles."""
+
+    def __init__(self):
+        super().__init__()
+        self.samples = {stage: [] for stage in self.STAGES}
+
+    def observe(self, stage, seconds):
+        super().observe(stage, seconds)
+        self.samples[stage].append(seconds)
+
+    def percentiles(self):
+        """Returns the count, p50 and p99 in milliseconds of every stage."""
+        results = {}
+        for stage, samples in self.samples.items():
+            if samples:
+                p50, p99 = np.percentile(np.array(samples) * 1000, [50, 99])
+                results[stage] = {"count": len(samples), "p50_ms": float(p50), "p99_ms": float(p99)}
+        return results
+
+
+def generate_video(path, frames=300, size=(1280, 720), fps=30, static_ratio=0.0):
+    """
+    Writes a video with moving shapes, used when no video is given.
+
+    With a static_ratio, the shapes stand still during that fraction of every second of video
+    and only sensor-like noise changes, like a conveyor between two parts.
+    """
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, size)
+    rng = np.random.default_rng(0)
+    background = rng.integers(0, 64, (size[1], size[0], 3), dtype=np.uint8)
+    i = 0
+    for n in range(frames):
+        if static_ratio > 0:
+            if n % fps < fps * (1 - static_ratio):
+                i += 1
+            frame = cv2.add(background, rng.integers(0, 4, background.shape, dtype=np.uint8))
+        else:
+            i = n
+            frame = background.copy()
+        for j in range(6):
+            x = int((i * (3 + j) + j * 200) % size[0])
+            y = int(size[1] / 2 + np.sin(i / 15 + j) * size[1] / 3)
+            cv2.circle(frame, (x, y), 40 + 10 * j, (60 * j % 255, 200, 255 - 40 * j), -1)
+        writer.write(frame)
+    writer.release()
+
+
+def build_detector(name, config, video, ovms_url):
+    """Creates a detector the way app.py does, reading from a local video and the fake OVMS."""
+    if name in ("safety-yolo8", "yolov8n"):
+        model_config = config[name]
+        return YOLOv8OVMS(
+            rtsp_url=video, class_names=model_config["class_names"], input_shape=model_config["input_shape"],
+            color_palette=None, confidence_thres=model_config["conf_thres"], iou_thres=model_config["iou_thres"],
+            model_name=name, ovms_url=ovms_url, save_img_loc=False, skip_rate=0)
+    if name == "weld-porosity-detection":
+        model_config = config[name]
+        return WeldPorosity(
+            rtsp_url=video, class_names=model_config["class_names"], input_shape=model_config["input_shape"],
+            confidence_thres=model_config["conf_thres"], iou_thres=model_config["iou_thres"],
+            model_name=name, ovms_url=ovms_url, skip_rate=0)
+    if name == "human-pose-estimation":
+        model_config = config[name]
+        return PoseEstimator(
+            rtsp_url=video, class_names=model_config["class_names"], input_shape=model_config["input_shape"],
+            confidence_thres=model_config["conf_thres"], iou_thres=model_config["iou_thres"],
+            model_name=name, ovms_url=ovms_url, skip_rate=0,
+            default_skeleton=model_config["default_skeleton"], colors=model_config["colors"],
+            nms_kernel=model_config.get("nms_kernel", 3), keyframe_interval=model_config.get("keyframe_interval", 1),
+            min_tracking_confidence=model_config.get("min_tracking_confidence", 0.5))
+    if name == "bolt-detection":
+        model_config = config.get(name, BOLT_CONFIG)
+        return BoltDetection(
+            rtsp_url=video, input_shape=model_config["input_shape"], confidence_thres=model_config["conf_thres"],
+            iou_thres=model_config["iou_thres"], model_name=name, ovms_url=ovms_url, skip_rate=0)
+    raise ValueError(f"Unknown detector: {name}")
+
+
+def memory_mb():
+    """Returns the current and peak resident memory of the process in MiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+    try:
+        with open("/proc/self/statm") as statm:
+            current = int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except OSError:
+        current = peak
+    return current, peak
+
+
+def consume(stream, received):
+    """Reads a pipeline stream until it is closed, adding up the bytes received."""
+    for item in stream:
+        received[0] += len(item)
+
+
+def run_detector(name, config, video, ovms_url, max_in_flight, duration, motion_gate=False, client_overlay=False):
+    """Runs one detector pipeline for duration seconds and returns its results."""
+    detector = build_detector(name, config, video, ovms_url)
+    metrics = RecordingMetrics()
+    pipeline = DetectorPipeline(detector, max_in_flight=max_in_flight, metrics=metrics, motion_gate=MotionGate() if motion_gate else None)
+    pipeline.warm_up()
+    pipeline.start()
+
+    received = [0]
+    stream = pipeline.frames()
+    if client_overlay:
+        stream = pipeline.metadata()
+        raw_viewer = threading.Thread(target=consume, args=((frame for _, frame in pipeline.raw_frames()), received), daemon=True)
+        raw_viewer.start()
+
+    frames = 0
+    first_frame = None
+    start = time.perf_counter()
+    for item in stream:
+        received[0] += len(item)
+        now = time.perf_counter()
+        if first_frame is None:
+            first_frame = now
+        frames += 1
+        if now - start >= duration:
+            break
+    elapsed = time.perf_counter() - (first_frame or start)
+    stats = pipeline.stats()
+    pipeline.stop()
+    total_elapsed = time.perf_counter() - start
+
+    current, peak = memory_mb()
+    return {
+        "detector": name,
+        "fps": (frames - 1) / elapsed if frames > 1 and elapsed > 0 else 0.0,
+        "frames": frames,
+        "kbytes_per_second": received[0] / 1024 / total_elapsed if total_elapsed > 0 else 0.0,
+        "stages": metrics.percentiles(),
+        "dropped_frames": stats["dropped_frames"],
+        "failed": stats["failed"],
+        "motion_gate": stats.get("motion_gate"),
+        "memory_mb": current,
+        "peak_memory_mb": peak,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--video", help="Local video to replay, a synthetic one is generated when omitted")
+    parser.add_argument("--detectors", nargs="+", default=DETECTORS, choices=DETECTORS)
+    parser.add_argument("--config", default=os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "config", "template_config_file.json"))
+    parser.add_argument("--outputs", help="Directory with one sub-directory of recorded outputs per model")
+    parser.add_argument("--latency-ms", type=float, default=10.0, help="Latency of every fake predict call")
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--max-in-flight", type=int, default=2)
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to run each detector")
+    parser.add_argument("--static-ratio", type=float, default=0.0, help="Fraction of every second the synthetic video is static")
+    parser.add_argument("--motion-gate", action="store_true", help="Reuse the last result on static frames with the default MotionGate")
+    parser.add_argument("--client-overlay", action="store_true", help="Stream the detection metadata and raw video instead of the annotated video")
+    parser.add_argument("--json", help="File to write the results to")
+    args = parser.parse_args()
+
+    with open(args.config) as config_file:
+        config = json.load(config_file)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        video = args.video
+        if video is None:
+            video = os.path.join(tmp, "synthetic.avi")
+            generate_video(video, static_ratio=args.static_ratio)
+
+        results = []
+        with FakeOVMSServer(default_outputs(config, args.outputs), args.latency_ms, args.jitter_ms) as server:
+            for name in args.detectors:
+                results.append(run_detector(name, config, video, server.url, args.max_in_flight, args.duration, args.motion_gate, args.client_overlay))
+
+    rows = []
+    for result in results:
+        stages = " ".join(f"{stage}={values['p50_ms']:.1f}/{values['p99_ms']:.1f}" for stage, values in result["stages"].items())
+        gate = result["motion_gate"]
+        gated = f"{gate['gated_ratio']:.0%} ({gate['saved_seconds']:.1f} s)" if gate else "-"
+        rows.append([result["detector"], f"{result['fps']:.1f}", stages, sum(result["dropped_frames"].values()), gated,
+                     f"{result['kbytes_per_second']:.0f}", f"{result['memory_mb']:.0f}"])
+    print(tabulate(rows, headers=["Detector", "FPS", "Stage p50/p99 (ms)", "Dropped", "Gated (saved)", "KiB/s", "RSS (MiB)"]))
+
+    if args.json:
+        report = {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "environment": {
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "opencv": cv2.__version__,
+                "machine": platform.machine(),
+                "cpus": os.cpu_count(),
+            },
+            "settings": {
+                "video": args.video or "synthetic",
+                "latency_ms": args.latency_ms,
+                "jitter_ms": args.jitter_ms,
+                "max_in_flight": args.max_in_flight,
+                "duration": args.duration,
+                "static_ratio": args.static_ratio,
+                "motion_gate": args.motion_gate,
+                "client_overlay": args.client_overlay,
+            },
+            "results": results,
+        }
+        with open(args.json, "w") as json_file:
+            json.dump(report, json_file, indent=2)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
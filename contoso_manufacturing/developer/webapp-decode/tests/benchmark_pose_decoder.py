@@ -0,0 +1,288 @@
+"""
+Micro-benchmark for the grouping, adjust and refine steps of AssociativeEmbeddingDecoder.
+
+Compares the original per-person Pose objects, padded assignment problems and
+per-joint Python loops against the array-backed grouping, the rectangular
+assignment and the vectorized adjust() and refine() in pose_decoder.py. Reports
+the time per frame of each step and of the whole decoder, and the frames where
+the poses or scores differ, which can only happen when two assignments of the
+joints to poses have the same cost. Also reports the top_k candidates, poses and
+decoder time with the heatmap NMS of PoseEstimator. Uses recorded human-pose-estimation outputs
+(.npz files with "heatmaps" and "2674" arrays, see record_outputs.py) when
+given, synthetic ones otherwise.
+
+Usage:
+    python benchmark_pose_decoder.py --people 30
+    python benchmark_pose_decoder.py --outputs ./recorded_outputs/human-pose-estimation
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+# pylint: disable=wrong-import-position
+from pose_decoder import AssociativeEmbeddingDecoder, heatmap_nms
+from fake_ovms import load_outputs, synthetic_pose
+
+
+class LegacyPose:
+    """The per-person object _match_by_tag grouped the joints in before PoseGroups."""
+
+    def __init__(self, num_joints, tag_size=1):
+        self.num_joints = num_joints
+        self.tag_size = tag_size
+        self.pose = np.zeros((num_joints, 2 + 1 + tag_size), dtype=np.float32)
+        self.pose_tag = np.zeros(tag_size, dtype=np.float32)
+        self.valid_points_num = 0
+        self.c = np.zeros(2, dtype=np.float32)
+
+    def add(self, idx, joint, tag):
+        self.pose[idx] = joint
+        self.c = self.c * self.valid_points_num + joint[:2]
+        self.pose_tag = (self.pose_tag * self.valid_points_num) + tag
+        self.valid_points_num += 1
+        self.c /= self.valid_points_num
+        self.pose_tag /= self.valid_points_num
+
+    @property
+    def tag(self):
+        if self.valid_points_num > 0:
+            return self.pose_tag
+        return None
+
+    @property
+    def center(self):
+        if self.valid_points_num > 0:
+            return self.c
+        return None
+
+
+def legacy_max_match(scores):
+    """The _max_match of AssociativeEmbeddingDecoder before it returned the rows and columns directly."""
+    r, c = linear_sum_assignment(scores)
+    return np.stack((r, c), axis=1)
+
+
+def legacy_match_by_tag(self, inp):
+    """The _match_by_tag of AssociativeEmbeddingDecoder before PoseGroups."""
+    tag_k, loc_k, val_k = inp
+    embd_size = tag_k.shape[2]
+    all_joints = np.concatenate((loc_k, val_k[..., None], tag_k), -1)
+
+    poses = []
+    for idx in self.joint_order:
+        tags = tag_k[idx]
+        joints = all_joints[idx]
+        mask = joints[:, 2] > self.detection_threshold
+        tags = tags[mask]
+        joints = joints[mask]
+
+        if len(poses) == 0:
+            for tag, joint in zip(tags, joints):
+                pose = LegacyPose(self.num_joints, embd_size)
+                pose.add(idx, joint, tag)
+                poses.append(pose)
+            continue
+
+        if joints.shape[0] == 0 or (self.ignore_too_much and len(poses) == self.max_num_people):
+            continue
+
+        poses_tags = np.stack([p.tag for p in poses], axis=0)
+        diff = tags[:, None] - poses_tags[None, :]
+        diff_normed = np.linalg.norm(diff, ord=2, axis=2)
+        diff_saved = np.copy(diff_normed)
+
+        if self.dist_reweight:
+            centers = np.stack([p.center for p in poses], axis=0)[None]
+            dists = np.linalg.norm(joints[:, :2][:, None, :] - centers, ord=2, axis=2)
+            close_tags_masks = diff_normed < self.tag_threshold
+            min_dists = np.min(dists, axis=0, keepdims=True)
+            dists /= min_dists + 1e-10
+            diff_normed[close_tags_masks] *= dists[close_tags_masks]
+
+        if self.use_detection_val:
+            diff_normed = np.round(diff_normed) * 100 - joints[:, 2:3]
+        num_added = diff.shape[0]
+        num_grouped = diff.shape[1]
+        if num_added > num_grouped:
+            diff_normed = np.pad(diff_normed, ((0, 0), (0, num_added - num_grouped)),
+                                 mode='constant', constant_values=1e10)
+
+        pairs = self._max_match(diff_normed)
+        for row, col in pairs:
+            if row < num_added and col < num_grouped and diff_saved[row][col] < self.tag_threshold:
+                poses[col].add(idx, joints[row], tags[row])
+            else:
+                pose = LegacyPose(self.num_joints, embd_size)
+                pose.add(idx, joints[row], tags[row])
+                poses.append(pose)
+
+    ans = np.asarray([p.pose for p in poses], dtype=np.float32).reshape(-1, self.num_joints, 2 + 1 + embd_size)
+    tags = np.asarray([p.tag for p in poses], dtype=np.float32).reshape(-1, embd_size)
+    return ans, tags
+
+
+def legacy_adjust(ans, heatmaps):
+    """The per-joint loop AssociativeEmbeddingDecoder.adjust used before vectorization."""
+    H, W = heatmaps.shape[-2:]
+    for batch_idx, people in enumerate(ans):
+        for person in people:
+            for k, joint in enumerate(person):
+                heatmap = heatmaps[batch_idx, k]
+                px = int(joint[0])
+                py = int(joint[1])
+                if 1 < px < W - 1 and 1 < py < H - 1:
+                    diff = np.array([
+                        heatmap[py, px + 1] - heatmap[py, px - 1],
+                        heatmap[py + 1, px] - heatmap[py - 1, px]
+                    ])
+                    joint[:2] += np.sign(diff) * .25
+    return ans
+
+
+def legacy_refine(heatmap, tag, keypoints, pose_tag=None):
+    """The per-joint loop AssociativeEmbeddingDecoder.refine used before vectorization."""
+    K, H, W = heatmap.shape
+    if len(tag.shape) == 3:
+        tag = tag[..., None]
+
+    if pose_tag is not None:
+        prev_tag = pose_tag
+    else:
+        tags = []
+        for i in range(K):
+            if keypoints[i, 2] > 0:
+                x, y = keypoints[i][:2].astype(int)
+                tags.append(tag[i, y, x])
+        prev_tag = np.mean(tags, axis=0)
+
+    for i, (_heatmap, _tag) in enumerate(zip(heatmap, tag)):
+        if keypoints[i, 2] > 0:
+            continue
+        diff = np.abs(_tag[..., 0] - prev_tag) + 0.5
+        diff = diff.astype(np.int32).astype(_heatmap.dtype)
+        diff -= _heatmap
+        idx = diff.argmin()
+        y, x = np.divmod(idx, _heatmap.shape[-1])
+        val = _heatmap[y, x]
+        if val > 0:
+            keypoints[i, :3] = x, y, val
+            if 1 < x < W - 1 and 1 < y < H - 1:
+                diff = np.array([
+                    _heatmap[y, x + 1] - _heatmap[y, x - 1],
+                    _heatmap[y + 1, x] - _heatmap[y - 1, x]
+                ])
+                keypoints[i, :2] += np.sign(diff) * .25
+    return keypoints
+
+
+class LegacyDecoder(AssociativeEmbeddingDecoder):
+    """AssociativeEmbeddingDecoder with the original grouping, adjust and refine loops."""
+    _match_by_tag = legacy_match_by_tag
+    _max_match = staticmethod(legacy_max_match)
+    adjust = staticmethod(legacy_adjust)
+    refine = staticmethod(legacy_refine)
+
+
+def make_decoder(cls, detection_threshold):
+    """Creates a decoder with the settings PoseEstimator uses."""
+    return cls(num_joints=17, adjust=True, refine=True, delta=0.5, max_num_people=30,
+               detection_threshold=detection_threshold, tag_threshold=1, pose_threshold=0.1,
+               use_detection_val=True, ignore_too_much=False, dist_reweight=True)
+
+
+def grouped_poses(decoder, heatmaps, tags):
+    """Runs top_k and the grouping of the decoder, returning the inputs of adjust and refine."""
+    tag_k, loc_k, val_k = decoder.top_k(heatmaps, tags)
+    ans = tuple(map(decoder._match_by_tag, zip(tag_k, loc_k, val_k)))
+    ans, ans_tags = map(list, zip(*ans))
+    return ans, ans_tags
+
+
+def time_it(func, repeat):
+    """Returns the mean time of func() in milliseconds."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) * 1000 / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--outputs", help="Directory of recorded .npz outputs")
+    parser.add_argument("--people", type=int, default=30, help="Number of people in the synthetic outputs")
+    parser.add_argument("--size", type=int, default=224, help="Heatmap size of the synthetic outputs")
+    parser.add_argument("--sigma", type=float, default=1.5, help="Standard deviation in pixels of the synthetic joint peaks")
+    parser.add_argument("--detection-threshold", type=float, default=0.1)
+    parser.add_argument("--nms-kernel", type=int, default=3, help="Pooling window of the heatmap NMS")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.outputs:
+        outputs = load_outputs(args.outputs)
+    else:
+        outputs = [synthetic_pose(size=args.size, num_people=args.people, sigma=args.sigma, seed=seed) for seed in range(5)]
+    frames = [(np.abs(o["heatmaps"]), o["2674"]) for o in outputs]
+
+    legacy = make_decoder(LegacyDecoder, args.detection_threshold)
+    vectorized = make_decoder(AssociativeEmbeddingDecoder, args.detection_threshold)
+
+    # Identical outputs of the whole decoder
+    mismatches = 0
+    people = 0
+    for heatmaps, tags in frames:
+        legacy_poses, legacy_scores = legacy(heatmaps.copy(), tags, nms_heatmaps=heatmaps)
+        poses, scores = vectorized(heatmaps.copy(), tags, nms_heatmaps=heatmaps)
+        people += len(poses)
+        # The tag and center means are computed from sums instead of running means, so they may differ in the last bits
+        if not (legacy_poses.shape == poses.shape and np.allclose(legacy_poses, poses, atol=1e-5) and np.allclose(legacy_scores, scores, atol=1e-5)):
+            mismatches += 1
+
+    group_ms = {}
+    adjust_ms = {}
+    refine_ms = {}
+    for name, decoder in (("legacy", legacy), ("vectorized", vectorized)):
+        group_total = adjust_total = refine_total = 0.0
+        for heatmaps, tags in frames:
+            group_total += time_it(lambda: grouped_poses(decoder, heatmaps, tags), args.repeat)
+            ans, ans_tags = grouped_poses(decoder, heatmaps, tags)
+            adjust_total += time_it(lambda: decoder.adjust([a.copy() for a in ans], heatmaps), args.repeat)
+            refine_total += time_it(lambda: [decoder.refine(heatmaps[0], tags[0], pose.copy(), tag) for pose, tag in zip(ans[0], ans_tags[0])], args.repeat)
+        group_ms[name] = group_total / len(frames)
+        adjust_ms[name] = adjust_total / len(frames)
+        refine_ms[name] = refine_total / len(frames)
+
+    decode_ms = {
+        name: sum(time_it(lambda: decoder(heatmaps.copy(), tags, nms_heatmaps=heatmaps), args.repeat) for heatmaps, tags in frames) / len(frames)
+        for name, decoder in (("legacy", legacy), ("vectorized", vectorized))
+    }
+
+    print(f"Frames: {len(frames)} x heatmaps {tuple(frames[0][0].shape)}, {people / len(frames):.1f} poses per frame")
+    for step, times in (("group", group_ms), ("adjust", adjust_ms), ("refine", refine_ms), ("decoder", decode_ms)):
+        print(f"{step:8s} legacy {times['legacy']:8.3f} ms  vectorized {times['vectorized']:8.3f} ms  speedup {times['legacy'] / times['vectorized']:6.1f}x")
+    print(f"Frames with different poses or scores: {mismatches}")
+
+    # Candidates and decoder time with the heatmap NMS of PoseEstimator.decode
+    candidates = {"raw": 0, "nms": 0}
+    nms_people = 0
+    for heatmaps, tags in frames:
+        nms_heatmaps = heatmap_nms(heatmaps, args.nms_kernel)
+        for name, candidate_heatmaps in (("raw", heatmaps), ("nms", nms_heatmaps)):
+            _, _, val_k = vectorized.top_k(candidate_heatmaps, tags)
+            candidates[name] += np.count_nonzero(val_k > args.detection_threshold)
+        nms_people += len(vectorized(heatmaps.copy(), tags, nms_heatmaps=nms_heatmaps)[0])
+    nms_ms = sum(time_it(lambda: heatmap_nms(heatmaps, args.nms_kernel), args.repeat) for heatmaps, _ in frames) / len(frames)
+    nms_decode_ms = sum(
+        time_it(lambda: vectorized(heatmaps.copy(), tags, nms_heatmaps=heatmap_nms(heatmaps, args.nms_kernel)), args.repeat)
+        for heatmaps, tags in frames) / len(frames)
+    print(f"Heatmap NMS {args.nms_kernel}x{args.nms_kernel}: {nms_ms:.3f} ms, candidates per frame {candidates['raw'] / len(frames):.1f} -> {candidates['nms'] / len(frames):.1f}, "
+          f"poses per frame {people / len(frames):.1f} -> {nms_people / len(frames):.1f}, decoder with NMS {nms_decode_ms:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
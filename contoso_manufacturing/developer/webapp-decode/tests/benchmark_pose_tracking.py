@@ -0,0 +1,162 @@
+"""
+Benchmark of the keyframe-plus-tracking mode of PoseEstimator.
+
+Processes the same frames of a video with a PoseEstimator that runs the model
+on every frame (the reference) and with PoseEstimators that run it on every
+n-th frame only and track the joints with optical flow in between. Reports
+per keyframe interval:
+  - FPS of the sequential preprocess / predict / postprocess / draw loop
+  - keyframes and forced re-detects
+  - joint drift: distance in pixels between the joints of the tracked poses and
+    the joints of the reference poses on the same frame, for the joints visible
+    in both, on the frames between keyframes
+
+Drift is only meaningful with a real model: pass --ovms-url of an OVMS serving
+human-pose-estimation, or --model-path of its OpenVINO IR. Without either, the
+in-process fake OVMS from fake_ovms.py serves synthetic or --outputs
+recordings, which measures the FPS only.
+
+Usage:
+    python benchmark_pose_tracking.py --video ./videos/people.mp4 --ovms-url localhost:9000 --intervals 2 5 10
+    python benchmark_pose_tracking.py --video ./videos/people.mp4 --model-path ./models/human-pose-estimation/1/model.xml
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from tabulate import tabulate
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+# pylint: disable=wrong-import-position
+from backends import OpenVINOBackend
+from benchmark_pipelines import build_detector, generate_video
+from fake_ovms import FakeOVMSServer, default_outputs
+
+MODEL_NAME = "human-pose-estimation"
+
+
+def read_frames(video, count):
+    """Reads the first count frames of the video."""
+    cap = cv2.VideoCapture(video)
+    frames = []
+    while len(frames) < count:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def run(detector, frames):
+    """
+    Processes the frames one by one.
+
+    Returns:
+        tuple: The FPS, the poses drawn on every frame and whether each frame was tracked.
+    """
+    poses_per_frame = []
+    tracked_frames = []
+    draw_poses = detector.draw_poses
+
+    def draw_and_record(img, poses, *args, **kwargs):
+        poses_per_frame.append(poses.copy())
+        tracked_frames.append(detector.tracker is not None and detector.tracker.frames_since_keyframe > 0)
+        return draw_poses(img, poses, *args, **kwargs)
+
+    detector.draw_poses = draw_and_record
+    start = time.perf_counter()
+    for frame in frames:
+        detector.process(frame.copy())
+    elapsed = time.perf_counter() - start
+    return len(frames) / elapsed, poses_per_frame, tracked_frames
+
+
+def joint_drift(poses, reference, threshold):
+    """Matches the poses to the reference poses and returns the distances of the joints visible in both."""
+    if len(poses) == 0 or len(reference) == 0:
+        return np.empty(0)
+    visible = (poses[:, None, :, 2] > threshold) & (reference[None, :, :, 2] > threshold)
+    distances = np.linalg.norm(poses[:, None, :, :2] - reference[None, :, :, :2], axis=3)
+    # Mean distance of the shared joints, pairs without shared joints are never matched
+    shared = visible.sum(axis=2)
+    costs = np.where(shared > 0, (distances * visible).sum(axis=2) / np.maximum(shared, 1), 1e9)
+    rows, cols = linear_sum_assignment(costs)
+    return np.concatenate([distances[r, c][visible[r, c]] for r, c in zip(rows, cols) if shared[r, c] > 0] or [np.empty(0)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--video", help="Local video to process, a synthetic one is generated when omitted")
+    parser.add_argument("--frames", type=int, default=150, help="Number of frames to process")
+    parser.add_argument("--intervals", type=int, nargs="+", default=[2, 5, 10], help="Keyframe intervals to compare")
+    parser.add_argument("--min-confidence", type=float, default=0.5)
+    parser.add_argument("--ovms-url", help="OVMS serving human-pose-estimation")
+    parser.add_argument("--model-path", help="OpenVINO IR of human-pose-estimation, run in process")
+    parser.add_argument("--outputs", help="Directory with one sub-directory of recorded outputs per model, for the fake OVMS")
+    parser.add_argument("--latency-ms", type=float, default=30.0, help="Latency of every fake predict call")
+    parser.add_argument("--config", default=os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "config", "template_config_file.json"))
+    parser.add_argument("--json", help="File to write the results to")
+    args = parser.parse_args()
+
+    with open(args.config) as config_file:
+        config = json.load(config_file)
+    threshold = config[MODEL_NAME]["conf_thres"]
+
+    with contextlib.ExitStack() as stack:
+        video = args.video
+        if video is None:
+            video = os.path.join(stack.enter_context(tempfile.TemporaryDirectory()), "synthetic.avi")
+            generate_video(video, frames=args.frames)
+        frames = read_frames(video, args.frames)
+
+        ovms_url = args.ovms_url
+        if ovms_url is None and args.model_path is None:
+            print("No model given, the fake OVMS only measures the FPS, drift is meaningless")
+            server = stack.enter_context(FakeOVMSServer(default_outputs(config, args.outputs), args.latency_ms))
+            ovms_url = server.url
+
+        def make_detector(interval):
+            model_config = dict(config[MODEL_NAME], keyframe_interval=interval, min_tracking_confidence=args.min_confidence)
+            detector = build_detector(MODEL_NAME, {MODEL_NAME: model_config}, video, ovms_url or "localhost:9000")
+            if args.model_path:
+                detector.backend = OpenVINOBackend(args.model_path)
+            return detector
+
+        reference_fps, reference, _ = run(make_detector(1), frames)
+        results = [{"keyframe_interval": 1, "fps": reference_fps, "keyframes": len(frames), "forced_keyframes": 0,
+                    "drift_mean_px": 0.0, "drift_p95_px": 0.0}]
+        for interval in args.intervals:
+            detector = make_detector(interval)
+            fps, poses, tracked = run(detector, frames)
+            tracking = detector.tracker.stats()
+            drift = np.concatenate([joint_drift(p, r, threshold) for p, r, t in zip(poses, reference, tracked) if t] or [np.empty(0)])
+            results.append({
+                "keyframe_interval": interval,
+                "fps": fps,
+                "keyframes": tracking["keyframes"],
+                "forced_keyframes": tracking["forced_keyframes"],
+                "drift_mean_px": float(drift.mean()) if drift.size else 0.0,
+                "drift_p95_px": float(np.percentile(drift, 95)) if drift.size else 0.0,
+            })
+
+    print(f"Frames: {len(frames)} of {args.video or 'a synthetic video'}")
+    print(tabulate([[r["keyframe_interval"], f"{r['fps']:.1f}", r["keyframes"], r["forced_keyframes"], f"{r['drift_mean_px']:.1f}", f"{r['drift_p95_px']:.1f}"] for r in results],
+                   headers=["Keyframe interval", "FPS", "Keyframes", "Forced", "Drift mean (px)", "Drift p95 (px)"]))
+
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump({"frames": len(frames), "video": args.video or "synthetic", "results": results}, json_file, indent=2)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Micro-benchmark for the detector preprocessing.
+
+Compares the original copy chains of YOLOv8OVMS, WeldPorosity and PoseEstimator
+against the fused TensorPreprocessor, reporting the time and the peak number of
+bytes allocated per frame (measured with tracemalloc) and checking that both
+produce the same input tensor. Frames are read from a local video when given,
+otherwise a synthetic frame is used.
+
+Usage:
+    python benchmark_preprocess.py
+    python benchmark_preprocess.py --video ./videos/helmet.mp4 --repeat 200
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+# pylint: disable=wrong-import-position
+from preprocessing import TensorPreprocessor
+from pose_decoder import resize_image
+
+
+def legacy_yolov8(img, input_shape):
+    """The preprocessing YOLOv8OVMS used before the fused preprocessor."""
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    img = cv2.resize(img, tuple(input_shape))
+    image_data = np.array(img) / 255.0
+    image_data = np.transpose(image_data, (2, 0, 1))
+    return np.expand_dims(image_data, axis=0).astype(np.float32)
+
+
+def legacy_welding(img, input_shape):
+    """The preprocessing WeldPorosity used before the fused preprocessor."""
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    img = cv2.resize(img, tuple(input_shape))
+    img = img.astype(np.float32)
+    img = img.transpose((2, 0, 1))
+    img = img[np.newaxis, ...]
+    return img[:, ::-1, :, :]
+
+
+def legacy_pose(img, input_shape):
+    """The preprocessing PoseEstimator used before the fused preprocessor."""
+    w, h = input_shape
+    img = resize_image(img, (w, h), keep_aspect_ratio=True)
+    resized_h, resized_w = img.shape[:2]
+    img = np.pad(img, ((0, h - resized_h), (0, w - resized_w), (0, 0)), mode='constant', constant_values=0)
+    img = img.transpose((2, 0, 1))
+    return img[None].astype(np.float32)
+
+
+def load_frames(video, count, image_shape):
+    """Reads frames from a local video, or creates a synthetic frame."""
+    if video is None:
+        rng = np.random.default_rng(0)
+        return [rng.integers(0, 256, (image_shape[1], image_shape[0], 3), dtype=np.uint8)]
+    cap = cv2.VideoCapture(video)
+    frames = []
+    while len(frames) < count:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def measure(func, frames, repeat):
+    """Returns the mean time in milliseconds and the peak bytes allocated per frame."""
+    func(frames[0])  # Allocate lazily created buffers outside the measurement
+
+    start = time.perf_counter()
+    for i in range(repeat):
+        func(frames[i % len(frames)])
+    elapsed_ms = (time.perf_counter() - start) * 1000 / repeat
+
+    tracemalloc.start()
+    peak = 0
+    for i in range(min(repeat, 20)):
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        result = func(frames[i % len(frames)])
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - baseline)
+        del result
+    tracemalloc.stop()
+    return elapsed_ms, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--video", help="Local video to read frames from")
+    parser.add_argument("--count", type=int, default=20, help="Number of frames to read from the video")
+    parser.add_argument("--image-shape", type=int, nargs=2, default=[1920, 1080])
+    parser.add_argument("--repeat", type=int, default=100)
+    args = parser.parse_args()
+
+    frames = load_frames(args.video, args.count, args.image_shape)
+    cases = [
+        ("YOLOv8OVMS", legacy_yolov8, [640, 640], dict(swap_rb=True, scale=1 / 255.0)),
+        ("WeldPorosity", legacy_welding, [224, 224], {}),
+        ("PoseEstimator", legacy_pose, [448, 448], dict(keep_aspect_ratio=True)),
+    ]
+
+    print(f"Frames: {len(frames)} x {frames[0].shape[1]}x{frames[0].shape[0]}")
+    for name, legacy, input_shape, options in cases:
+        preprocessor = TensorPreprocessor(input_shape, **options)
+        fused = lambda img, preprocessor=preprocessor: preprocessor(img)[0]
+        difference = max(float(np.abs(legacy(img, input_shape) - fused(img)).max()) for img in frames)
+
+        legacy_ms, legacy_bytes = measure(lambda img: legacy(img, input_shape), frames, args.repeat)
+        fused_ms, fused_bytes = measure(fused, frames, args.repeat)
+
+        print(f"{name} {input_shape[0]}x{input_shape[1]}")
+        print(f"  Legacy: {legacy_ms:8.3f} ms/frame {legacy_bytes / 1024:10.1f} KiB allocated/frame")
+        print(f"  Fused:  {fused_ms:8.3f} ms/frame {fused_bytes / 1024:10.1f} KiB allocated/frame")
+        print(f"  Max absolute difference: {difference:.6f}")
+
+
+if __name__ == "__main__":
+    main()
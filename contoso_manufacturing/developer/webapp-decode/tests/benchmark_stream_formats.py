@@ -0,0 +1,143 @@
+"""
+Benchmark of the output stream formats of the webapp-decode pipelines.
+
+Encodes the same frames in real time as the MJPEG stream (one cv2.imencode per
+frame, as DetectorPipeline does for /video_feed) and as the H.264 fragmented MP4
+stream (FMP4Encoder piping the frames into FFmpeg, as for
+/video_feed?format=fmp4), and reports per stream:
+  - the bitrate sent to every viewer
+  - the CPU used, in percent of one core, by the encode stage plus FFmpeg
+  - the mean time per frame spent in the encode stage
+When no video is given, a synthetic one is generated. FFmpeg must be installed,
+or given with --ffmpeg.
+
+Usage:
+    python benchmark_stream_formats.py
+    python benchmark_stream_formats.py --video ./videos/helmet.mp4 --fps 15 --duration 20 --bitrate 1M
+"""
+import argparse
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+import cv2
+from tabulate import tabulate
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+# pylint: disable=wrong-import-position
+from fmp4 import FMP4Encoder
+from benchmark_pipelines import generate_video
+
+
+def load_frames(video, count):
+    """Decodes up to count frames of a video into memory."""
+    cap = cv2.VideoCapture(video)
+    frames = []
+    while len(frames) < count:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def children_cpu():
+    """Returns the CPU seconds used by the terminated child processes, i.e. FFmpeg."""
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_stream(frames, fps, duration, encode):
+    """Feeds the frames in a loop at fps for duration seconds and returns the stage CPU and encode times."""
+    interval = 1.0 / fps
+    count = int(duration * fps)
+    cpu_start = time.thread_time()
+    encode_seconds = 0.0
+    next_time = time.perf_counter()
+    for i in range(count):
+        start = time.perf_counter()
+        encode(frames[i % len(frames)])
+        encode_seconds += time.perf_counter() - start
+        next_time += interval
+        time.sleep(max(0.0, next_time - time.perf_counter()))
+    return time.thread_time() - cpu_start, encode_seconds / count, count
+
+
+def benchmark_mjpeg(frames, fps, duration, quality):
+    """Encodes the frames as the MJPEG stream and returns the results."""
+    sent = [0]
+
+    def encode(frame):
+        ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        # Multipart boundary and headers added by gen_frames
+        sent[0] += len(buffer) + len(b'--frame\r\nContent-Type: image/jpeg\r\n\r\n\r\n')
+
+    cpu, encode_seconds, count = run_stream(frames, fps, duration, encode)
+    return {"format": "mjpeg", "bytes": sent[0], "cpu": cpu, "encode_ms": encode_seconds * 1000, "frames": count}
+
+
+def benchmark_fmp4(frames, fps, duration, bitrate, gop_seconds, ffmpeg):
+    """Encodes the frames as the fragmented MP4 stream and returns the results."""
+    encoder = FMP4Encoder(bitrate=bitrate, fps=fps, gop_seconds=gop_seconds, ffmpeg=ffmpeg)
+    # Stand-in for one viewer, so the bytes counted are the ones a client receives
+    received = [0]
+
+    def view():
+        for data in encoder.broadcaster.subscribe():
+            received[0] += len(data)
+
+    viewer = threading.Thread(target=view, daemon=True)
+    viewer.start()
+    while encoder.broadcaster.subscribers == 0:
+        time.sleep(0.01)
+    ffmpeg_start = children_cpu()
+    cpu, encode_seconds, count = run_stream(frames, fps, duration, encoder.encode)
+    encoder.stop()
+    ffmpeg_cpu = children_cpu() - ffmpeg_start
+    encoder.close()
+    viewer.join()
+    return {"format": "fmp4", "bytes": received[0], "cpu": cpu + ffmpeg_cpu, "encode_ms": encode_seconds * 1000, "frames": count}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--video", help="Local video to encode, a synthetic one is generated when omitted")
+    parser.add_argument("--fps", type=float, default=15.0, help="Frame rate of the annotated video")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to stream in each format")
+    parser.add_argument("--quality", type=int, default=95, help="JPEG quality, 95 is the OpenCV default used by the pipeline")
+    parser.add_argument("--bitrate", default="2M", help="fMP4 bitrate in FFmpeg notation")
+    parser.add_argument("--gop-seconds", type=float, default=2.0)
+    parser.add_argument("--ffmpeg", default=os.environ.get("FFMPEG_PATH", "ffmpeg"), help="FFmpeg executable")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        video = args.video
+        if video is None:
+            video = os.path.join(tmp, "synthetic.avi")
+            generate_video(video)
+        frames = load_frames(video, int(args.fps * args.duration))
+
+    results = [
+        benchmark_mjpeg(frames, args.fps, args.duration, args.quality),
+        benchmark_fmp4(frames, args.fps, args.duration, args.bitrate, args.gop_seconds, args.ffmpeg),
+    ]
+
+    rows = []
+    for result in results:
+        seconds = result["frames"] / args.fps
+        rows.append([result["format"], f"{result['bytes'] * 8 / seconds / 1e6:.2f}", f"{result['cpu'] / seconds:.0%}", f"{result['encode_ms']:.2f}"])
+    height, width = frames[0].shape[:2]
+    print(f"Frames: {width}x{height} at {args.fps:g} FPS for {args.duration:g} s")
+    print(tabulate(rows, headers=["Format", "Bitrate (Mbit/s)", "CPU (one core)", "Encode stage (ms/frame)"]))
+    mjpeg, fmp4 = results
+    if fmp4["bytes"]:
+        print(f"MJPEG uses {mjpeg['bytes'] / fmp4['bytes']:.1f}x the bandwidth of fMP4")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Benchmark of the region-of-interest and tiling modes of YOLOv8OVMS.
+
+Processes the same frames of a video with the whole frame resized to the model
+input and with every given tiling of the region of interest, and reports per
+mode:
+  - tiles per frame (the batch size of the predict call)
+  - mean preprocess, predict and postprocess time per frame
+  - detections per frame, and small detections (box height below
+    --small-fraction of the frame height), the ones tiling is meant to recover
+
+Detection counts are only meaningful with a real model: pass --ovms-url of an
+OVMS serving the model with a dynamic batch dimension. Without it, the
+in-process fake OVMS from fake_ovms.py serves synthetic outputs, which
+measures the cost of the tiles only.
+
+Usage:
+    python benchmark_tiling.py --video ./videos/helmet.mp4 --ovms-url localhost:9000 --tilings 2x2 3x2
+    python benchmark_tiling.py --roi "[[[0.2, 0.3], [0.8, 0.3], [0.8, 1.0], [0.2, 1.0]]]" --tilings 1x1 2x2 --overlap 0.2
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+from tabulate import tabulate
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+# pylint: disable=wrong-import-position
+from benchmark_pipelines import build_detector, generate_video
+from benchmark_pose_tracking import read_frames
+from fake_ovms import FakeOVMSServer, default_outputs
+from tiling import TileLayout
+
+
+def run(detector, frames, small_height):
+    """Processes the frames one by one and returns the mean stage times and detection counts."""
+    totals = {"tiles": 0, "preprocess": 0.0, "predict": 0.0, "postprocess": 0.0, "detections": 0, "small": 0}
+    for frame in frames:
+        start = time.perf_counter()
+        inputs, tiles = detector.preprocess(frame)
+        preprocessed = time.perf_counter()
+        outputs = detector.predict(inputs) if inputs is not None else {}
+        predicted = time.perf_counter()
+        boxes, _, _ = detector.decode(outputs, tiles)
+        detector.postprocess(frame, outputs, tiles)
+        done = time.perf_counter()
+
+        totals["tiles"] += 1 if tiles is None else len(tiles)
+        totals["preprocess"] += preprocessed - start
+        totals["predict"] += predicted - preprocessed
+        # decode() runs twice, once to count the detections and once in postprocess()
+        totals["postprocess"] += done - predicted
+        totals["detections"] += len(boxes)
+        totals["small"] += int((boxes[:, 3] < small_height).sum()) if len(boxes) else 0
+    return {key: value / len(frames) for key, value in totals.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--video", help="Local video to process, a synthetic one is generated when omitted")
+    parser.add_argument("--frames", type=int, default=50, help="Number of frames to process")
+    parser.add_argument("--model", default="safety-yolo8", choices=["safety-yolo8", "yolov8n"])
+    parser.add_argument("--tilings", nargs="+", default=["2x2", "3x2"], help="Tilings to compare, as <columns>x<rows>")
+    parser.add_argument("--overlap", type=float, default=0.2)
+    parser.add_argument("--full-frame", action="store_true", help="Add the whole region of interest as one more tile")
+    parser.add_argument("--roi", help="Region of interest, JSON list of polygons in normalized frame coordinates")
+    parser.add_argument("--small-fraction", type=float, default=0.05, help="Box height relative to the frame below which a detection is small")
+    parser.add_argument("--ovms-url", help="OVMS serving the model, the fake OVMS is used when omitted")
+    parser.add_argument("--latency-ms", type=float, default=10.0, help="Latency of every fake predict call")
+    parser.add_argument("--config", default=os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "config", "template_config_file.json"))
+    args = parser.parse_args()
+
+    with open(args.config) as config_file:
+        config = json.load(config_file)
+    roi = json.loads(args.roi) if args.roi else None
+
+    modes = [("whole frame", None)]
+    if roi is not None:
+        modes.append(("roi", TileLayout(roi=roi)))
+    for tiling in args.tilings:
+        columns, rows = (int(n) for n in tiling.lower().split("x"))
+        modes.append((f"{'roi ' if roi else ''}{columns}x{rows} tiles", TileLayout(roi=roi, rows=rows, columns=columns, overlap=args.overlap, full_frame=args.full_frame)))
+
+    with contextlib.ExitStack() as stack:
+        video = args.video
+        if video is None:
+            video = os.path.join(stack.enter_context(tempfile.TemporaryDirectory()), "synthetic.avi")
+            generate_video(video, frames=args.frames)
+        frames = read_frames(video, args.frames)
+
+        ovms_url = args.ovms_url
+        if ovms_url is None:
+            print("No OVMS given, the fake OVMS only measures the cost of the tiles, detection counts are meaningless")
+            ovms_url = stack.enter_context(FakeOVMSServer(default_outputs(config), args.latency_ms)).url
+
+        small_height = args.small_fraction * frames[0].shape[0]
+        rows = []
+        for name, tile_layout in modes:
+            detector = build_detector(args.model, config, video, ovms_url)
+            detector.tile_layout = tile_layout
+            result = run(detector, frames, small_height)
+            rows.append([name, f"{result['tiles']:.1f}", f"{result['preprocess'] * 1000:.1f}", f"{result['predict'] * 1000:.1f}",
+                         f"{result['postprocess'] * 1000:.1f}", f"{result['detections']:.1f}", f"{result['small']:.1f}"])
+
+    print(f"Frames: {len(frames)} of {args.video or 'a synthetic video'}, {frames[0].shape[1]}x{frames[0].shape[0]}")
+    print(tabulate(rows, headers=["Mode", "Tiles", "Preprocess (ms)", "Predict (ms)", "Postprocess (ms)", "Detections", "Small"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Micro-benchmark for the YOLOv8 output decoder.
+
+Compares the original per-anchor Python loop against the vectorized
+YOLOv8OVMS.decode() on recorded OVMS outputs. Outputs can be recorded from a
+live OVMS with --record, or loaded from a directory of .npy files captured
+earlier. When no recording is given a synthetic output tensor is used.
+
+Usage:
+    python benchmark_yolov8_postprocess.py --outputs ./recorded_outputs
+    python benchmark_yolov8_postprocess.py --record ./recorded_outputs --video ./videos/helmet.mp4 --ovms 192.168.0.4:31640
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+# pylint: disable=wrong-import-position
+from yolov8 import YOLOv8OVMS
+
+
+def legacy_decode(outputs, confidence_thres, iou_thres, x_factor, y_factor):
+    """The per-row decode loop that YOLOv8OVMS.postprocess used before vectorization."""
+    outputs = np.transpose(np.squeeze(outputs[0]))
+    rows = outputs.shape[0]
+    boxes = []
+    scores = []
+    class_ids = []
+    for i in range(rows):
+        classes_scores = outputs[i, 4:]
+        max_score = np.max(classes_scores)
+        if max_score >= confidence_thres:
+            class_id = np.argmax(classes_scores)
+            x, y, w, h = outputs[i, 0:4]
+            left = int((x - w / 2) * x_factor)
+            top = int((y - h / 2) * y_factor)
+            width = int(w * x_factor)
+            height = int(h * y_factor)
+            class_ids.append(class_id)
+            scores.append(max_score)
+            boxes.append([left, top, width, height])
+    indices = cv2.dnn.NMSBoxes(boxes, scores, confidence_thres, iou_thres)
+    if len(indices) > 0:
+        indices = indices.flatten()
+    return [boxes[i] for i in indices], [scores[i] for i in indices], [class_ids[i] for i in indices]
+
+
+def make_decoder(input_shape, img_shape, num_classes, confidence_thres, iou_thres):
+    """Builds a YOLOv8OVMS instance without opening a video source or gRPC channel."""
+    decoder = YOLOv8OVMS.__new__(YOLOv8OVMS)
+    decoder.input_width, decoder.input_height = input_shape
+    decoder.img_width, decoder.img_height = img_shape
+    decoder.class_names = [str(i) for i in range(num_classes)]
+    decoder.confidence_thres = confidence_thres
+    decoder.iou_thres = iou_thres
+    decoder.verbose = False
+    decoder.tile_layout = None
+    decoder.cap = cv2.VideoCapture()
+    return decoder
+
+
+def synthetic_output(num_classes, num_anchors, num_objects, input_shape, seed=0):
+    """Creates an output tensor shaped like YOLOv8 with a handful of confident anchors."""
+    rng = np.random.default_rng(seed)
+    output = np.zeros((1, 4 + num_classes, num_anchors), dtype=np.float32)
+    output[0, 0] = rng.uniform(0, input_shape[0], num_anchors)
+    output[0, 1] = rng.uniform(0, input_shape[1], num_anchors)
+    output[0, 2:4] = rng.uniform(10, 120, (2, num_anchors))
+    output[0, 4:] = rng.uniform(0, 0.3, (num_classes, num_anchors))
+    hits = rng.choice(num_anchors, num_objects * 5, replace=False)
+    output[0, 4 + rng.integers(0, num_classes, hits.size), hits] = rng.uniform(0.5, 1.0, hits.size)
+    return output
+
+
+def load_outputs(path):
+    """Loads recorded outputs from a .npy file or a directory of .npy files."""
+    files = sorted(glob.glob(os.path.join(path, "*.npy"))) if os.path.isdir(path) else [path]
+    return [np.load(f) for f in files]
+
+
+def record_outputs(path, video, ovms_url, model_name, input_shape, count):
+    """Runs frames from a local video through OVMS and stores the raw outputs as .npy files."""
+    from ovmsclient import make_grpc_client
+
+    os.makedirs(path, exist_ok=True)
+    client = make_grpc_client(ovms_url)
+    cap = cv2.VideoCapture(video)
+    for i in range(count):
+        ret, img = cap.read()
+        if not ret:
+            break
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        img = cv2.resize(img, tuple(input_shape))
+        image_data = np.expand_dims(np.transpose(img / 255.0, (2, 0, 1)), axis=0).astype(np.float32)
+        output = client.predict({"images": image_data}, model_name)
+        np.save(os.path.join(path, f"{model_name}_{i:05d}.npy"), output)
+    cap.release()
+    print(f"Recorded {i + 1} outputs to {path}")
+
+
+def time_it(func, outputs, repeat):
+    """Returns the mean time in milliseconds to decode every output once."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for output in outputs:
+            func(output)
+    return (time.perf_counter() - start) * 1000 / (repeat * len(outputs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--outputs", help="Recorded OVMS output (.npy file or directory of .npy files)")
+    parser.add_argument("--record", help="Directory to record OVMS outputs into before benchmarking")
+    parser.add_argument("--video", help="Local video used when recording")
+    parser.add_argument("--ovms", default="localhost:9000", help="OVMS gRPC address used when recording")
+    parser.add_argument("--model", default="safety-yolo8", help="Model name used when recording")
+    parser.add_argument("--count", type=int, default=50, help="Number of outputs to record")
+    parser.add_argument("--num-classes", type=int, default=3, help="Number of classes for the synthetic output")
+    parser.add_argument("--input-shape", type=int, nargs=2, default=[640, 640])
+    parser.add_argument("--image-shape", type=int, nargs=2, default=[1920, 1080])
+    parser.add_argument("--conf", type=float, default=0.5)
+    parser.add_argument("--iou", type=float, default=0.5)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.record:
+        record_outputs(args.record, args.video, args.ovms, args.model, args.input_shape, args.count)
+        args.outputs = args.record
+
+    if args.outputs:
+        outputs = load_outputs(args.outputs)
+    else:
+        outputs = [synthetic_output(args.num_classes, 8400, 10, args.input_shape, seed) for seed in range(10)]
+
+    num_classes = outputs[0].shape[1] - 4
+    decoder = make_decoder(args.input_shape, args.image_shape, num_classes, args.conf, args.iou)
+    x_factor = decoder.img_width / decoder.input_width
+    y_factor = decoder.img_height / decoder.input_height
+
+    # Sanity check: every box kept by the class-agnostic loop must also be kept by the class-aware decode
+    missing = 0
+    for output in outputs:
+        legacy_boxes, _, _ = legacy_decode(output, args.conf, args.iou, x_factor, y_factor)
+        boxes, _, _ = decoder.decode(output)
+        vectorized = {tuple(b) for b in boxes.tolist()}
+        missing += sum(1 for b in legacy_boxes if tuple(b) not in vectorized)
+
+    legacy_ms = time_it(lambda o: legacy_decode(o, args.conf, args.iou, x_factor, y_factor), outputs, args.repeat)
+    vectorized_ms = time_it(decoder.decode, outputs, args.repeat)
+
+    print(f"Outputs:           {len(outputs)} x {tuple(outputs[0].shape)}")
+    print(f"Legacy loop:       {legacy_ms:8.3f} ms/frame")
+    print(f"Vectorized decode: {vectorized_ms:8.3f} ms/frame")
+    print(f"Speedup:           {legacy_ms / vectorized_ms:8.1f}x")
+    print(f"Legacy boxes missing from vectorized result: {missing}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+In-process stand-in for the OpenVINO Model Server gRPC API.
+
+Serves the TensorFlow Serving Predict call that ovmsclient uses, so the
+detectors can run against it unchanged with make_grpc_client("localhost:<port>").
+Every model returns recorded output tensors in rotation after a configurable
+latency. Recordings are read from <outputs>/<model_name>/*.npy (single output,
+stored under the output name "output0") or *.npz (one array per output name);
+models without a recording get synthetic outputs shaped like the real models.
+
+Usage as a standalone server:
+    python fake_ovms.py --port 9000 --latency-ms 20 --outputs ./recorded_outputs
+"""
+import argparse
+import glob
+import itertools
+import json
+import os
+import threading
+import time
+from concurrent import futures
+
+import grpc
+import numpy as np
+from ovmsclient.tfs_compat.grpc.tensors import make_tensor_proto
+from ovmsclient.tfs_compat.protos.tensorflow_serving.apis import predict_pb2, prediction_service_pb2_grpc
+
+
+def synthetic_yolov8(num_classes, input_shape=(640, 640), num_anchors=8400, num_objects=10, seed=0):
+    """Creates a YOLOv8 output tensor with a handful of confident anchors."""
+    rng = np.random.default_rng(seed)
+    output = np.zeros((1, 4 + num_classes, num_anchors), dtype=np.float32)
+    output[0, 0] = rng.uniform(0, input_shape[0], num_anchors)
+    output[0, 1] = rng.uniform(0, input_shape[1], num_anchors)
+    output[0, 2:4] = rng.uniform(10, 120, (2, num_anchors))
+    output[0, 4:] = rng.uniform(0, 0.3, (num_classes, num_anchors))
+    hits = rng.choice(num_anchors, num_objects * 5, replace=False)
+    output[0, 4 + rng.integers(0, num_classes, hits.size), hits] = rng.uniform(0.5, 1.0, hits.size)
+    return {"output0": output}
+
+
+def synthetic_pose(num_joints=17, size=224, num_people=3, sigma=0.0, seed=0):
+    """
+    Creates human-pose-estimation-0007 heatmaps and embeddings with a few people.
+
+    Joints are single-pixel peaks, or Gaussian blobs with the standard deviation sigma in
+    pixels, like the heatmaps of the real model, when sigma is above 0.
+    """
+    rng = np.random.default_rng(seed)
+    heatmaps = rng.uniform(0, 0.05, (1, num_joints, size, size)).astype(np.float32)
+    embeddings = rng.normal(0, 0.1, (1, num_joints, size, size, 1)).astype(np.float32)
+    radius = int(np.ceil(3 * sigma))
+    for person in range(num_people):
+        center = rng.uniform(40, size - 40, 2)
+        for joint in range(num_joints):
+            x, y = (center + rng.normal(0, 15, 2)).astype(int)
+            value = rng.uniform(0.5, 1.0)
+            if radius == 0:
+                heatmaps[0, joint, y, x] = value
+                embeddings[0, joint, y, x, 0] = person
+                continue
+            top, left = max(y - radius, 0), max(x - radius, 0)
+            yy, xx = np.mgrid[top:min(y + radius + 1, size), left:min(x + radius + 1, size)]
+            blob = value * np.exp(-((xx - x) ** 2 + (yy - y) ** 2) / (2 * sigma ** 2))
+            window = heatmaps[0, joint, top:top + blob.shape[0], left:left + blob.shape[1]]
+            np.maximum(window, blob, out=window)
+            embeddings[0, joint, top:top + blob.shape[0], left:left + blob.shape[1], 0] = person
+    return {"heatmaps": heatmaps, "2674": embeddings}
+
+
+def synthetic_classifier(num_classes, seed=0):
+    """Creates classification logits."""
+    rng = np.random.default_rng(seed)
+    return {"output0": rng.normal(0, 1, (1, num_classes)).astype(np.float32)}
+
+
+def load_outputs(path):
+    """Loads the recorded outputs of a model from a directory of .npy / .npz files."""
+    outputs = []
+    for file in sorted(glob.glob(os.path.join(path, "*.np[yz]"))):
+        if file.endswith(".npz"):
+            with np.load(file) as arrays:
+                outputs.append({name: arrays[name] for name in arrays.files})
+        else:
+            outputs.append({"output0": np.load(file)})
+    return outputs
+
+
+class FakePredictionService(prediction_service_pb2_grpc.PredictionServiceServicer):
+    """Answers Predict calls with recorded outputs after a fixed latency."""
+
+    def __init__(self, outputs, latency_ms=0.0, jitter_ms=0.0):
+        self.outputs = {name: itertools.cycle(model_outputs) for name, model_outputs in outputs.items()}
+        self.latency = latency_ms / 1000.0
+        self.jitter = jitter_ms / 1000.0
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def Predict(self, request, context):
+        model_name = request.model_spec.name
+        if model_name not in self.outputs:
+            context.abort(grpc.StatusCode.NOT_FOUND, f"Model with requested name is not found: {model_name}")
+
+        # Scale the recorded batch of one to the batch size of the request
+        batch_size = max(tensor.tensor_shape.dim[0].size for tensor in request.inputs.values())
+        with self.lock:
+            self.requests += 1
+            outputs = next(self.outputs[model_name])
+
+        delay = self.latency + (np.random.uniform(-self.jitter, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+
+        response = predict_pb2.PredictResponse()
+        response.model_spec.name = model_name
+        for name, output in outputs.items():
+            if batch_size > 1:
+                output = np.repeat(output, batch_size, axis=0)
+            response.outputs[name].CopyFrom(make_tensor_proto(output))
+        return response
+
+
+class FakeOVMSServer:
+    """
+    Runs a FakePredictionService on a local port.
+
+    Use as a context manager; the url attribute is passed to make_grpc_client().
+    """
+
+    def __init__(self, outputs, latency_ms=0.0, jitter_ms=0.0, port=0, max_workers=16):
+        """
+        Args:
+            outputs (dict): The list of output dicts to return, keyed by model name.
+            latency_ms (float): Time each Predict call takes.
+            jitter_ms (float): Maximum random deviation from latency_ms.
+            port (int): The port to listen on, 0 for any free port.
+            max_workers (int): Number of Predict calls served concurrently.
+        """
+        self.service = FakePredictionService(outputs, latency_ms, jitter_ms)
+        self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers), options=[
+            ("grpc.max_send_message_length", 256 * 1024 * 1024),
+            ("grpc.max_receive_message_length", 256 * 1024 * 1024),
+        ])
+        prediction_service_pb2_grpc.add_PredictionServiceServicer_to_server(self.service, self.server)
+        self.port = self.server.add_insecure_port(f"localhost:{port}")
+        self.url = f"localhost:{self.port}"
+
+    def start(self):
+        self.server.start()
+        return self
+
+    def stop(self):
+        self.server.stop(grace=None)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def default_outputs(config, outputs_dir=None):
+    """
+    Returns the outputs served for every model of a webapp-decode configuration.
+
+    Args:
+        config (dict): The model configuration, as in config/template_config_file.json.
+        outputs_dir (str): Directory with one sub-directory of recorded outputs per model.
+
+    Returns:
+        dict: The list of output dicts keyed by model name.
+    """
+    outputs = {}
+    for model_name, model_config in config.items():
+        recorded = load_outputs(os.path.join(outputs_dir, model_name)) if outputs_dir else []
+        if recorded:
+            outputs[model_name] = recorded
+        elif "yolo" in model_name:
+            outputs[model_name] = [synthetic_yolov8(len(model_config["class_names"]), model_config["input_shape"], seed=seed) for seed in range(10)]
+        elif "pose" in model_name:
+            size = model_config["input_shape"][0] // 2
+            outputs[model_name] = [synthetic_pose(size=size, seed=seed) for seed in range(10)]
+        elif "class_names" in model_config:
+            outputs[model_name] = [synthetic_classifier(len(model_config["class_names"]), seed) for seed in range(10)]
+    return outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--outputs", help="Directory with one sub-directory of recorded outputs per model")
+    parser.add_argument("--config", default=os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "config", "template_config_file.json"))
+    args = parser.parse_args()
+
+    with open(args.config) as config_file:
+        config = json.load(config_file)
+    with FakeOVMSServer(default_outputs(config, args.outputs), args.latency_ms, args.jitter_ms, args.port) as server:
+        print(f"Fake OVMS serving {', '.join(server.service.outputs)} on {server.url}")
+        server.server.wait_for_termination()
+
+
+if __name__ == "__main__":
+    main()
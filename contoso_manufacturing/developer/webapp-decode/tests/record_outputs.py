@@ -0,0 +1,67 @@
+"""
+Records the outputs of a model for the frames of a video.
+
+Runs the frames through the preprocess() of the detector of the model and its
+OVMS model, and writes every output to <out>/<model_name>/<frame>.npz (one
+array per output name) or .npy (single output). The recordings are replayed by
+fake_ovms.py and used by benchmark_pipelines.py and benchmark_pose_decoder.py
+with --outputs, so these benchmarks run on real model outputs without OVMS.
+
+Usage:
+    python record_outputs.py --video ./videos/people.mp4 --model human-pose-estimation --ovms-url localhost:9000
+    python record_outputs.py --video ./videos/helmet.mp4 --model safety-yolo8 --frames 100 --every 5 --out ./recorded_outputs
+"""
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+# pylint: disable=wrong-import-position
+from benchmark_pipelines import DETECTORS, build_detector
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--video", required=True, help="Local video or RTSP URL to read the frames from")
+    parser.add_argument("--model", required=True, choices=DETECTORS)
+    parser.add_argument("--ovms-url", default="localhost:9000")
+    parser.add_argument("--config", default=os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "config", "template_config_file.json"))
+    parser.add_argument("--frames", type=int, default=50, help="Number of frames to record")
+    parser.add_argument("--every", type=int, default=1, help="Record every n-th frame of the video")
+    parser.add_argument("--out", default="recorded_outputs")
+    args = parser.parse_args()
+
+    with open(args.config) as config_file:
+        config = json.load(config_file)
+
+    detector = build_detector(args.model, config, args.video, args.ovms_url)
+    out_dir = os.path.join(args.out, args.model)
+    os.makedirs(out_dir, exist_ok=True)
+
+    recorded = 0
+    frame_number = 0
+    while recorded < args.frames:
+        ret, frame = detector.cap.read()
+        if not ret:
+            break
+        frame_number += 1
+        if frame_number % args.every:
+            continue
+        inputs, _ = detector.preprocess(frame)
+        outputs = detector.predict(inputs)
+        path = os.path.join(out_dir, f"{recorded:05d}")
+        if isinstance(outputs, dict):
+            np.savez(path + ".npz", **outputs)
+        else:
+            np.save(path + ".npy", outputs)
+        recorded += 1
+
+    print(f"Recorded {recorded} outputs of {args.model} to {out_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import os
+import shutil
+import sys
+import threading
+import time
+
+import numpy as np
+import pytest
+
+
+this_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(this_dir, ".."))
+
+
+# pylint: disable=wrong-import-position
+from fmp4 import FMP4Encoder, FragmentBroadcaster
+
+FFMPEG = os.environ.get("FFMPEG_PATH", "ffmpeg")
+
+
+def read_in_thread(stream, count):
+    """Reads up to count items of a stream on a thread and returns the thread and the items list."""
+    items = []
+
+    def read():
+        for item in stream:
+            items.append(item)
+            if len(items) == count:
+                return
+
+    thread = threading.Thread(target=read, daemon=True)
+    thread.start()
+    return thread, items
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_subscriber_after_end_stream_waits_for_next_stream():
+    broadcaster = FragmentBroadcaster()
+    broadcaster.start_stream(b"init-1")
+    broadcaster.publish(b"fragment-1", keyframe=True)
+    broadcaster.end_stream()
+
+    thread, items = read_in_thread(broadcaster.subscribe(timeout=0.05), 2)
+    assert wait_for(lambda: broadcaster.subscribers == 1)
+    time.sleep(0.1)
+    assert items == []
+
+    broadcaster.start_stream(b"init-2")
+    broadcaster.publish(b"fragment-2", keyframe=True)
+    thread.join(timeout=5)
+    assert items == [b"init-2", b"fragment-2"]
+    broadcaster.close()
+
+
+@pytest.mark.skipif(shutil.which(FFMPEG) is None, reason="FFmpeg is not installed")
+def test_viewer_after_stop_start_cycle_gets_live_stream():
+    encoder = FMP4Encoder(fps=15, gop_seconds=0.2, ffmpeg=FFMPEG)
+    frame = np.zeros((64, 96, 3), np.uint8)
+
+    thread, first_items = read_in_thread(encoder.broadcaster.subscribe(timeout=0.05), 2)
+    assert wait_for(lambda: encoder.broadcaster.subscribers == 1)
+    assert wait_for(lambda: encoder.encode(frame) or len(first_items) == 2)
+    thread.join(timeout=5)
+    assert first_items[0][4:8] == b"ftyp"
+
+    # The last viewer left, the pipeline stops FFmpeg until the next one subscribes
+    encoder.stop()
+    thread, items = read_in_thread(encoder.broadcaster.subscribe(timeout=0.05), 3)
+    assert wait_for(lambda: encoder.broadcaster.subscribers == 1)
+    assert wait_for(lambda: encoder.encode(frame) or len(items) == 3)
+    thread.join(timeout=5)
+
+    # The new viewer starts with the initialization segment of the new FFmpeg process and keeps receiving fragments
+    assert encoder.restarts == 2
+    assert len(items) == 3
+    assert items[0][4:8] == b"ftyp"
+    assert all(item[4:8] == b"moof" for item in items[1:])
+    encoder.close()
+
+
+@pytest.mark.skipif(shutil.which(FFMPEG) is None, reason="FFmpeg is not installed")
+def test_stop_and_close_while_encoding_leave_no_ffmpeg_running():
+    encoder = FMP4Encoder(fps=30, ffmpeg=FFMPEG)
+    frame = np.zeros((64, 96, 3), np.uint8)
+    processes = []
+    done = threading.Event()
+
+    def encode():
+        while not done.is_set():
+            encoder.encode(frame)
+            if encoder.process is not None and encoder.process not in processes:
+                processes.append(encoder.process)
+
+    thread = threading.Thread(target=encode, daemon=True)
+    thread.start()
+    for _ in range(5):
+        time.sleep(0.05)
+        encoder.stop()
+    encoder.close()
+    done.set()
+    thread.join(timeout=5)
+
+    assert not thread.is_alive()
+    assert encoder.process is None
+    assert all(process.poll() is not None for process in processes)
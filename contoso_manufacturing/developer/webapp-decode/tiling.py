@@ -0,0 +1,133 @@
+import threading
+import cv2
+import numpy as np
+
+class TileLayout:
+    """
+    Splits the region of interest of a camera into the tiles a detector sends to the model.
+
+    The region of interest is a list of polygons in normalized [0, 1] frame coordinates, so it
+    holds for any capture resolution. Pixels outside of it are blacked out before inference and
+    detections whose center lies outside of it are dropped. Its bounding rectangle is divided
+    into rows x columns tiles overlapping by the given fraction of a tile, each resized to the
+    full model input, so small objects keep more pixels than in the downscaled whole frame.
+    Tiles without any pixel of the region of interest are skipped. With full_frame, the whole
+    bounding rectangle is added as one more tile, to find the objects larger than a tile.
+
+    The layout is computed once per frame size.
+    """
+
+    def __init__(self, roi=None, rows=1, columns=1, overlap=0.0, full_frame=False):
+        """
+        Args:
+            roi (list): Polygons, each a list of [x, y] points in normalized frame coordinates, or None for the whole frame.
+            rows (int): Number of tile rows.
+            columns (int): Number of tile columns.
+            overlap (float): Fraction of a tile shared with the next tile, between 0 and 1.
+            full_frame (bool): Whether to also infer the whole region of interest as one tile.
+        """
+        self.roi = [np.asarray(polygon, dtype=np.float64).reshape(-1, 2) for polygon in roi] if roi else None
+        self.rows = max(1, int(rows))
+        self.columns = max(1, int(columns))
+        self.overlap = min(max(float(overlap), 0.0), 0.9)
+        self.full_frame = full_frame
+        self.lock = threading.Lock()
+        self.frame_size = None
+        self.mask = None
+        self.tiles = []
+        self.tile_masks = []
+
+    def _update(self, width, height):
+        mask = None
+        rect = (0, 0, width, height)
+        if self.roi is not None:
+            mask = np.zeros((height, width), np.uint8)
+            polygons = [np.round(polygon * (width, height)).astype(np.int32) for polygon in self.roi]
+            cv2.fillPoly(mask, polygons, 255)
+            points = cv2.findNonZero(mask)
+            rect = cv2.boundingRect(points) if points is not None else (0, 0, 0, 0)
+
+        tiles = []
+        rx, ry, rw, rh = rect
+        if rw > 0 and rh > 0:
+            # Tile size such that the tiles overlapping by self.overlap exactly cover the rectangle
+            tile_w = rw / (self.columns - (self.columns - 1) * self.overlap)
+            tile_h = rh / (self.rows - (self.rows - 1) * self.overlap)
+            for row in range(self.rows):
+                for column in range(self.columns):
+                    x0 = rx + int(round(column * tile_w * (1 - self.overlap)))
+                    y0 = ry + int(round(row * tile_h * (1 - self.overlap)))
+                    x1 = min(rx + rw, int(round(x0 + tile_w)))
+                    y1 = min(ry + rh, int(round(y0 + tile_h)))
+                    tiles.append((x0, y0, x1 - x0, y1 - y0))
+            if self.full_frame and len(tiles) > 1:
+                tiles.append(rect)
+
+        tile_masks = []
+        kept = []
+        for x, y, w, h in tiles:
+            tile_mask = None if mask is None else mask[y:y + h, x:x + w]
+            if tile_mask is not None:
+                covered = cv2.countNonZero(tile_mask)
+                if covered == 0:
+                    # Entirely outside the region of interest
+                    continue
+                if covered == tile_mask.size:
+                    tile_mask = None
+            kept.append((x, y, w, h))
+            tile_masks.append(tile_mask)
+
+        self.frame_size = (width, height)
+        self.mask = mask
+        self.tiles = kept
+        self.tile_masks = tile_masks
+
+    def split(self, img):
+        """
+        Cuts a frame into its tiles, with the pixels outside the region of interest blacked out.
+
+        Args:
+            img (np.ndarray): The frame.
+
+        Returns:
+            tuple: The tile images and their (x, y, width, height) rectangles in the frame.
+        """
+        height, width = img.shape[:2]
+        with self.lock:
+            if self.frame_size != (width, height):
+                self._update(width, height)
+            tiles, tile_masks = self.tiles, self.tile_masks
+
+        images = []
+        for (x, y, w, h), tile_mask in zip(tiles, tile_masks):
+            tile = img[y:y + h, x:x + w]
+            images.append(tile if tile_mask is None else cv2.bitwise_and(tile, tile, mask=tile_mask))
+        return images, tiles
+
+    def contains(self, points):
+        """
+        Tells which points lie inside the region of interest of the last split frame.
+
+        Args:
+            points (np.ndarray): The (N, 2) x, y points in frame coordinates.
+
+        Returns:
+            np.ndarray: The (N,) bool array, True for the points inside.
+        """
+        mask = self.mask
+        if mask is None:
+            return np.ones(len(points), dtype=bool)
+        x = np.clip(points[:, 0].astype(np.int64), 0, mask.shape[1] - 1)
+        y = np.clip(points[:, 1].astype(np.int64), 0, mask.shape[0] - 1)
+        return mask[y, x] > 0
+
+    def polygons(self):
+        """
+        Returns the region of interest of the last split frame in pixels, for drawing it.
+
+        Returns:
+            list: The (N, 1, 2) int32 polygons, empty without a region of interest.
+        """
+        if self.roi is None or self.frame_size is None:
+            return []
+        return [np.round(polygon * self.frame_size).astype(np.int32).reshape(-1, 1, 2) for polygon in self.roi]
@@ -1,14 +1,14 @@
 import cv2
 import numpy as np
-import json
+import threading
 import time
-from ovmsclient import make_grpc_client
-from tabulate import tabulate
-import os
-import datetime
+from detector import Detector
+from backends import OVMSBackend
+from preprocessing import TensorPreprocessor
+from overlay import OverlayRenderer
 
-class YOLOv8OVMS:
-    def __init__(self, rtsp_url, class_names, input_shape, color_palette, confidence_thres, iou_thres, model_name, ovms_url, save_img_loc, skip_rate, verbose=False):
+class YOLOv8OVMS(Detector):
+    def __init__(self, rtsp_url, class_names, input_shape, color_palette, confidence_thres, iou_thres, model_name, ovms_url, save_img_loc, skip_rate, verbose=False, batch_scheduler=None, capture_options=None, backend=None, tile_layout=None):
         print(f"Initializing YOLOv8OVMS with RTSP URL: {rtsp_url}")
         self.rtsp_url = rtsp_url
         self.class_names = class_names
@@ -22,119 +22,190 @@ class YOLOv8OVMS:
         self.verbose=verbose
         self.frame_number =0
         self.skip_rate=skip_rate
+        self.batch_scheduler=batch_scheduler  # Shared BatchScheduler when several cameras use the same model
+        self.preprocessor = TensorPreprocessor(input_shape, swap_rb=True, scale=1 / 255.0)
+        self.capture_options = capture_options
+        self.tile_layout = tile_layout  # TileLayout of the region of interest, None to infer the whole frame at once
+        self.tile_count = 1
+        self.overlay = OverlayRenderer()
 
         # Track frames and inference processing time for displaying FPS performance metrics 
+        # The inference time is the wall-clock time with at least one predict call running, as
+        # several calls overlap when the pipeline keeps more than one in flight
         self.total_inference_time = 0.0
+        self.inference_lock = threading.Lock()
+        self.inference_running = 0
+        self.inference_busy_since = 0.0
         self.inference_fps = 0.0
         self.total_fps = 0.0
         self.total_frames = 0
         self.start_time = time.time()
 
-        self.cap = cv2.VideoCapture(rtsp_url)
-        self.grpc_client = make_grpc_client(ovms_url)
-        
-        if not self.cap.isOpened():
-            print("Error: Unable to open video source.")
-        else:
-            # Lee un frame para determinar el tamaño de los frames del video
-            ret, frame = self.cap.read()
-            if ret:
-                self.img_height, self.img_width = frame.shape[:2]
-                print(f"Image dimensions: {self.img_width}x{self.img_height}")
-            else:
-                print("Failed to grab frame to set image dimensions")
-  
-    def preprocess(self):
+        self.backend = backend if backend is not None else OVMSBackend(ovms_url, model_name)
+        self.open_source(rtsp_url)
+
+    def preprocess(self, img):
         self.log("Preprocessing the frame...")
 
-        ret, img = self.cap.read()
-        if not ret:
-            print("Failed to grab frame")
-            return None
         self.img_height, self.img_width = img.shape[:2]  # Actualiza las dimensiones basadas en el frame actual
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        img = cv2.resize(img, (self.input_width, self.input_height))
-        image_data = np.array(img) / 255.0
-        image_data = np.transpose(image_data, (2, 0, 1))
-        image_data = np.expand_dims(image_data, axis=0).astype(np.float32)
-        return image_data
-
-    def postprocess(self, input_image, output):
+        if self.tile_layout is None:
+            # Resize, BGR -> RGB, scale to [0, 1] and HWC -> NCHW into a reused float32 tensor
+            image_data, _ = self.preprocessor(img)
+            return {"images": image_data}, None
+
+        # The tiles of the region of interest are sent as one batched request
+        images, tiles = self.tile_layout.split(img)
+        if not tiles:
+            # Empty region of interest, nothing to infer
+            return None, tiles
+        image_data, _ = self.preprocessor.batch(images)
+        return {"images": image_data}, tiles
+
+    def predict(self, inputs):
+        # Perform inference on the preprocessed image; capture the start and end times
+        with self.inference_lock:
+            if self.inference_running == 0:
+                self.inference_busy_since = time.time()
+            self.inference_running += 1
+        try:
+            if self.batch_scheduler is not None:
+                return self.batch_scheduler.predict(inputs)
+            return super().predict(inputs)
+        finally:
+            with self.inference_lock:
+                self.inference_running -= 1
+                if self.inference_running == 0:
+                    self.total_inference_time += time.time() - self.inference_busy_since
+
+    def decode(self, output, tiles=None):
+        """
+        Decodes the raw YOLOv8 output tensor into detections using batched NumPy operations.
+
+        Args:
+            output (np.ndarray): The model output with shape (tiles, 4 + num_classes, num_anchors).
+            tiles (list): The (x, y, width, height) frame rectangle of every image of the batch, or
+                None for a single image of the whole frame.
+
+        Returns:
+            tuple: Arrays of boxes (N x 4, int32 left/top/width/height in frame coordinates),
+                scores (N, float32) and class IDs (N, int32) that survived class-aware NMS.
+        """
+        if tiles is None:
+            tiles = [(0, 0, self.img_width, self.img_height)]
+
+        tile_boxes, tile_scores, tile_class_ids, tile_ids = [], [], [], []
+        for i, (tile_x, tile_y, tile_w, tile_h) in enumerate(tiles):
+            # Work on the (4 + num_classes, num_anchors) layout so reductions run over contiguous rows
+            predictions = np.squeeze(output[i])
+
+            # Keep only the anchors whose best class score is above the confidence threshold
+            class_scores = predictions[4:]
+            max_scores = class_scores.max(axis=0)
+            candidates = np.flatnonzero(max_scores >= self.confidence_thres)
+
+            tile_scores.append(max_scores[candidates].astype(np.float32))
+            tile_class_ids.append(class_scores[:, candidates].argmax(axis=0).astype(np.int32))
+
+            # Rescale the center/size boxes to left/top/width/height in frame coordinates
+            x_factor = tile_w / self.input_width
+            y_factor = tile_h / self.input_height
+            x, y, w, h = predictions[:4, candidates]
+            boxes = np.empty((candidates.size, 4), dtype=np.int32)
+            boxes[:, 0] = (x - w / 2) * x_factor + tile_x
+            boxes[:, 1] = (y - h / 2) * y_factor + tile_y
+            boxes[:, 2] = w * x_factor
+            boxes[:, 3] = h * y_factor
+            tile_boxes.append(boxes)
+            tile_ids.append(np.full(candidates.size, i, dtype=np.int32))
+
+        if len(tiles) == 1:
+            boxes, scores, class_ids = tile_boxes[0], tile_scores[0], tile_class_ids[0]
+        elif tiles:
+            boxes, scores, class_ids = np.concatenate(tile_boxes), np.concatenate(tile_scores), np.concatenate(tile_class_ids)
+        else:
+            boxes, scores, class_ids = np.empty((0, 4), np.int32), np.empty(0, np.float32), np.empty(0, np.int32)
+
+        # Apply class-aware non-maximum suppression so overlapping boxes of different classes are kept;
+        # across tiles it also merges the boxes of an object seen by two overlapping tiles
+        indices = cv2.dnn.NMSBoxesBatched(boxes, scores, class_ids, self.confidence_thres, self.iou_thres)
+        indices = np.asarray(indices, dtype=np.int32).flatten()
+
+        if len(tiles) > 1 and indices.size > 1:
+            indices = indices[self.suppress_cut_boxes(boxes[indices], scores[indices], class_ids[indices], np.concatenate(tile_ids)[indices])]
+        if self.tile_layout is not None and indices.size:
+            # Drop the detections centered outside the region of interest
+            selected = boxes[indices]
+            indices = indices[self.tile_layout.contains(selected[:, :2] + selected[:, 2:] / 2)]
+
+        return boxes[indices], scores[indices], class_ids[indices]
+
+    def suppress_cut_boxes(self, boxes, scores, class_ids, tile_ids, max_overlap=0.7):
+        """
+        Removes the boxes of objects cut by a tile border that another tile found whole.
+
+        The box of the cut part lies mostly inside the box of the whole object, but is too small
+        for their IoU to reach the NMS threshold, so the intersection is compared with the area
+        of the smaller box instead, between boxes of the same class from different tiles.
+
+        Args:
+            boxes (np.ndarray): The (N, 4) left/top/width/height boxes left by NMS.
+            scores (np.ndarray): The (N,) scores.
+            class_ids (np.ndarray): The (N,) class IDs.
+            tile_ids (np.ndarray): The (N,) index of the tile of every box.
+            max_overlap (float): Intersection over the smaller area above which the lower scored box is removed.
+
+        Returns:
+            np.ndarray: The indices of the boxes kept.
+        """
+        x0, y0 = boxes[:, 0], boxes[:, 1]
+        x1, y1 = x0 + boxes[:, 2], y0 + boxes[:, 3]
+        width = np.clip(np.minimum(x1[:, None], x1[None]) - np.maximum(x0[:, None], x0[None]), 0, None)
+        height = np.clip(np.minimum(y1[:, None], y1[None]) - np.maximum(y0[:, None], y0[None]), 0, None)
+        areas = np.maximum(boxes[:, 2] * boxes[:, 3], 1)
+        overlap = (width * height) / np.minimum(areas[:, None], areas[None])
+        candidates = (overlap > max_overlap) & (class_ids[:, None] == class_ids[None]) & (tile_ids[:, None] != tile_ids[None])
+
+        keep = np.ones(len(boxes), dtype=bool)
+        for i in np.argsort(-scores, kind="stable"):
+            if keep[i]:
+                suppressed = candidates[i] & keep
+                suppressed[i] = False
+                keep[suppressed] = False
+        return np.flatnonzero(keep)
+
+    def postprocess(self, input_image, output, meta=None):
         self.log("Postprocessing the output...")
 
-        # Transpose and squeeze the output to match the expected shape
-        outputs = np.transpose(np.squeeze(output[0]))
-
-        # Get the number of rows in the outputs array
-        rows = outputs.shape[0]
-
-        # Lists to store the bounding boxes, scores, and class IDs of the detections
-        boxes = []
-        scores = []
-        class_ids = []
-
-        # Calculate the scaling factors for the bounding box coordinates
-        x_factor = self.img_width / self.input_width
-        y_factor = self.img_height / self.input_height
-
-        # Iterate over each row in the outputs array
-        for i in range(rows):
-            # Extract the class scores from the current row
-            classes_scores = outputs[i, 4:]
-
-            # Find the maximum score among the class scores
-            max_score = np.max(classes_scores)
-
-            # If the maximum score is above the confidence threshold
-            if max_score >= self.confidence_thres:
-                # Get the class ID with the highest score
-                class_id = np.argmax(classes_scores)
-
-                # Extract the bounding box coordinates from the current row
-                x, y, w, h = outputs[i, 0:4]
-
-                # Calculate the scaled coordinates of the bounding box
-                left = int((x - w / 2) * x_factor)
-                top = int((y - h / 2) * y_factor)
-                width = int(w * x_factor)
-                height = int(h * y_factor)
-
-                # Add the class ID, score, and box coordinates to the respective lists
-                class_ids.append(class_id)
-                scores.append(max_score)
-                boxes.append([left, top, width, height])
+        # Update metrics used for FPS calculations
+        self.total_frames += 1
 
-        # Apply non-maximum suppression to filter out overlapping bounding boxes
-        indices = cv2.dnn.NMSBoxes(boxes, scores, self.confidence_thres, self.iou_thres)
+        # Calculate FPS for both the inferencing step and the final feed
+        self.inference_fps = self.total_frames / self.total_inference_time if self.total_inference_time else 0.0
+        self.total_fps = self.total_frames / (time.time() - self.start_time)    # This includes e.g. JPEG encoding in the encode stage outside of self.run()
+        self.log(f"FPS={self.total_fps} Inference={self.inference_fps:.03f} ({self.total_frames} frames)")
 
-        # Check if indices are returned as a numpy array and access them correctly
-        if len(indices) > 0:
-            indices = indices.flatten()  # This ensures indices are flattened properly
-        elif(self.verbose):
+        self.tile_count = 1 if meta is None else len(meta)
+        boxes, scores, class_ids = self.decode(output, meta)
+        if len(boxes) == 0 and self.verbose:
             print("No boxes to display after NMS.")
+        self.record_detections(boxes=boxes.tolist(), classes=[self.class_names[class_id] for class_id in class_ids],
+                               scores=np.round(scores, 3).tolist())
+        if not self.should_draw():
+            return input_image
 
-        # Prepare data for tabulate
-        table_data = []
-
-        # Iterate over the selected indices after non-maximum suppression
-        for i in indices:
-            # Get the box, score, and class ID corresponding to the index
-            
-            box = boxes[i]
-            score = scores[i]
-            class_id = class_ids[i]
+        with self.timed("draw"):
+            if self.tile_layout is not None:
+                # Outline the region of interest
+                cv2.polylines(input_image, self.tile_layout.polygons(), True, (0, 255, 255), 2)
 
-            # Draw the detection on the input image
-            self.draw_detections(input_image, box, score, class_id)
-            table_data.append([i, box, score, self.class_names[class_id]])
+            # Iterate over the detections that survived non-maximum suppression
+            for box, score, class_id in zip(boxes, scores, class_ids):
+                # Draw the detection on the input image
+                self.draw_detections(input_image, box, score, class_id)
 
-        # Draw the FPS counter on the image
-        self.draw_fps(input_image)
+            # Draw the FPS counter on the image
+            self.draw_fps(input_image)
 
-        # Print the table
-        # headers = ["Index", "Box", "Score", "Class"]
-        #self.log(str(tabulate(table_data, headers=headers, tablefmt="grid")))
-        
         # Return the modified input image
         return input_image
 
@@ -151,35 +222,30 @@ class YOLOv8OVMS:
         # Create the label text with class name and score
         label = f"{self.class_names[class_id]}: {score:.2f}"
 
-        # Calculate the dimensions of the label text
-        (label_width, label_height), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 1.2, 1)
+        # The label is rendered once with its background, plus a 10 pixel border above and below, and reused
+        style = dict(font_scale=1.2, thickness=1, text_color=(0, 0, 0), background_color=(0, 0, 255), padding=(0, 10, 0, 10))
+        _, label_height = self.overlay.text_size(label, **style)
 
         # Calculate the position of the label text; this is the bottom-left corner of the text string
         label_x = x1
         label_y = y1 - 10 if y1 - 10 > label_height else y1 + 20
 
-        # Draw a filled rectangle as the background for the label text, plus a 10 pixel border above and below
-        cv2.rectangle(img, (label_x, label_y - label_height - 10), (label_x + label_width, label_y + 10), (0,0,255), cv2.FILLED)
-
-         # Draw the label text on the image
-        cv2.putText(img, label, (label_x, label_y), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 0, 0), 1, cv2.LINE_AA)
+        # Draw the label text on its background
+        self.overlay.label(img, label, (label_x, label_y), **style)
 
     def draw_fps(self, img):
 
         # Create an array of strings - one for each line of text to display on the image
         label_array = [f"FPS: {self.total_fps:.02f}",
                        f"FPS (inference): {self.inference_fps:.02f}",
+                       f"Skipped frames: {self.skip_ratio():.0%}",
                        f"Input: {self.img_width}x{self.img_height}",
-                       f"Inferencing: {self.input_width}x{self.input_height}",
+                       f"Inferencing: {self.input_width}x{self.input_height}" + (f" x {self.tile_count} tiles" if self.tile_count != 1 else ""),
                        f"Model: {self.model_name}"]
         
-        # Define the font style and size
-        font_scale = 1.0
-        font_face = cv2.FONT_HERSHEY_SIMPLEX
-        font_thickness = 1
-        background_color = (0,0,255)    # red
-        font_color = (0, 0, 0)          # black
+        # Define the font style and size: black text on red, with a border on all sides
         pixel_border = 10
+        style = dict(font_scale=1.0, thickness=1, text_color=(0, 0, 0), background_color=(0, 0, 255), padding=(pixel_border,) * 4)
 
         # Define the starting position for the text (30 pixels from the top left corner)
         (label_x, label_y) = (30, 30)
@@ -187,53 +253,9 @@ class YOLOv8OVMS:
         # Loop through each line of text in the label array and draw it on the image
         for label in label_array:
             # Calculate the dimensions of the label text
-            (label_width, label_height), _ = cv2.getTextSize(label, font_face, font_scale, font_thickness)
-            self.log(f"Label: {label}, Width: {label_width}, Height: {label_height}")
+            _, label_height = self.overlay.text_size(label, **style)
 
-            # Draw a filled rectangle as the background for the label text, including a border on all sides
-            # Draw the label text on the image
+            # Draw the label text on its background, rendered once per distinct text
             # Update the starting position for the next line, including a pixel_border pixel margin between lines
-            cv2.rectangle(img, (label_x - pixel_border, label_y - pixel_border), (label_x + label_width + pixel_border, label_y + label_height + pixel_border), background_color, cv2.FILLED)
-            cv2.putText(img, label, (label_x, label_y + label_height), font_face, font_scale, font_color, font_thickness, cv2.LINE_AA)
+            self.overlay.label(img, label, (label_x, label_y + label_height), **style)
             label_y += (label_height + 2 * pixel_border)
-
-    def run(self):
-        self.log("Running detection...")
-
-        self.frame_number += 1
-        # If mod = 0, i will get the frame and skip it
-        if ((self.skip_rate > 0) and (self.frame_number % self.skip_rate == 0)):
-            self.cap.read()
-            return None
-        
-        # Pre-process the image
-        # Perform inference on the preprocessed image; capture the start and end times
-        # Post-processing including drawing bounding boxes
-        image_data = self.preprocess()
-        time1 = time.time()
-        outputs = self.grpc_client.predict({"images": image_data}, self.model_name)
-        time2 = time.time()
-        frame = self.postprocess(self.cap.read()[1], outputs)
-
-        # Update metrics used for FPS calculations
-        self.total_inference_time += (time2 - time1)
-        self.total_frames += 1
-
-        # Calculate FPS for both the inferencing step and the final feed  
-        self.inference_fps = self.total_frames / self.total_inference_time
-        self.total_fps = self.total_frames / (time.time() - self.start_time)    # This includes e.g. JPEG encoding in the parent method outside of self.run()
-        self.log(f"FPS={self.total_fps} Inference={self.inference_fps:.03f} ({self.total_frames} frames)")
-
-        return frame
-
-    def log(self, message):
-        """Logs a message with a timestamp if verbose is true."""
-        if self.verbose:
-            timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            print(f"{timestamp} - {message}")
-
-    def __del__(self):
-        print("Releasing resources...")
-        self.cap.release()
-        cv2.destroyAllWindows()
-        print("Released video capture and destroyed all windows.")
\ No newline at end of file
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 from importlib import import_module
 import os
+import subprocess
 import cv2
 from flask import Flask, render_template, Response, request, session, redirect, url_for, jsonify
 from flask_session import Session
@@ -237,17 +238,70 @@ def addPurchase():
 
 @app.route('/video_feed/<feed>')
 def video_feed(feed):
+    # ?format=fmp4 streams the camera as fragmented MP4 instead of MJPEG
+    if request.args.get('format', 'mjpeg') == 'fmp4':
+        return Response(gen_fmp4(feed), mimetype='video/mp4')
     return Response(gen_frames(feed),
                     mimetype='multipart/x-mixed-replace; boundary=frame')
 
 
-def gen_frames(source):
-    """Video streaming frame capture function."""
+def camera_url(source):
+    """Returns the RTSP URL of a camera feed."""
     baseUrl = "rtsp://localhost:554/media/" 
     if os.environ.get('CAMERAS_BASEURL'):
         baseUrl = str(os.environ['CAMERAS_BASEURL'])
+    return baseUrl + source
+
+
+camera_codecs = {}  # Video codec of every camera feed probed so far
+
+
+def camera_codec(source):
+    """Returns the video codec of a camera feed as named by FFmpeg, e.g. "h264", or None if it could not be probed."""
+    if source not in camera_codecs:
+        try:
+            probe = subprocess.run([
+                os.environ.get('FFPROBE_PATH', 'ffprobe'), '-v', 'error', '-rtsp_transport', 'tcp', '-i', camera_url(source),
+                '-select_streams', 'v:0', '-show_entries', 'stream=codec_name', '-of', 'csv=p=0'],
+                capture_output=True, text=True, timeout=10)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            print(f"Error probing the codec of {source}: {e}")
+            return None
+        codec = probe.stdout.strip()
+        if not codec:
+            return None
+        camera_codecs[source] = codec
+    return camera_codecs[source]
+
+
+def gen_fmp4(source):
+    """Video streaming function streaming the camera as H.264 fragmented MP4."""
+    # H.264 cameras are copied without decoding or re-encoding; other codecs, or a codec that
+    # could not be probed, are transcoded since browsers only play H.264 in MP4 reliably
+    if camera_codec(source) == 'h264':
+        video_codec = ['-c:v', 'copy']
+    else:
+        video_codec = ['-c:v', 'libx264', '-preset', 'ultrafast', '-tune', 'zerolatency', '-pix_fmt', 'yuv420p']
+    # One fragment per frame for low latency
+    ffmpeg = subprocess.Popen([
+        os.environ.get('FFMPEG_PATH', 'ffmpeg'), '-hide_banner', '-loglevel', 'error',
+        '-rtsp_transport', 'tcp', '-i', camera_url(source),
+        '-an'] + video_codec + ['-f', 'mp4', '-movflags', 'empty_moov+default_base_moof+frag_every_frame', 'pipe:1'],
+        stdout=subprocess.PIPE, bufsize=0)
+    try:
+        while True:
+            chunk = ffmpeg.stdout.read(65536)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        ffmpeg.kill()
+        ffmpeg.wait()
 
-    cap = cv2.VideoCapture(baseUrl + source)  # capture the video from the live feed
+
+def gen_frames(source):
+    """Video streaming frame capture function."""
+    cap = cv2.VideoCapture(camera_url(source))  # capture the video from the live feed
 
     while True:
         # # Capture frame-by-frame. Return boolean(True=frame read correctly. )